@@ -1,10 +1,16 @@
+import hmac
 import os
-from flask import Flask, send_from_directory, send_file
+import threading
+import time
+from flask import Flask, Response, request, send_from_directory
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 from config import get_settings
-from routes import auth_bp, song_bp, payment_bp
-from pathlib import Path
+from routes import auth_bp, song_bp, payment_bp, storage_bp, admin_bp
+from tasks import BackgroundTaskProcessor
+from services.music_generator import MusicGenerator
+from services.metrics import REGISTRY
+from services.profiling import install_request_profiling
 
 
 def create_app():
@@ -14,6 +20,16 @@ def create_app():
     
     app.config["SECRET_KEY"] = settings.secret_key
     app.config["JWT_SECRET_KEY"] = settings.jwt_secret_key
+    # Only the stream routes take a token in the URL, see require_stream_auth
+    app.config["JWT_TOKEN_LOCATION"] = ["headers"]
+    # Let Apache/lighttpd send /storage files instead of the Python worker
+    app.config["USE_X_SENDFILE"] = settings.storage_x_sendfile
+    
+    if settings.trusted_proxy_count:
+        # Take the client address from X-Forwarded-For, so login rate limits
+        # apply per client rather than to the proxy
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=settings.trusted_proxy_count)
     
     CORS(app, resources={r"/api/*": {"origins": "*"}})
     
@@ -22,6 +38,20 @@ def create_app():
     app.register_blueprint(auth_bp)
     app.register_blueprint(song_bp)
     app.register_blueprint(payment_bp)
+    app.register_blueprint(storage_bp)
+    app.register_blueprint(admin_bp)
+    
+    if settings.profiling_enabled and settings.admin_token:
+        install_request_profiling(app)
+    
+    if settings.model_warmup:
+        # Warm up in the background so /health can report progress
+        threading.Thread(target=_warm_up_model, daemon=True).start()
+    
+    if settings.recover_pending_songs or settings.generation_lease_seconds > 0:
+        # Off the startup path, so the worker can take requests before the
+        # database client has been created
+        threading.Thread(target=_recover_pending_songs, daemon=True).start()
     
     @app.route("/")
     @app.route("/<path:path>")
@@ -32,24 +62,62 @@ def create_app():
     
     @app.route("/health")
     def health_check():
+        model_state = MusicGenerator().state
+        # With warm-up enabled, hold traffic until the model is hot
+        ready = model_state == "ready" or not settings.model_warmup
         return {
-            "status": "healthy",
+            "status": "healthy" if ready else "starting",
+            "model": model_state,
             "storage": "local" if settings.use_local_storage else "gcs",
             "payment": "enabled" if settings.stripe_enabled else "disabled"
-        }, 200
+        }, 200 if ready else 503
     
-    @app.route("/storage/<path:filepath>")
-    def serve_storage(filepath):
-        storage_path = Path(settings.local_storage_path)
-        file_path = storage_path / filepath
-
-        if file_path.is_file():
-            return send_file(file_path, mimetype="audio/wav")
-        return {"error": "File not found", "path": str(file_path)}, 404
+    @app.route("/metrics")
+    def metrics():
+        """Metrics of this process in the Prometheus text format."""
+        if not settings.metrics_enabled:
+            return {"error": "Not found"}, 404
+        
+        if settings.metrics_token:
+            expected = f"Bearer {settings.metrics_token}"
+            if not hmac.compare_digest(request.headers.get("Authorization", ""), expected):
+                return {"error": "Unauthorized"}, 401
+        
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
     
     return app
 
 
+def _warm_up_model():
+    try:
+        MusicGenerator().warm_up()
+    except Exception as e:
+        print(f"WARNING: model warm-up failed: {e}")
+
+
+def _recover_pending_songs():
+    # Pending songs once at startup (RECOVER_PENDING_SONGS); songs whose lease
+    # expired after their process died, every half lease for as long as the
+    # process runs
+    settings = get_settings()
+    lease = settings.generation_lease_seconds
+    stale_only = not settings.recover_pending_songs
+    if stale_only:
+        time.sleep(lease / 2)
+    while True:
+        try:
+            queued = BackgroundTaskProcessor.recover_pending_songs(stale_only=stale_only)
+            if queued:
+                print(f"Re-queued {queued} pending or abandoned song(s)")
+        except Exception as e:
+            print(f"WARNING: could not recover pending songs: {e}")
+        
+        if lease <= 0:
+            return
+        stale_only = True
+        time.sleep(lease / 2)
+
+
 if __name__ == "__main__":
     app = create_app()
     app.run(host="0.0.0.0", port=80, debug=True)
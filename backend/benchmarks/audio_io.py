@@ -0,0 +1,81 @@
+"""Disk I/O and latency of handing generated audio to storage.
+
+Run from the backend directory:
+
+    python -m benchmarks.audio_io --max-tokens 256 1024 4096 --rounds 20
+
+Audio is synthesized once per length, then each round encodes it and
+stores it as a song would be stored, either through a temp WAV file
+(``MusicGenerator.generate`` + ``StorageService.upload_file``) or from
+memory (``generate_audio`` + ``upload_audio``). Uses the storage backend
+configured in .env. Bytes read and written are taken from /proc/self/io and
+include the write to local storage itself, so the difference between the two
+rows is the temp file round trip.
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import scipy
+
+from services.music_generator import MusicGenerator
+from services.storage import StorageService
+
+PROMPT = "lo-fi hip hop beat with warm piano"
+
+
+def io_counters():
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError):
+        return 0, 0
+
+
+def via_temp_file(storage, audio, sampling_rate, blob_name):
+    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_file:
+        scipy.io.wavfile.write(tmp_file.name, rate=sampling_rate, data=audio)
+    storage.upload_file(tmp_file.name, blob_name)
+    os.remove(tmp_file.name)
+
+
+def in_memory(storage, audio, sampling_rate, blob_name):
+    buffer = io.BytesIO()
+    scipy.io.wavfile.write(buffer, rate=sampling_rate, data=audio)
+    storage.upload_buffer(buffer, blob_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-tokens", type=int, nargs="+", default=[256, 1024, 4096])
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    generator = MusicGenerator()
+    storage = StorageService()
+    blob_name = "benchmarks/audio_io.wav"
+
+    print(f"{'tokens':>6} {'path':>9} {'ms/song':>9} {'read KiB':>10} {'write KiB':>10}")
+    for max_tokens in args.max_tokens:
+        audio, sampling_rate = generator._synthesize(PROMPT, max_tokens)
+
+        for name, store in (("temp file", via_temp_file), ("memory", in_memory)):
+            read_before, write_before = io_counters()
+            start = time.perf_counter()
+            for _ in range(args.rounds):
+                store(storage, audio, sampling_rate, blob_name)
+            per_song = (time.perf_counter() - start) * 1000 / args.rounds
+            read_after, write_after = io_counters()
+
+            read_kib = (read_after - read_before) / args.rounds / 1024
+            write_kib = (write_after - write_before) / args.rounds / 1024
+            print(f"{max_tokens:>6} {name:>9} {per_song:>9.2f} {read_kib:>10.0f} {write_kib:>10.0f}")
+
+    storage.delete_file(blob_name)
+
+
+if __name__ == "__main__":
+    main()
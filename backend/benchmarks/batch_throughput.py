@@ -0,0 +1,59 @@
+"""Throughput of MusicGen inference by batch size.
+
+Run from the backend directory:
+
+    python -m benchmarks.batch_throughput --batch-sizes 1 2 4 8 --max-tokens 256
+
+For each batch size, runs ``--rounds`` padded ``generate`` calls and reports
+seconds per batch, songs per minute and the speedup over the first batch
+size given (the serial baseline with the defaults).
+"""
+import argparse
+import time
+
+from services.music_generator import MusicGenerator
+
+PROMPTS = [
+    "lo-fi hip hop beat with warm piano",
+    "epic orchestral trailer music with drums",
+    "upbeat 80s synthwave with arpeggios",
+    "acoustic folk guitar, gentle and calm",
+    "fast jazz trio with walking bass",
+    "ambient pad drone, slow and evolving",
+    "reggae groove with offbeat guitar",
+    "heavy metal riff with double kick drums",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    generator = MusicGenerator()
+    generator._ensure_loaded()
+    if generator._model == "mock":
+        raise SystemExit("transformers is not installed; install requirements-ml.txt to benchmark the model")
+
+    # Warm up kernels so the first batch size is not penalised
+    generator._generate_batch(PROMPTS[:1], 16)
+
+    baseline = None
+    print(f"{'batch':>5} {'s/batch':>9} {'songs/min':>10} {'speedup':>8}")
+    for batch_size in args.batch_sizes:
+        prompts = [PROMPTS[i % len(PROMPTS)] for i in range(batch_size)]
+
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            generator._generate_batch(prompts, args.max_tokens)
+        per_batch = (time.perf_counter() - start) / args.rounds
+
+        songs_per_min = batch_size * 60.0 / per_batch
+        baseline = baseline or songs_per_min
+        print(f"{batch_size:>5} {per_batch:>9.2f} {songs_per_min:>10.2f} {songs_per_min / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,451 @@
+"""Latency and throughput of the whole song pipeline, without Supabase or GCS.
+
+Run from the backend directory:
+
+    python -m benchmarks.end_to_end --scenario users --clients 8 --songs 5
+    python -m benchmarks.end_to_end --output before.json
+    python -m benchmarks.end_to_end --compare before.json
+
+Runs the app in this process and drives it through Flask test clients, one
+per simulated client thread. The database and the GCS bucket are replaced
+by the in-memory stand-ins of benchmarks/local_backends.py, which wait
+``--db-latency-ms`` and ``--gcs-latency-ms`` per call, and the model by
+``MUSICGEN_MODEL=mock``, which makes synthetic audio in ``--ms-per-token``
+per token. Everything in between runs for real: routes, SongService, the
+generation queue, status writer, upload pool, generation cache and encoders.
+
+Scenarios (``--scenario all`` runs them one after another):
+
+    users      --clients signed-in users each create --songs songs in turn,
+               polling GET /api/songs/<id> every --poll-interval until done
+    anonymous  --clients anonymous requests arrive at once, --songs each,
+               each followed with GET /api/songs/anonymous/<id>?wait=
+    polling    --clients users with --seed-songs songs each poll their song
+               list with If-None-Match for --duration seconds
+
+Reports p50/p95/p99 per endpoint, of songs from the POST until the client
+sees them finished, and songs per minute. Settings the benchmark does not
+set (GENERATION_WORKERS, GENERATION_BATCH_SIZE, STATUS_FLUSH_INTERVAL_MS,
+AUDIO_OUTPUT_FORMATS, ...) are read from the environment as usual and saved
+in the report. ``--output`` writes the report as JSON, and ``--compare``
+prints the change against one saved on another commit.
+
+Clients and workers share one interpreter, and requests skip the WSGI
+server and network, so compare runs on the same machine and settings
+rather than reading the numbers as production latencies.
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import math
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional
+
+PERCENTILES = (50, 95, 99)
+SCENARIOS = ("users", "anonymous", "polling")
+FINISHED = ("completed", "failed")
+RECORDED_SETTINGS = (
+    "generation_workers",
+    "generation_queue_size",
+    "generation_batch_size",
+    "storage_upload_workers",
+    "status_flush_interval_ms",
+    "encoding_workers",
+    "audio_output_formats",
+    "generation_cache_enabled",
+    "gcs_delivery",
+)
+PROMPTS = [
+    "lo-fi hip hop beat with warm piano",
+    "epic orchestral trailer music with drums",
+    "upbeat 80s synthwave with arpeggios",
+    "acoustic folk guitar, gentle and calm",
+    "fast jazz trio with walking bass",
+    "ambient pad drone, slow and evolving",
+]
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    rank = math.ceil(p / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+class Recorder:
+    """Latency samples and counts of one scenario, from many threads."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def request(self, client, name: str, method: str, url: str, **kwargs):
+        """Send one request through the test client and time it under name."""
+        start = time.perf_counter()
+        response = client.open(url, method=method, **kwargs)
+        self.observe(name, time.perf_counter() - start)
+        self.count(f"{name} {response.status_code}")
+        return response
+
+    def latencies(self) -> Dict[str, dict]:
+        summary = {}
+        for name, values in sorted(self.samples.items()):
+            values = sorted(values)
+            summary[name] = {
+                "count": len(values),
+                "mean_ms": sum(values) / len(values) * 1000,
+                **{f"p{p}_ms": percentile(values, p) * 1000 for p in PERCENTILES},
+                "max_ms": values[-1] * 1000,
+            }
+        return summary
+
+
+def prompt_source(distinct: int):
+    """Prompts for new songs: all unique, or cycling through ``distinct``
+    prompts so that repeats hit the generation cache."""
+    if distinct <= 0:
+        return lambda: f"{PROMPTS[0]} #{uuid.uuid4().hex[:8]}"
+    cycle = itertools.cycle([f"{PROMPTS[i % len(PROMPTS)]} #{i}" for i in range(distinct)])
+    lock = threading.Lock()
+
+    def next_prompt() -> str:
+        with lock:
+            return next(cycle)
+    return next_prompt
+
+
+def configure_environment(args, directory: str) -> None:
+    """Point the settings at the stand-ins; must run before get_settings()."""
+    os.environ.update({
+        "MUSICGEN_MODEL": "mock",
+        "MOCK_GENERATION_MS_PER_TOKEN": str(args.ms_per_token),
+        "INFERENCE_SERVER_ADDRESS": "",
+        "MODEL_WARMUP": "false",
+        "RECOVER_PENDING_SONGS": "false",
+        "PROFILING_ENABLED": "false",
+        # Anonymous songs get the free tier's length
+        "FREE_USER_MAX_TOKENS": str(args.max_tokens),
+        "SUPABASE_URL": "http://supabase.invalid",
+        "SUPABASE_KEY": "benchmark",
+        "LOCAL_STORAGE_PATH": os.path.join(directory, "storage"),
+        "ANONYMOUS_JOB_PATH": os.path.join(directory, "jobs"),
+    })
+    if args.storage == "gcs":
+        # Only needs to look configured; no credentials are read
+        os.environ.update({
+            "GCS_BUCKET_NAME": "musicgen-benchmark",
+            "GCS_PROJECT_ID": "benchmark",
+            "GOOGLE_APPLICATION_CREDENTIALS": os.devnull,
+        })
+    else:
+        os.environ["GCS_BUCKET_NAME"] = ""
+    os.environ.setdefault("SECRET_KEY", secrets.token_hex(32))
+    os.environ.setdefault("JWT_SECRET_KEY", secrets.token_hex(32))
+
+
+def seed_users(app, database, count: int, max_tokens: int) -> List[dict]:
+    """Paid users allowed max_tokens per song, each with an access token."""
+    from flask_jwt_extended import create_access_token
+
+    rows = [{
+        "id": str(uuid.uuid4()),
+        "email": f"benchmark-{uuid.uuid4().hex[:12]}@example.com",
+        "password_hash": "-",
+        "first_name": "Bench",
+        "last_name": f"User {index}",
+        "is_paid": True,
+        "max_tokens": max_tokens,
+    } for index in range(count)]
+    database.seed("users", rows)
+
+    with app.app_context():
+        return [{
+            "id": row["id"],
+            "headers": {"Authorization": f"Bearer {create_access_token(identity=row['id'])}"},
+        } for row in rows]
+
+
+def run_clients(count: int, target) -> float:
+    """Run target(index) on count threads released together; returns the wall time."""
+    barrier = threading.Barrier(count + 1)
+
+    def run(index: int) -> None:
+        barrier.wait()
+        target(index)
+
+    threads = [threading.Thread(target=run, args=(index,), daemon=True) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def song_summary(recorder: Recorder, wall_seconds: float) -> dict:
+    completed = recorder.counts.get("completed", 0)
+    return {
+        "wall_seconds": wall_seconds,
+        "songs_completed": completed,
+        "songs_failed": recorder.counts.get("failed", 0),
+        "songs_per_minute": completed / wall_seconds * 60 if wall_seconds else 0.0,
+    }
+
+
+def scenario_users(app, database, args) -> dict:
+    users = seed_users(app, database, args.clients, args.max_tokens)
+    next_prompt = prompt_source(args.distinct_prompts)
+    recorder = Recorder()
+
+    def user(index: int) -> None:
+        client = app.test_client()
+        headers = users[index]["headers"]
+        for number in range(args.songs):
+            body = {"title": f"Song {number}", "prompt": next_prompt(), "max_tokens": args.max_tokens}
+            start = time.perf_counter()
+            while True:
+                response = recorder.request(client, "POST /api/songs", "POST", "/api/songs", json=body, headers=headers)
+                if response.status_code != 503:
+                    break
+                # Queue full: back off like a client honouring Retry-After
+                recorder.count("rejected")
+                time.sleep(min(float(response.headers.get("Retry-After", 1)), args.poll_interval * 4))
+            if response.status_code != 201:
+                recorder.count("errors")
+                continue
+
+            song = response.get_json()["song"]
+            while song["status"] not in FINISHED:
+                time.sleep(args.poll_interval)
+                response = recorder.request(client, "GET /api/songs/<id>", "GET", f"/api/songs/{song['id']}", headers=headers)
+                if response.status_code != 200:
+                    recorder.count("errors")
+                    break
+                song = response.get_json()["song"]
+            if song["status"] in FINISHED:
+                recorder.observe("song (POST to finished)", time.perf_counter() - start)
+                recorder.count(song["status"])
+
+    wall_seconds = run_clients(args.clients, user)
+    return {**song_summary(recorder, wall_seconds), "counts": recorder.counts, "latency": recorder.latencies()}
+
+
+def scenario_anonymous(app, database, args) -> dict:
+    next_prompt = prompt_source(args.distinct_prompts)
+    recorder = Recorder()
+
+    def visitor(index: int) -> None:
+        client = app.test_client()
+        for _ in range(args.songs):
+            start = time.perf_counter()
+            response = recorder.request(
+                client, "POST /api/songs/anonymous", "POST", "/api/songs/anonymous", json={"prompt": next_prompt()})
+            if response.status_code == 503:
+                recorder.count("rejected")
+                continue
+            if response.status_code not in (200, 202):
+                recorder.count("errors")
+                continue
+
+            job = response.get_json()["job"]
+            while job["status"] not in FINISHED:
+                response = recorder.request(
+                    client, "GET /api/songs/anonymous/<id>?wait", "GET",
+                    f"/api/songs/anonymous/{job['id']}?wait={args.poll_wait}")
+                if response.status_code != 200:
+                    recorder.count("errors")
+                    break
+                job = response.get_json()["job"]
+            if job["status"] in FINISHED:
+                recorder.observe("song (POST to finished)", time.perf_counter() - start)
+                recorder.count(job["status"])
+
+    wall_seconds = run_clients(args.clients, visitor)
+    return {**song_summary(recorder, wall_seconds), "counts": recorder.counts, "latency": recorder.latencies()}
+
+
+def scenario_polling(app, database, args) -> dict:
+    users = seed_users(app, database, args.clients, args.max_tokens)
+    bucket = os.environ.get("GCS_BUCKET_NAME") or "local"
+    for user in users:
+        database.seed("songs", [{
+            "user_id": user["id"],
+            "title": f"Seeded {number}",
+            "prompt": PROMPTS[number % len(PROMPTS)],
+            "max_tokens": args.max_tokens,
+            "status": "completed",
+            "gcs_url": f"https://storage.googleapis.com/{bucket}/seed-{uuid.uuid4().hex}.wav",
+        } for number in range(args.seed_songs)])
+    recorder = Recorder()
+
+    def poller(index: int) -> None:
+        client = app.test_client()
+        headers = dict(users[index]["headers"])
+        deadline = time.perf_counter() + args.duration
+        while time.perf_counter() < deadline:
+            response = recorder.request(client, "GET /api/songs", "GET", "/api/songs?limit=50", headers=headers)
+            if response.status_code == 200 and args.etag and response.headers.get("ETag"):
+                headers["If-None-Match"] = response.headers["ETag"]
+            time.sleep(args.poll_interval)
+
+    wall_seconds = run_clients(args.clients, poller)
+    requests = sum(len(values) for values in recorder.samples.values())
+    return {
+        "wall_seconds": wall_seconds,
+        "requests_per_second": requests / wall_seconds if wall_seconds else 0.0,
+        "counts": recorder.counts,
+        "latency": recorder.latencies(),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report: dict, baseline: Optional[dict]) -> None:
+    base_scenarios = (baseline or {}).get("scenarios", {})
+    if baseline:
+        print(f"compared with {baseline.get('commit') or 'baseline'} (in brackets: change from it)")
+
+    def change(value: float, base: Optional[float]) -> str:
+        if not base:
+            return ""
+        return f" [{(value - base) / base * 100:+.0f}%]"
+
+    for name, result in report["scenarios"].items():
+        base = base_scenarios.get(name, {})
+        print()
+        if "songs_per_minute" in result:
+            print(
+                f"{name}: {result['songs_completed']} songs completed, {result['songs_failed']} failed "
+                f"in {result['wall_seconds']:.1f}s, "
+                f"{result['songs_per_minute']:.1f} songs/min{change(result['songs_per_minute'], base.get('songs_per_minute'))}"
+            )
+        else:
+            print(
+                f"{name}: {result['requests_per_second']:.1f} requests/s in {result['wall_seconds']:.1f}s"
+                f"{change(result['requests_per_second'], base.get('requests_per_second'))}"
+            )
+        others = {key: value for key, value in result["counts"].items() if " " in key or key in ("rejected", "errors")}
+        if others:
+            print("  " + ", ".join(f"{key}: {value}" for key, value in sorted(others.items())))
+
+        print(f"  {'':<40} {'count':>6} " + " ".join(f"{f'p{p} ms':>16}" for p in PERCENTILES))
+        for metric, stats in result["latency"].items():
+            base_stats = base.get("latency", {}).get(metric, {})
+            cells = [
+                f"{stats[f'p{p}_ms']:.1f}{change(stats[f'p{p}_ms'], base_stats.get(f'p{p}_ms'))}"
+                for p in PERCENTILES
+            ]
+            print(f"  {metric:<40} {stats['count']:>6} " + " ".join(f"{cell:>16}" for cell in cells))
+
+    print()
+    print(f"database requests: {report['database_requests']}, GCS requests: {report['gcs_requests']}, "
+          f"db calls per song: {report['lifecycle'].get('db_calls_per_song')}")
+
+
+def run(args, directory: str) -> dict:
+    configure_environment(args, directory)
+
+    from app import create_app
+    from benchmarks.local_backends import install_local_backends
+    from config import get_settings
+    from tasks.background_processor import BackgroundTaskProcessor
+
+    settings = get_settings()
+    if args.max_tokens > settings.max_configurable_tokens:
+        raise SystemExit(f"--max-tokens is over MAX_CONFIGURABLE_TOKENS ({settings.max_configurable_tokens})")
+
+    database, gcs = install_local_backends(
+        db_latency_ms=args.db_latency_ms,
+        gcs_latency_ms=args.gcs_latency_ms if args.storage == "gcs" else None,
+        gcs_megabytes_per_second=args.gcs_mbps,
+    )
+    app = create_app()
+
+    scenarios = {
+        "users": scenario_users,
+        "anonymous": scenario_anonymous,
+        "polling": scenario_polling,
+    }
+    names = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    results = {}
+    for name in names:
+        print(f"running {name}...", file=sys.stderr)
+        results[name] = scenarios[name](app, database, args)
+
+    return {
+        "commit": git_commit(),
+        "options": {key: value for key, value in vars(args).items() if key not in ("json", "output", "compare")},
+        "settings": {name: getattr(settings, name) for name in RECORDED_SETTINGS},
+        "scenarios": results,
+        "database_requests": database.requests,
+        "gcs_requests": gcs.requests if gcs else None,
+        "lifecycle": BackgroundTaskProcessor.lifecycle_stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent users or anonymous visitors")
+    parser.add_argument("--songs", type=int, default=4, help="songs per client")
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--ms-per-token", type=float, default=2.0, help="synthetic model time per token")
+    parser.add_argument("--distinct-prompts", type=int, default=0, help="reuse this many prompts (0: every prompt is new)")
+    parser.add_argument("--db-latency-ms", type=float, default=5.0, help="round trip of each database request")
+    parser.add_argument("--storage", choices=("gcs", "local"), default="gcs", help="fake GCS bucket or local files")
+    parser.add_argument("--gcs-latency-ms", type=float, default=30.0, help="round trip of each GCS call")
+    parser.add_argument("--gcs-mbps", type=float, default=100.0, help="GCS transfer rate in MB/s (0: unlimited)")
+    parser.add_argument("--poll-interval", type=float, default=0.25, help="seconds between polls")
+    parser.add_argument("--poll-wait", type=float, default=10.0, help="?wait= of anonymous job polls")
+    parser.add_argument("--seed-songs", type=int, default=100, help="songs per user in the polling scenario")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of the polling scenario")
+    parser.add_argument("--no-etag", dest="etag", action="store_false", help="poll the song list without If-None-Match")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--output", help="also write the report as JSON to this file")
+    parser.add_argument("--compare", help="a report saved with --output to compare against")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    # The app prints its notices to stdout, which is kept for the report
+    with tempfile.TemporaryDirectory(prefix="musicgen-benchmark-") as directory, contextlib.redirect_stdout(sys.stderr):
+        report = run(args, directory)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,560 @@
+"""In-process stand-ins for Supabase and GCS, for benchmarks.
+
+``InMemorySupabase`` answers the query chains the services build through
+DatabaseService (select/insert/update/delete with eq, neq, gt, gte, lt, lte,
+in_, or_, order and limit, ``count="exact"``) and the ``update_songs``
+function from db/schema.sql. ``FakeGcsClient`` keeps blobs in a dict and
+implements the bucket, blob and batch calls StorageService makes.
+
+Each database request and each GCS call sleeps for a configurable latency
+before it runs, standing in for the network round trip, and uploads and
+downloads also pay for their size at ``megabytes_per_second``. Database
+requests are recorded in ``musicgen_db_request_seconds`` like the real
+client's.
+
+``install_local_backends`` puts them behind the service container, so the
+routes, services and background workers run unchanged on top of them.
+"""
+import copy
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import quote
+
+from config import get_settings
+from services.database import DatabaseService
+from services.metrics import DB_REQUEST_SECONDS
+from services.storage import StorageService, signed_delivery_enabled
+
+# Column defaults from db/schema.sql
+DEFAULTS = {
+    "users": {"is_paid": False, "stripe_customer_id": None, "max_tokens": 256},
+    "songs": {"description": None, "status": "pending", "gcs_url": None, "audio_formats": {}, "error_message": None, "lease_expires_at": None},
+}
+# Columns looked up by equality often enough to keep an index on
+INDEXED_COLUMNS = ("id", "user_id", "email")
+HTTP_METHODS = {"select": "GET", "insert": "POST", "update": "PATCH", "delete": "DELETE"}
+
+
+def _now() -> str:
+    # The format the services write timestamps in
+    return datetime.utcnow().isoformat()
+
+
+def _text(value: Any) -> Optional[str]:
+    """A value as PostgREST compares it."""
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _split(expression: str) -> List[str]:
+    """Split a PostgREST logic expression at its top-level commas."""
+    parts, depth, quoted, current = [], 0, False, []
+    for char in expression:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == ",":
+            parts.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    parts.append("".join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _unquote(value: str) -> str:
+    return value[1:-1] if len(value) >= 2 and value[0] == value[-1] == '"' else value
+
+
+def _condition(column: str, operator: str, value: Any) -> Callable[[dict], bool]:
+    if operator == "in":
+        values = {_text(item) for item in value}
+        return lambda row: _text(row.get(column)) in values
+    if operator == "is":
+        expected = None if _text(value) == "null" else _text(value)
+        return lambda row: _text(row.get(column)) == expected
+
+    expected = _text(value)
+    compare = {
+        "eq": lambda actual: actual == expected,
+        "neq": lambda actual: actual != expected,
+        "gt": lambda actual: actual > expected,
+        "gte": lambda actual: actual >= expected,
+        "lt": lambda actual: actual < expected,
+        "lte": lambda actual: actual <= expected,
+    }.get(operator)
+    if compare is None:
+        raise ValueError(f"Unsupported filter operator: {operator}")
+
+    def condition(row: dict) -> bool:
+        actual = _text(row.get(column))
+        return actual is not None and compare(actual)
+    return condition
+
+
+def _parse_logic(expression: str) -> Callable[[dict], bool]:
+    """A row predicate for one term of an or_() expression."""
+    for combinator, combine in (("and(", all), ("or(", any)):
+        if expression.startswith(combinator) and expression.endswith(")"):
+            terms = [_parse_logic(term) for term in _split(expression[len(combinator):-1])]
+            return lambda row: combine(term(row) for term in terms)
+
+    column, operator, value = expression.split(".", 2)
+    if operator == "in":
+        value = [_unquote(item) for item in _split(value.strip("()"))]
+    else:
+        value = _unquote(value)
+    return _condition(column, operator, value)
+
+
+class Table:
+    """Rows of one table by id, with equality indexes on INDEXED_COLUMNS."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.rows: Dict[str, dict] = {}
+        self.indexes: Dict[str, Dict[str, set]] = {column: {} for column in INDEXED_COLUMNS}
+
+    def add(self, row: dict) -> None:
+        self.rows[row["id"]] = row
+        self._index(row, add=True)
+
+    def remove(self, row: dict) -> None:
+        del self.rows[row["id"]]
+        self._index(row, add=False)
+
+    def update(self, row: dict, changes: dict) -> None:
+        self._index(row, add=False)
+        row.update(changes)
+        self._index(row, add=True)
+
+    def _index(self, row: dict, add: bool) -> None:
+        for column, index in self.indexes.items():
+            value = _text(row.get(column))
+            if value is None:
+                continue
+            ids = index.setdefault(value, set())
+            if add:
+                ids.add(row["id"])
+            else:
+                ids.discard(row["id"])
+                if not ids:
+                    del index[value]
+
+    def candidates(self, equalities: Dict[str, str]) -> List[dict]:
+        """Rows that may match, narrowed by the most selective indexed equality."""
+        best = None
+        for column, value in equalities.items():
+            if column in self.indexes:
+                ids = self.indexes[column].get(value, set())
+                if best is None or len(ids) < len(best):
+                    best = ids
+        if best is None:
+            return list(self.rows.values())
+        return [self.rows[row_id] for row_id in best]
+
+
+class Query:
+    """One request under construction, like postgrest's request builders."""
+
+    def __init__(self, database: "InMemorySupabase", table: str, operation: str, payload: Any = None, columns: str = "*", count: Optional[str] = None):
+        self.database = database
+        self.table = table
+        self.operation = operation
+        self.payload = payload
+        self.columns = columns
+        self.count = count
+        self.filters: List[Callable[[dict], bool]] = []
+        self.equalities: Dict[str, str] = {}
+        self.orders: List[tuple] = []
+        self.row_limit: Optional[int] = None
+
+    def _filter(self, column: str, operator: str, value: Any) -> "Query":
+        if operator == "eq":
+            self.equalities[column] = _text(value)
+        self.filters.append(_condition(column, operator, value))
+        return self
+
+    def eq(self, column: str, value: Any) -> "Query":
+        return self._filter(column, "eq", value)
+
+    def neq(self, column: str, value: Any) -> "Query":
+        return self._filter(column, "neq", value)
+
+    def gt(self, column: str, value: Any) -> "Query":
+        return self._filter(column, "gt", value)
+
+    def gte(self, column: str, value: Any) -> "Query":
+        return self._filter(column, "gte", value)
+
+    def lt(self, column: str, value: Any) -> "Query":
+        return self._filter(column, "lt", value)
+
+    def lte(self, column: str, value: Any) -> "Query":
+        return self._filter(column, "lte", value)
+
+    def in_(self, column: str, values: List[Any]) -> "Query":
+        return self._filter(column, "in", values)
+
+    def or_(self, filters: str) -> "Query":
+        terms = [_parse_logic(term) for term in _split(filters)]
+        self.filters.append(lambda row: any(term(row) for term in terms))
+        return self
+
+    def order(self, column: str, desc: bool = False) -> "Query":
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, size: int) -> "Query":
+        self.row_limit = size
+        return self
+
+    def execute(self):
+        return self.database._execute(self)
+
+
+class TableBuilder:
+    def __init__(self, database: "InMemorySupabase", table: str):
+        self.database = database
+        self.table = table
+
+    def select(self, columns: str = "*", count: Optional[str] = None) -> Query:
+        return Query(self.database, self.table, "select", columns=columns, count=count)
+
+    def insert(self, data: Any) -> Query:
+        return Query(self.database, self.table, "insert", payload=data)
+
+    def update(self, data: dict) -> Query:
+        return Query(self.database, self.table, "update", payload=data)
+
+    def delete(self) -> Query:
+        return Query(self.database, self.table, "delete")
+
+
+class RpcCall:
+    def __init__(self, database: "InMemorySupabase", function: str, params: dict):
+        self.database = database
+        self.function = function
+        self.params = params
+
+    def execute(self):
+        return self.database._call(self.function, self.params)
+
+
+class InMemorySupabase:
+    """The part of the Supabase client the services use, held in dicts.
+
+    Requests are applied atomically under one lock, after sleeping
+    ``latency_ms`` outside it.
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_seconds = latency_ms / 1000.0
+        self.tables: Dict[str, Table] = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def table(self, name: str) -> TableBuilder:
+        return TableBuilder(self, name)
+
+    def rpc(self, function: str, params: dict) -> RpcCall:
+        return RpcCall(self, function, params)
+
+    def seed(self, table: str, rows: List[dict]) -> None:
+        """Insert rows directly, without latency or metrics."""
+        with self._lock:
+            for row in rows:
+                self._table(table).add(self._new_row(table, row))
+
+    def _table(self, name: str) -> Table:
+        table = self.tables.get(name)
+        if table is None:
+            table = self.tables[name] = Table(name)
+        return table
+
+    @staticmethod
+    def _new_row(table: str, data: dict) -> dict:
+        now = _now()
+        row = {"id": str(uuid.uuid4()), **copy.deepcopy(DEFAULTS.get(table, {})), "created_at": now, "updated_at": now}
+        row.update(copy.deepcopy(data))
+        return row
+
+    @contextmanager
+    def _request(self, method: str, name: str):
+        start = time.perf_counter()
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        try:
+            with self._lock:
+                self.requests += 1
+                yield
+        finally:
+            DB_REQUEST_SECONDS.observe(time.perf_counter() - start, (method, name))
+
+    def _execute(self, query: Query):
+        with self._request(HTTP_METHODS[query.operation], query.table):
+            table = self._table(query.table)
+
+            if query.operation == "insert":
+                items = query.payload if isinstance(query.payload, list) else [query.payload]
+                rows = [self._new_row(query.table, item) for item in items]
+                for row in rows:
+                    table.add(row)
+                return SimpleNamespace(data=copy.deepcopy(rows), count=None)
+
+            rows = [
+                row for row in table.candidates(query.equalities)
+                if all(condition(row) for condition in query.filters)
+            ]
+
+            if query.operation == "update":
+                for row in rows:
+                    table.update(row, copy.deepcopy(query.payload))
+                return SimpleNamespace(data=copy.deepcopy(rows), count=None)
+
+            if query.operation == "delete":
+                for row in rows:
+                    table.remove(row)
+                return SimpleNamespace(data=rows, count=None)
+
+            total = len(rows)
+            # Stable sorts from the last key to the first, nulls last
+            for column, desc in reversed(query.orders):
+                present = [row for row in rows if row.get(column) is not None]
+                missing = [row for row in rows if row.get(column) is None]
+                rows = sorted(present, key=lambda row: _text(row[column]), reverse=desc) + missing
+            if query.row_limit is not None:
+                rows = rows[:query.row_limit]
+            if query.columns.strip() != "*":
+                columns = [column.strip() for column in query.columns.split(",")]
+                rows = [{column: row.get(column) for column in columns} for row in rows]
+            return SimpleNamespace(data=copy.deepcopy(rows), count=total if query.count else None)
+
+    def _call(self, function: str, params: dict):
+        if function != "update_songs":
+            raise ValueError(f"Unknown database function: {function}")
+
+        with self._request("POST", function):
+            table = self._table("songs")
+            updated = []
+            for update in params["updates"]:
+                row = table.rows.get(str(update["id"]))
+                if row is None:
+                    continue
+                # COALESCE: fields left out keep their value
+                changes = {
+                    column: copy.deepcopy(update[column])
+                    for column in ("status", "gcs_url", "audio_formats", "error_message")
+                    if update.get(column) is not None
+                }
+                changes["updated_at"] = update.get("updated_at") or _now()
+                table.update(row, changes)
+                updated.append(copy.deepcopy(row))
+            return SimpleNamespace(data=updated, count=None)
+
+
+class InMemoryDatabaseService(DatabaseService):
+    def __init__(self, client: InMemorySupabase):
+        self.client = client
+
+
+class FakeBlob:
+    def __init__(self, bucket: "FakeBucket", name: str, chunk_size: Optional[int] = None):
+        self.bucket = bucket
+        self.name = name
+        self.chunk_size = chunk_size
+
+    @property
+    def public_url(self) -> str:
+        return f"https://storage.googleapis.com/{self.bucket.name}/{quote(self.name)}"
+
+    @property
+    def size(self) -> Optional[int]:
+        stored = self.bucket.blobs.get(self.name)
+        return len(stored[0]) if stored else None
+
+    @property
+    def time_created(self) -> Optional[datetime]:
+        return self.bucket.created.get(self.name)
+
+    def _store(self, data: bytes, content_type: Optional[str]) -> None:
+        self.bucket.client._wait(len(data))
+        with self.bucket._lock:
+            self.bucket.blobs[self.name] = (data, content_type)
+            self.bucket.created[self.name] = datetime.now(timezone.utc)
+
+    def upload_from_filename(self, filename: str, content_type: Optional[str] = None, retry=None) -> None:
+        with open(filename, "rb") as f:
+            self._store(f.read(), content_type)
+
+    def upload_from_string(self, data, content_type: str = "text/plain", retry=None) -> None:
+        self._store(data.encode("utf-8") if isinstance(data, str) else bytes(data), content_type)
+
+    def upload_from_file(self, file_obj, rewind: bool = False, content_type: Optional[str] = None, retry=None) -> None:
+        if rewind:
+            file_obj.seek(0)
+        self._store(file_obj.read(), content_type)
+
+    def download_as_bytes(self, retry=None) -> bytes:
+        with self.bucket._lock:
+            stored = self.bucket.blobs.get(self.name)
+        if stored is None:
+            self.bucket.client._wait()
+            raise FileNotFoundError(f"No such object: {self.bucket.name}/{self.name}")
+        self.bucket.client._wait(len(stored[0]))
+        return stored[0]
+
+    def make_public(self) -> None:
+        self.bucket.client._wait()
+
+    def delete(self, retry=None) -> None:
+        client = self.bucket.client
+        batch = client._current_batch()
+        if batch is None:
+            client._wait()
+        with self.bucket._lock:
+            found = self.bucket.blobs.pop(self.name, None) is not None
+            self.bucket.created.pop(self.name, None)
+        if batch is not None:
+            if not found:
+                batch.missing.append(self.name)
+        elif not found:
+            raise FileNotFoundError(f"No such object: {self.bucket.name}/{self.name}")
+
+    def generate_signed_url(self, version: str = "v4", expiration=None, method: str = "GET") -> str:
+        # Signing happens locally with the service account key, no request
+        seconds = int(expiration.total_seconds()) if expiration is not None else 3600
+        return f"{self.public_url}?X-Goog-Expires={seconds}&X-Goog-Signature={uuid.uuid4().hex}"
+
+
+class FakeBucket:
+    def __init__(self, client: "FakeGcsClient", name: str):
+        self.client = client
+        self.name = name
+        self.blobs: Dict[str, tuple] = {}
+        self.created: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+
+    def blob(self, blob_name: str, chunk_size: Optional[int] = None) -> FakeBlob:
+        return FakeBlob(self, blob_name, chunk_size)
+
+    def copy_blob(self, blob: FakeBlob, destination_bucket: "FakeBucket", new_name: Optional[str] = None, retry=None) -> FakeBlob:
+        # Server-side, so only the request latency
+        self.client._wait()
+        with self._lock:
+            stored = self.blobs.get(blob.name)
+        if stored is None:
+            raise FileNotFoundError(f"No such object: {self.name}/{blob.name}")
+        with destination_bucket._lock:
+            destination_bucket.blobs[new_name or blob.name] = stored
+            destination_bucket.created[new_name or blob.name] = datetime.now(timezone.utc)
+        return destination_bucket.blob(new_name or blob.name)
+
+
+class FakeBatch:
+    """Like google.cloud.storage.Batch, raises the first failed call on exit."""
+
+    def __init__(self, client: "FakeGcsClient"):
+        self.client = client
+        self.missing: List[str] = []
+
+    def __enter__(self) -> "FakeBatch":
+        self.client._local.batch = self
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.client._local.batch = None
+        # One request for the whole batch
+        self.client._wait()
+        if self.missing and exc[0] is None:
+            from google.api_core.exceptions import NotFound
+
+            raise NotFound(f"No such object: {self.missing[0]}")
+
+
+class FakeGcsClient:
+    """Buckets in memory; every call waits ``latency_ms`` plus its size at
+    ``megabytes_per_second`` (0 for no bandwidth limit)."""
+
+    def __init__(self, latency_ms: float = 0.0, megabytes_per_second: float = 0.0):
+        self.latency_seconds = latency_ms / 1000.0
+        self.bytes_per_second = megabytes_per_second * 1024 * 1024
+        self.requests = 0
+        self._buckets: Dict[str, FakeBucket] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def bucket(self, name: str) -> FakeBucket:
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                bucket = self._buckets[name] = FakeBucket(self, name)
+            return bucket
+
+    def list_blobs(self, bucket: FakeBucket, prefix: str = "") -> List[FakeBlob]:
+        self._wait()
+        with bucket._lock:
+            names = [name for name in bucket.blobs if name.startswith(prefix)]
+        return [bucket.blob(name) for name in sorted(names)]
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+
+    def _current_batch(self) -> Optional[FakeBatch]:
+        return getattr(self._local, "batch", None)
+
+    def _wait(self, size: int = 0) -> None:
+        with self._lock:
+            self.requests += 1
+        seconds = self.latency_seconds
+        if self.bytes_per_second and size:
+            seconds += size / self.bytes_per_second
+        if seconds:
+            time.sleep(seconds)
+
+
+class FakeGcsStorageService(StorageService):
+    """StorageService in GCS mode, on a FakeGcsClient instead of google-cloud-storage."""
+
+    def __init__(self, client: FakeGcsClient):
+        self.settings = get_settings()
+        self.local_mode = False
+        self.client = client
+        self.bucket = client.bucket(self.settings.gcs_bucket_name)
+        self.retry = None
+        self.signed_delivery = signed_delivery_enabled()
+
+
+def install_local_backends(db_latency_ms: float = 0.0, gcs_latency_ms: Optional[float] = None, gcs_megabytes_per_second: float = 0.0):
+    """Back the service container with the stand-ins.
+
+    Without ``gcs_latency_ms`` storage is left as configured (local files
+    when GCS is not). Call before anything takes the services.
+
+    Returns:
+        The InMemorySupabase and the FakeGcsClient (or None)
+    """
+    from services.container import get_services
+
+    services = get_services()
+    database = InMemorySupabase(latency_ms=db_latency_ms)
+    services.override("database", InMemoryDatabaseService(database))
+
+    gcs = None
+    if gcs_latency_ms is not None:
+        if get_settings().use_local_storage:
+            raise ValueError("The fake GCS bucket needs GCS_BUCKET_NAME, GCS_PROJECT_ID and GOOGLE_APPLICATION_CREDENTIALS set")
+        gcs = FakeGcsClient(latency_ms=gcs_latency_ms, megabytes_per_second=gcs_megabytes_per_second)
+        services.override("storage", FakeGcsStorageService(gcs))
+    return database, gcs
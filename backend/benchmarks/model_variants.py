@@ -0,0 +1,97 @@
+"""Latency and memory of MusicGen by model, precision and thread count.
+
+Run from the backend directory:
+
+    python -m benchmarks.model_variants --models small medium --precisions fp32 bf16 int8 --threads 0 4
+
+Each configuration runs in a fresh process, configured through the same
+MUSICGEN_MODEL, MUSICGEN_PRECISION and TORCH_NUM_THREADS settings the app
+uses, so thread settings and peak memory do not leak between rows. Reports
+the load time, seconds per song of ``--max-tokens`` tokens, how much faster
+than real time that is, and the peak RSS of the process.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+PROMPT = "lo-fi hip hop beat with warm piano"
+
+
+def run_one(max_tokens, rounds):
+    """Benchmark the configured model in this process and print one JSON line."""
+    from services.music_generator import MusicGenerator
+
+    generator = MusicGenerator()
+    start = time.perf_counter()
+    generator._ensure_loaded()
+    load_seconds = time.perf_counter() - start
+    if generator._model == "mock":
+        raise SystemExit("transformers is not installed; install requirements-ml.txt to benchmark the model")
+
+    # Warm up kernels so the first round is not penalised
+    generator._generate_batch([PROMPT], 16)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        audio = generator._generate_batch([PROMPT], max_tokens)[0]
+    per_song = (time.perf_counter() - start) / rounds
+
+    print(json.dumps({
+        "load_seconds": load_seconds,
+        "seconds_per_song": per_song,
+        "audio_seconds": len(audio) / generator.sampling_rate,
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", nargs="+", default=["small"])
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "bf16", "int8"])
+    parser.add_argument("--threads", type=int, nargs="+", default=[0])
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--run-one", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(args.max_tokens, args.rounds)
+        return
+
+    print(f"{'model':>24} {'precision':>9} {'threads':>7} {'load s':>7} {'s/song':>8} {'x realtime':>10} {'peak RSS MiB':>12}")
+    for model in args.models:
+        for precision in args.precisions:
+            for threads in args.threads:
+                env = dict(
+                    os.environ,
+                    MUSICGEN_MODEL=model,
+                    MUSICGEN_PRECISION=precision,
+                    TORCH_NUM_THREADS=str(threads),
+                )
+                command = [
+                    sys.executable, "-m", "benchmarks.model_variants", "--run-one",
+                    "--max-tokens", str(args.max_tokens), "--rounds", str(args.rounds),
+                ]
+                result = subprocess.run(command, env=env, capture_output=True, text=True)
+
+                label = f"{model[-24:]:>24} {precision:>9} {threads or 'default':>7}"
+                if result.returncode != 0:
+                    error = (result.stderr.strip().splitlines() or ["failed"])[-1]
+                    print(f"{label} {error}")
+                    continue
+
+                row = json.loads(result.stdout.strip().splitlines()[-1])
+                realtime = row["audio_seconds"] / row["seconds_per_song"]
+                print(
+                    f"{label} {row['load_seconds']:>7.1f} {row['seconds_per_song']:>8.2f} "
+                    f"{realtime:>10.2f} {row['peak_rss_mib']:>12.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Startup time of the web app, with an import-time breakdown.
+
+Run from the backend directory:
+
+    python -m benchmarks.startup --top 20 --max-seconds 1.5
+
+Imports ``app`` and calls ``create_app()`` in a fresh interpreter under
+``python -X importtime``. Reports how long that took, the slowest modules by
+cumulative import time, and any heavy dependency (scipy, torch, stripe, the
+Supabase client, ...) that was imported before the first request. Those are
+meant to load on first use, so finding one here is a regression.
+
+Exits with status 1 when a heavy module was imported or the startup time is
+over ``--max-seconds``, so it can run in CI.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HEAVY_MODULES = [
+    "scipy",
+    "torch",
+    "transformers",
+    "stripe",
+    "google.cloud",
+    "supabase",
+    "httpx",
+    "soundfile",
+]
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app()
+created = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - start,
+    "create_app_seconds": created - imported,
+    "modules": sorted(sys.modules),
+}))
+"""
+
+
+def parse_importtime(stderr):
+    """(module, self microseconds, cumulative microseconds, depth) per import."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            rows.append((name.strip(), int(self_us), int(cumulative_us), (len(name) - len(name.lstrip())) // 2))
+        except ValueError:
+            continue
+    return rows
+
+
+def run_startup():
+    """Start the app once in a fresh interpreter and return (report, importtime rows)."""
+    # Keep background warm-up and recovery from racing the measurement
+    env = dict(os.environ, MODEL_WARMUP="false", RECOVER_PENDING_SONGS="false")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD],
+        env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        error = (result.stderr.strip().splitlines() or ["failed"])[-1]
+        raise SystemExit(f"create_app() failed: {error}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=15, help="how many of the slowest modules to list")
+    parser.add_argument("--max-seconds", type=float, default=None, help="fail when import plus create_app() takes longer")
+    parser.add_argument("--heavy", nargs="*", default=HEAVY_MODULES, help="modules that must not be imported at startup")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report, rows = run_startup()
+    total = report["import_seconds"] + report["create_app_seconds"]
+    heavy = [
+        name for name in args.heavy
+        if any(module == name or module.startswith(name + ".") for module in report["modules"])
+    ]
+    slowest = sorted(rows, key=lambda row: row[2], reverse=True)[:args.top]
+
+    if args.json:
+        print(json.dumps({
+            "import_seconds": report["import_seconds"],
+            "create_app_seconds": report["create_app_seconds"],
+            "total_seconds": total,
+            "modules_imported": len(report["modules"]),
+            "heavy_modules": heavy,
+            "slowest": [
+                {"module": name, "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000}
+                for name, self_us, cumulative_us, _ in slowest
+            ],
+        }, indent=2))
+    else:
+        print(f"import app      {report['import_seconds'] * 1000:8.0f} ms")
+        print(f"create_app()    {report['create_app_seconds'] * 1000:8.0f} ms")
+        print(f"total           {total * 1000:8.0f} ms  ({len(report['modules'])} modules)")
+        print()
+        print(f"{'cumulative ms':>13} {'self ms':>8}  module")
+        for name, self_us, cumulative_us, depth in slowest:
+            print(f"{cumulative_us / 1000:>13.1f} {self_us / 1000:>8.1f}  {'  ' * depth}{name}")
+        print()
+        print(f"heavy modules imported at startup: {', '.join(heavy) if heavy else 'none'}")
+
+    failed = bool(heavy)
+    if args.max_seconds is not None and total > args.max_seconds:
+        print(f"startup took {total:.2f}s, over the {args.max_seconds:.2f}s budget", file=sys.stderr)
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,12 +11,31 @@ class Settings(BaseSettings):
     
     supabase_url: str
     supabase_key: str
+    supabase_max_connections: int = 20
+    supabase_max_keepalive_connections: int = 10
+    supabase_keepalive_expiry_seconds: float = 60.0
     
     gcs_bucket_name: Optional[str] = None
     gcs_project_id: Optional[str] = None
     google_application_credentials: Optional[str] = None
+    gcs_max_connections: int = 32
+    # "public" makes every blob public; "signed" keeps them private and
+    # serves short-lived signed URLs
+    gcs_delivery: str = "public"
+    gcs_signed_url_ttl_seconds: int = 3600
+    gcs_signed_url_refresh_seconds: int = 300
     use_local_storage: bool = True
     local_storage_path: str = str(Path(__file__).parent / "storage" / "songs")
+    storage_cache_max_age: int = 31536000
+    storage_x_sendfile: bool = False
+    storage_accel_redirect_prefix: Optional[str] = None
+    
+    storage_upload_workers: int = 4
+    storage_upload_max_pending: int = 8
+    storage_upload_chunk_mb: int = 8
+    storage_retry_initial_seconds: float = 1.0
+    storage_retry_max_seconds: float = 32.0
+    storage_retry_timeout_seconds: float = 300.0
     
     stripe_secret_key: Optional[str] = None
     stripe_publishable_key: Optional[str] = None
@@ -28,7 +47,94 @@ class Settings(BaseSettings):
     paid_user_max_tokens: int = 2048
     max_configurable_tokens: int = 4096
     
+    user_cache_ttl_seconds: int = 30
+    
+    bcrypt_rounds: int = 12
+    password_hash_workers: int = 2
+    password_hash_max_pending: int = 32
+    login_max_attempts_per_email: int = 5
+    login_max_attempts_per_ip: int = 30
+    login_rate_window_seconds: int = 300
+    trusted_proxy_count: int = 0
+    
+    song_page_size: int = 50
+    song_page_size_max: int = 200
+    song_batch_max_items: int = 100
+    
     hf_home: str = "./model"
+    # small, medium, large, melody, a Hugging Face model id or a local path
+    musicgen_model: str = "small"
+    # With MUSICGEN_MODEL=mock, synthetic audio takes this long per token
+    mock_generation_ms_per_token: float = 0.0
+    # fp32, bf16 or int8 (dynamic quantization of the linear layers)
+    musicgen_precision: str = "fp32"
+    # 0 keeps torch's default (one thread per core)
+    torch_num_threads: int = 0
+    torch_interop_threads: int = 0
+    # Socket path or loopback host:port of services/inference_server.py; empty runs
+    # the model inside each web process
+    inference_server_address: str = ""
+    # Replicas share the server's copy of the weights (except int8 layers)
+    inference_server_replicas: int = 1
+    inference_server_pin_cpus: bool = True
+    model_warmup: bool = False
+    
+    generation_workers: int = 1
+    generation_queue_size: int = 32
+    generation_max_attempts: int = 2
+    generation_retry_after_seconds: int = 30
+    recover_pending_songs: bool = True
+    # A song whose process stops renewing its lease for this long is taken to
+    # be abandoned and is generated again; 0 never re-claims
+    generation_lease_seconds: int = 900
+    status_flush_interval_ms: int = 100
+    status_flush_batch_size: int = 100
+    
+    anonymous_job_path: str = str(Path(__file__).parent / "storage" / "jobs")
+    anonymous_job_ttl_seconds: int = 3600
+    anonymous_job_max_wait_seconds: int = 30
+    
+    sse_heartbeat_seconds: int = 15
+    sse_max_stream_seconds: int = 300
+    sse_retry_ms: int = 5000
+    # Lifetime of the tokens in event and audio stream URLs
+    stream_token_ttl_seconds: int = 60
+    # Events only reach streams in the publishing process; this often each
+    # stream sends the user's sync token so clients can catch up (0: never)
+    sse_resync_seconds: int = 60
+    
+    generation_batch_size: int = 1
+    generation_batch_wait_ms: int = 50
+    generation_batch_token_bucket: int = 256
+    
+    audio_stream_chunk_tokens: int = 0
+    audio_stream_wait_seconds: int = 30
+    audio_in_memory_max_mb: int = 64
+    
+    audio_output_formats: str = "wav16"
+    audio_compression_level: float = 0.5
+    encoding_workers: int = 1
+    encoding_queue_size: int = 64
+    
+    # A miss stores the audio twice (cache blob and the song's copy), so
+    # only worth it when prompts repeat
+    generation_cache_enabled: bool = False
+    generation_cache_max_entries: int = 1000
+    # Per process: storage can hold up to processes x this much
+    generation_cache_max_mb: int = 2048
+    generation_cache_ttl_seconds: int = 86400
+    
+    metrics_enabled: bool = True
+    # When set, /metrics requires "Authorization: Bearer <token>"
+    metrics_token: str = ""
+    
+    # Shared secret for /api/admin (X-Admin-Token) and for profiling requests
+    # (X-Profile); empty disables both
+    admin_token: str = ""
+    profiling_enabled: bool = False
+    # Fraction of generation jobs profiled
+    profiling_sample_rate: float = 0.0
+    profiling_torch: bool = True
     
     class Config:
         # Use absolute path to .env file relative to this config.py file
@@ -20,12 +20,45 @@ CREATE TABLE IF NOT EXISTS songs (
     max_tokens INTEGER NOT NULL,
     status VARCHAR(50) DEFAULT 'pending',
     gcs_url TEXT,
+    audio_formats JSONB DEFAULT '{}'::jsonb,
     error_message TEXT,
+    -- Until when the process generating the song holds it; renewed while it runs
+    lease_expires_at TIMESTAMP WITH TIME ZONE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- For databases created before audio_formats and lease_expires_at were added
+ALTER TABLE songs ADD COLUMN IF NOT EXISTS audio_formats JSONB DEFAULT '{}'::jsonb;
+ALTER TABLE songs ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMP WITH TIME ZONE;
+
+-- Applies many song updates in one call; used by the status writer.
+-- Fields left out of an update keep their current value.
+CREATE OR REPLACE FUNCTION update_songs(updates JSONB)
+RETURNS SETOF songs
+LANGUAGE sql
+AS $$
+    UPDATE songs AS s SET
+        status = COALESCE(u.status, s.status),
+        gcs_url = COALESCE(u.gcs_url, s.gcs_url),
+        audio_formats = COALESCE(u.audio_formats, s.audio_formats),
+        error_message = COALESCE(u.error_message, s.error_message),
+        updated_at = COALESCE(u.updated_at, NOW())
+    FROM jsonb_to_recordset(updates) AS u(
+        id UUID,
+        status VARCHAR(50),
+        gcs_url TEXT,
+        audio_formats JSONB,
+        error_message TEXT,
+        updated_at TIMESTAMP WITH TIME ZONE
+    )
+    WHERE s.id = u.id
+    RETURNING s.*;
+$$;
+
 CREATE INDEX IF NOT EXISTS idx_songs_user_id ON songs(user_id);
+CREATE INDEX IF NOT EXISTS idx_songs_user_created ON songs(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_songs_user_updated ON songs(user_id, updated_at DESC);
 CREATE INDEX IF NOT EXISTS idx_songs_status ON songs(status);
 CREATE INDEX IF NOT EXISTS idx_users_email ON users(email);
 CREATE INDEX IF NOT EXISTS idx_users_stripe_customer_id ON users(stripe_customer_id);
@@ -1,3 +1,3 @@
-from .auth import require_auth
+from .auth import require_auth, require_stream_auth, require_admin, create_stream_token, get_authenticated_user
 
-__all__ = ["require_auth"]
+__all__ = ["require_auth", "require_stream_auth", "require_admin", "create_stream_token", "get_authenticated_user"]
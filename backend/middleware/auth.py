@@ -1,24 +1,82 @@
+import hmac
+from datetime import timedelta
 from functools import wraps
-from flask import jsonify
-from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
-from services.auth import AuthService
+from typing import Optional
+from flask import jsonify, g, request
+from flask_jwt_extended import create_access_token, verify_jwt_in_request, get_jwt, get_jwt_identity
+from models import UserResponse
+from services.container import get_services
+from config import get_settings
+
+# Scope claim of the short-lived tokens put in stream URLs
+STREAM_SCOPE = "stream"
 
 
 def require_auth(fn):
+    """Allow requests with an access token in the Authorization header."""
+    return _authenticated(fn, locations=["headers"], scope=None)
+
+
+def require_stream_auth(fn):
+    """Allow requests with a stream token (see create_stream_token) in ?jwt=.
+    
+    EventSource and audio elements cannot send headers, so their URLs carry
+    a token that is only valid here and expires within seconds.
+    """
+    return _authenticated(fn, locations=["query_string"], scope=STREAM_SCOPE)
+
+
+def create_stream_token(user_id: str) -> str:
+    return create_access_token(
+        identity=user_id,
+        additional_claims={"scope": STREAM_SCOPE},
+        expires_delta=timedelta(seconds=get_settings().stream_token_ttl_seconds)
+    )
+
+
+def _authenticated(fn, locations, scope):
     @wraps(fn)
     def wrapper(*args, **kwargs):
         try:
-            verify_jwt_in_request()
+            verify_jwt_in_request(locations=locations)
+            # A stream token must not work as an access token, nor the reverse
+            if get_jwt().get("scope") != scope:
+                return jsonify({"error": "Invalid token for this endpoint"}), 401
+            
             current_user_id = get_jwt_identity()
             
-            auth_service = AuthService()
-            user = auth_service.get_user_by_id(current_user_id)
+            user = get_services().auth.get_user_by_id(current_user_id)
             
             if not user:
                 return jsonify({"error": "User not found"}), 404
             
+            # Handlers and services reuse this instead of fetching the user again
+            g.current_user = user
+            
             return fn(current_user_id, *args, **kwargs)
         except Exception as e:
             return jsonify({"error": str(e)}), 401
     
     return wrapper
+
+
+def require_admin(fn):
+    """Allow requests carrying X-Admin-Token: <ADMIN_TOKEN>.
+    Without ADMIN_TOKEN the admin routes do not exist."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = get_settings().admin_token
+        if not token:
+            return jsonify({"error": "Not found"}), 404
+        
+        if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), token):
+            return jsonify({"error": "Unauthorized"}), 401
+        
+        return fn(*args, **kwargs)
+    
+    return wrapper
+
+
+def get_authenticated_user() -> Optional[UserResponse]:
+    """The user loaded by require_auth for this request."""
+    return g.get("current_user")
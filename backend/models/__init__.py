@@ -1,5 +1,5 @@
 from .user import User, UserCreate, UserLogin, UserUpdate, UserResponse
-from .song import Song, SongCreate, SongUpdate, SongResponse, SongStatus
+from .song import Song, SongCreate, SongUpdate, SongResponse, SongStatus, AnonymousJob
 
 __all__ = [
     "User",
@@ -12,4 +12,5 @@ __all__ = [
     "SongUpdate",
     "SongResponse",
     "SongStatus",
+    "AnonymousJob",
 ]
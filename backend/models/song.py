@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel
 from enum import Enum
 
@@ -20,6 +20,7 @@ class Song(BaseModel):
     max_tokens: int
     status: SongStatus = SongStatus.PENDING
     gcs_url: Optional[str] = None
+    audio_formats: Optional[Dict[str, Optional[str]]] = None
     error_message: Optional[str] = None
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
@@ -30,6 +31,7 @@ class SongCreate(BaseModel):
     description: Optional[str] = None
     prompt: str
     max_tokens: Optional[int] = None
+    formats: Optional[List[str]] = None
 
 
 class SongUpdate(BaseModel):
@@ -46,6 +48,19 @@ class SongResponse(BaseModel):
     max_tokens: int
     status: SongStatus
     gcs_url: Optional[str] = None
+    # Encoded copies by format; None while the encode is still queued
+    audio_formats: Optional[Dict[str, Optional[str]]] = None
+    error_message: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+
+class AnonymousJob(BaseModel):
+    id: str
+    prompt: str
+    max_tokens: int
+    status: SongStatus = SongStatus.PENDING
+    download_url: Optional[str] = None
     error_message: Optional[str] = None
     created_at: datetime
     updated_at: datetime
@@ -1,5 +1,7 @@
 from .auth_routes import auth_bp
 from .song_routes import song_bp
 from .payment_routes import payment_bp
+from .storage_routes import storage_bp
+from .admin_routes import admin_bp
 
-__all__ = ["auth_bp", "song_bp", "payment_bp"]
+__all__ = ["auth_bp", "song_bp", "payment_bp", "storage_bp", "admin_bp"]
@@ -0,0 +1,72 @@
+from flask import Blueprint, request, jsonify, Response
+from middleware import require_admin
+from services.profiling import get_profiler, content_type
+
+admin_bp = Blueprint("admin", __name__, url_prefix="/api/admin")
+profiler = get_profiler()
+
+
+@admin_bp.route("/profiling", methods=["GET"])
+@require_admin
+def get_profiling():
+    return jsonify(profiler.state()), 200
+
+
+@admin_bp.route("/profiling", methods=["PUT"])
+@require_admin
+def update_profiling():
+    """Sample generation jobs in this process.
+    Body: {"sample_rate": 0.05} and/or {"next_jobs": 3}.
+    """
+    try:
+        if not profiler.enabled:
+            return jsonify({"error": "Profiling is disabled, set PROFILING_ENABLED=true"}), 400
+        
+        data = request.get_json() or {}
+        sample_rate = data.get("sample_rate")
+        next_jobs = data.get("next_jobs")
+        
+        state = profiler.configure(
+            sample_rate=float(sample_rate) if sample_rate is not None else None,
+            next_jobs=int(next_jobs) if next_jobs is not None else None
+        )
+        return jsonify(state), 200
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@admin_bp.route("/profiles", methods=["GET"])
+@require_admin
+def list_profiles():
+    """The most recent stored profiles, newest first (?limit=, default 20)."""
+    try:
+        limit = min(max(request.args.get("limit", 20, type=int), 1), 200)
+        profiles = profiler.list_profiles(limit)
+        
+        for profile in profiles:
+            profile["downloads"] = {
+                name: f"{admin_bp.url_prefix}/profiles/{profile['id']}/{name}"
+                for name in profile.get("artifacts", [])
+            }
+        
+        return jsonify({"profiles": profiles}), 200
+    except Exception as e:
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@admin_bp.route("/profiles/<profile_id>/<name>", methods=["GET"])
+@require_admin
+def download_profile(profile_id, name):
+    try:
+        data = profiler.artifact(profile_id, name)
+        
+        return Response(data, mimetype=content_type(name), headers={
+            "Content-Disposition": f'attachment; filename="{profile_id}-{name}"',
+            "Cache-Control": "private, no-store"
+        })
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        return jsonify({"error": "Internal server error"}), 500
@@ -1,11 +1,18 @@
 from flask import Blueprint, request, jsonify
 from models import UserCreate, UserLogin, UserUpdate
-from services.auth import AuthService
-from middleware import require_auth
+from services.container import get_services
+from services.auth import PasswordHasherBusyError, LoginRateLimitedError
+from middleware import require_auth, get_authenticated_user
 from flask_jwt_extended import get_jwt_identity
 
 auth_bp = Blueprint("auth", __name__, url_prefix="/api/auth")
-auth_service = AuthService()
+auth_service = get_services().lazy("auth")
+
+
+def retry_later_response(error, status: int):
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, status
 
 
 @auth_bp.route("/signup", methods=["POST"])
@@ -19,6 +26,8 @@ def signup():
             "message": "User created successfully",
             "user": user.model_dump()
         }), 201
+    except PasswordHasherBusyError as e:
+        return retry_later_response(e, 503)
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except Exception as e:
@@ -30,7 +39,7 @@ def login():
     try:
         data = request.get_json()
         login_data = UserLogin(**data)
-        user, access_token, refresh_token = auth_service.authenticate_user(login_data)
+        user, access_token, refresh_token = auth_service.authenticate_user(login_data, client_ip=request.remote_addr)
         
         return jsonify({
             "message": "Login successful",
@@ -38,6 +47,10 @@ def login():
             "access_token": access_token,
             "refresh_token": refresh_token
         }), 200
+    except LoginRateLimitedError as e:
+        return retry_later_response(e, 429)
+    except PasswordHasherBusyError as e:
+        return retry_later_response(e, 503)
     except ValueError as e:
         return jsonify({"error": str(e)}), 401
     except Exception as e:
@@ -48,7 +61,7 @@ def login():
 @require_auth
 def get_current_user(current_user_id):
     try:
-        user = auth_service.get_user_by_id(current_user_id)
+        user = get_authenticated_user()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
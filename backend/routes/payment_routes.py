@@ -1,10 +1,10 @@
 from flask import Blueprint, request, jsonify
-from services.payment import PaymentService
-from middleware import require_auth
+from services.container import get_services
+from middleware import require_auth, get_authenticated_user
 from config import get_settings
 
 payment_bp = Blueprint("payment", __name__, url_prefix="/api/payment")
-payment_service = PaymentService()
+payment_service = get_services().lazy("payment")
 settings = get_settings()
 
 
@@ -19,7 +19,8 @@ def create_checkout_session(current_user_id):
         session = payment_service.create_checkout_session(
             current_user_id,
             success_url,
-            cancel_url
+            cancel_url,
+            user=get_authenticated_user()
         )
         
         return jsonify(session), 200
@@ -48,7 +49,7 @@ def stripe_webhook():
 @require_auth
 def cancel_subscription(current_user_id):
     try:
-        result = payment_service.cancel_subscription(current_user_id)
+        result = payment_service.cancel_subscription(current_user_id, user=get_authenticated_user())
         
         return jsonify(result), 200
     except ValueError as e:
@@ -1,11 +1,33 @@
-from flask import Blueprint, request, jsonify
-from models import SongCreate, SongUpdate
-from services.song import SongService
-from middleware import require_auth
+from flask import Blueprint, request, jsonify, Response, redirect
+from models import SongCreate, SongUpdate, SongStatus
+from services.container import get_services
+from middleware import require_auth, require_stream_auth, create_stream_token, get_authenticated_user
+from tasks.worker_pool import QueueFullError
+from tasks.background_processor import BackgroundTaskProcessor
+from tasks.job_store import get_job_store
+from services.events import get_event_broker, get_sync_tokens
+from services.audio_stream import get_stream_registry, wav_stream_header, to_pcm16
+from services.storage import delivery_epoch
+from config import get_settings
+import hashlib
+import json
+import queue
+import time
 import uuid
 
 song_bp = Blueprint("songs", __name__, url_prefix="/api/songs")
-song_service = SongService()
+song_service = get_services().lazy("song")
+settings = get_settings()
+
+
+def queue_full_response(error: QueueFullError):
+    response = jsonify({
+        "error": str(error),
+        "queue_depth": error.queue_depth,
+        "retry_after": error.retry_after
+    })
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 503
 
 
 @song_bp.route("", methods=["POST"])
@@ -14,31 +36,228 @@ def create_song(current_user_id):
     try:
         data = request.get_json()
         song_data = SongCreate(**data)
-        song = song_service.create_song(current_user_id, song_data)
+        song = song_service.create_song(current_user_id, song_data, user=get_authenticated_user())
         
         return jsonify({
             "message": "Song creation started",
-            "song": song.model_dump()
+            "song": song_service.with_delivery_urls([song.model_dump()])[0]
         }), 201
+    except QueueFullError as e:
+        return queue_full_response(e)
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": "Internal server error"}), 500
 
 
-@song_bp.route("", methods=["GET"])
+@song_bp.route("/batch", methods=["POST"])
 @require_auth
-def get_user_songs(current_user_id):
+def create_songs(current_user_id):
+    """Create up to SONG_BATCH_MAX_ITEMS songs from {"songs": [...]}.
+    Returns one result per song, in order, each with its own status.
+    """
+    try:
+        data = request.get_json() or {}
+        items = data.get("songs")
+        if not isinstance(items, list):
+            return jsonify({"error": "songs must be a list"}), 400
+        
+        results = song_service.create_songs(current_user_id, items, user=get_authenticated_user())
+        
+        created = [result["song"].model_dump() for result in results if "song" in result]
+        delivered = iter(song_service.with_delivery_urls(created))
+        
+        body = []
+        for index, result in enumerate(results):
+            item = {"index": index, **result}
+            if "song" in result:
+                item["song"] = next(delivered)
+            body.append(item)
+        
+        response = jsonify({
+            "results": body,
+            "created": len(created),
+            "failed": len(results) - len(created)
+        })
+        if any(result["status"] == 503 for result in results):
+            response.headers["Retry-After"] = str(BackgroundTaskProcessor.get_pool().retry_after)
+        return response, 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@song_bp.route("/batch", methods=["DELETE"])
+@require_auth
+def delete_songs(current_user_id):
+    """Delete up to SONG_BATCH_MAX_ITEMS songs from {"ids": [...]}.
+    Returns one result per id, in order.
+    """
     try:
-        songs = song_service.get_user_songs(current_user_id)
+        data = request.get_json() or {}
+        song_ids = data.get("ids")
+        if not isinstance(song_ids, list) or not all(isinstance(song_id, str) for song_id in song_ids):
+            return jsonify({"error": "ids must be a list of song ids"}), 400
+        
+        results = song_service.delete_songs(song_ids, current_user_id)
+        deleted = sum(1 for result in results if result["status"] == 200)
         
         return jsonify({
-            "songs": [song.model_dump() for song in songs]
+            "results": results,
+            "deleted": deleted,
+            "failed": len(results) - deleted
         }), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": "Internal server error"}), 500
 
 
+@song_bp.route("", methods=["GET"])
+@require_auth
+def get_user_songs(current_user_id):
+    """List the user's songs.
+    
+    With ?updated_since=<sync token> only songs changed after the token are
+    returned, and 304 when there are none. Otherwise the list carries an ETag, and a
+    matching If-None-Match gets 304 without reading the songs.
+    """
+    try:
+        fields = request.args.get("fields")
+        fields = fields.split(",") if fields else None
+        updated_since = request.args.get("updated_since")
+        
+        if updated_since:
+            songs, sync_token = song_service.get_songs_changed_since(
+                current_user_id,
+                updated_since,
+                limit=request.args.get("limit", type=int),
+                fields=fields
+            )
+            if not songs:
+                return "", 304
+            
+            return jsonify({
+                "songs": song_service.with_delivery_urls(songs),
+                "sync_token": sync_token
+            }), 200
+        
+        version, sync_token = song_service.get_songs_version(current_user_id)
+        # Signed URLs in the body expire, so the ETag also rolls over with them
+        etag_source = f"{version}|{delivery_epoch()}|{request.query_string.decode()}"
+        etag = hashlib.sha256(etag_source.encode("utf-8")).hexdigest()[:32]
+        
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+        
+        status = request.args.get("status")
+        
+        songs, next_cursor = song_service.get_user_songs(
+            current_user_id,
+            limit=request.args.get("limit", type=int),
+            cursor=request.args.get("cursor"),
+            fields=fields,
+            statuses=status.split(",") if status else None
+        )
+        
+        response = jsonify({
+            "songs": song_service.with_delivery_urls(songs),
+            "next_cursor": next_cursor,
+            "sync_token": sync_token
+        })
+        response.set_etag(etag)
+        # Let the browser cache the list but revalidate it on every request
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response, 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": "Internal server error"}), 500
+
+
+def resync_event(user_id: str) -> str:
+    """A "resync" event with the user's sync token, or an empty string if it
+    cannot be read right now (the next one will try again)."""
+    try:
+        # All of the user's streams in this process share one read per period
+        sync_token = get_sync_tokens().get(user_id, settings.sse_resync_seconds, song_service.get_sync_token)
+    except Exception:
+        return ""
+    return f"event: resync\ndata: {json.dumps({'sync_token': sync_token})}\n\n"
+
+
+@song_bp.route("/stream-token", methods=["POST"])
+@require_auth
+def stream_token(current_user_id):
+    """A short-lived token for the ?jwt= of /events and /<id>/stream."""
+    return jsonify({
+        "token": create_stream_token(current_user_id),
+        "expires_in": settings.stream_token_ttl_seconds
+    }), 200
+
+
+@song_bp.route("/events", methods=["GET"])
+@require_stream_auth
+def song_events(current_user_id):
+    """Server-sent events with the user's song status changes.
+    EventSource cannot set headers, so it passes a token from
+    POST /stream-token as ?jwt=.
+    Pass ?song_id= to only receive events for one song.
+    
+    Changes made by other processes are not published here, so every
+    SSE_RESYNC_SECONDS the stream also sends a "resync" event with the
+    user's sync token, read once per period for all of the user's streams.
+    A client whose token differs fetches what changed.
+    """
+    song_id = request.args.get("song_id")
+    
+    def stream():
+        broker = get_event_broker()
+        subscription = broker.subscribe(current_user_id)
+        try:
+            yield f"retry: {settings.sse_retry_ms}\n\n"
+            
+            # Bound the connection so a worker is never held indefinitely;
+            # EventSource reconnects on its own
+            deadline = time.monotonic() + settings.sse_max_stream_seconds
+            resync_at = time.monotonic() + settings.sse_resync_seconds
+            while time.monotonic() < deadline:
+                timeout = settings.sse_heartbeat_seconds
+                if settings.sse_resync_seconds > 0:
+                    timeout = max(0.0, min(timeout, resync_at - time.monotonic()))
+                try:
+                    event = subscription.get(timeout=timeout)
+                except queue.Empty:
+                    event = None
+                
+                if settings.sse_resync_seconds > 0 and time.monotonic() >= resync_at:
+                    resync_at = time.monotonic() + settings.sse_resync_seconds
+                    resync = resync_event(current_user_id)
+                    if resync:
+                        yield resync
+                elif event is None:
+                    yield ": keep-alive\n\n"
+                
+                if event is None:
+                    continue
+                
+                if song_id and event["id"] != song_id:
+                    continue
+                
+                event = song_service.with_delivery_urls([event])[0]
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(current_user_id, subscription)
+    
+    return Response(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+
 @song_bp.route("/<song_id>", methods=["GET"])
 @require_auth
 def get_song(current_user_id, song_id):
@@ -48,7 +267,44 @@ def get_song(current_user_id, song_id):
         if not song:
             return jsonify({"error": "Song not found"}), 404
         
-        return jsonify({"song": song.model_dump()}), 200
+        return jsonify({"song": song_service.with_delivery_urls([song.model_dump()])[0]}), 200
+    except Exception as e:
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@song_bp.route("/<song_id>/stream", methods=["GET"])
+@require_stream_auth
+def stream_song_audio(current_user_id, song_id):
+    """Audio of a song while it is being generated, as a streamed 16-bit WAV.
+    Completed songs redirect to the stored file. Audio elements cannot set
+    headers, so a token from POST /stream-token is passed as ?jwt=.
+    """
+    try:
+        song = song_service.get_song(song_id, current_user_id)
+        
+        if not song:
+            return jsonify({"error": "Song not found"}), 404
+        
+        channel = get_stream_registry().get(song_id)
+        
+        if channel is None or not channel.wait_for_data(settings.audio_stream_wait_seconds):
+            song = song_service.get_song(song_id, current_user_id)
+            if song and song.status == SongStatus.COMPLETED and song.gcs_url:
+                return redirect(song_service.with_delivery_urls([song.model_dump()])[0]["gcs_url"])
+            return jsonify({
+                "error": "Song audio is not streaming",
+                "status": song.status.value if song else None
+            }), 409
+        
+        def stream():
+            yield wav_stream_header(channel.sampling_rate)
+            for chunk in channel:
+                yield to_pcm16(chunk)
+        
+        return Response(stream(), mimetype="audio/wav", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        })
     except Exception as e:
         return jsonify({"error": "Internal server error"}), 500
 
@@ -63,7 +319,7 @@ def update_song(current_user_id, song_id):
         
         return jsonify({
             "message": "Song updated successfully",
-            "song": song.model_dump()
+            "song": song_service.with_delivery_urls([song.model_dump()])[0]
         }), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 404
@@ -86,8 +342,9 @@ def delete_song(current_user_id, song_id):
 
 @song_bp.route("/anonymous", methods=["POST"])
 def create_anonymous_song():
-    """Generate a song for anonymous users - no login required.
-    Song is generated and returned immediately but not saved to any profile.
+    """Queue a song for anonymous users - no login required.
+    Returns a job id at once; poll /anonymous/<job_id> for the download URL.
+    The song is not saved to any profile.
     """
     try:
         data = request.get_json()
@@ -100,16 +357,38 @@ def create_anonymous_song():
         if not prompt:
             return jsonify({"error": "Prompt cannot be empty"}), 400
         
-        # Generate song synchronously
-        result = song_service.generate_anonymous_song(prompt)
+        job = song_service.create_anonymous_job(prompt)
         
         return jsonify({
-            "message": "Song generated successfully",
-            "download_url": result["download_url"],
-            "song_id": result["song_id"]
-        }), 200
+            "message": "Song generation queued",
+            "job": song_service.job_with_delivery_url(job)
+        }), 200 if job.status == SongStatus.COMPLETED else 202
         
+    except QueueFullError as e:
+        return queue_full_response(e)
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     except Exception as e:
-        return jsonify({"error": f"Failed to generate song: {str(e)}"}), 500
+        return jsonify({"error": f"Failed to queue song: {str(e)}"}), 500
+
+
+@song_bp.route("/anonymous/<job_id>", methods=["GET"])
+def get_anonymous_job(job_id):
+    """Status of an anonymous job. With ?wait=<seconds> the request is held
+    until the job completes or fails, up to the configured maximum.
+    """
+    try:
+        wait = min(
+            request.args.get("wait", 0, type=float),
+            settings.anonymous_job_max_wait_seconds
+        )
+        
+        store = get_job_store()
+        job = store.wait(job_id, wait) if wait > 0 else store.get(job_id)
+        
+        if not job:
+            return jsonify({"error": "Job not found or expired"}), 404
+        
+        return jsonify({"job": song_service.job_with_delivery_url(job)}), 200
+    except Exception as e:
+        return jsonify({"error": "Internal server error"}), 500
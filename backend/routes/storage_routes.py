@@ -0,0 +1,56 @@
+from flask import Blueprint, jsonify, send_file, Response
+from werkzeug.security import safe_join
+from services.audio_encoder import CONTENT_TYPES
+from services.storage import PRIVATE_PREFIX
+from config import get_settings
+from urllib.parse import quote
+import os
+import posixpath
+import re
+
+storage_bp = Blueprint("storage", __name__, url_prefix="/storage")
+settings = get_settings()
+
+# Blobs named after a song/job uuid or a content hash are written once and
+# never change, so clients and CDNs may cache them forever
+IMMUTABLE_NAME = re.compile(
+    r"^(?:[0-9a-f]{64}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})(?:\.[a-z0-9]+)+$"
+)
+
+
+def is_immutable(filepath: str) -> bool:
+    return bool(IMMUTABLE_NAME.match(filepath.rsplit("/", 1)[-1]))
+
+
+def is_private(filepath: str) -> bool:
+    return posixpath.normpath(filepath).startswith(PRIVATE_PREFIX)
+
+
+@storage_bp.route("/<path:filepath>")
+def serve_storage(filepath):
+    file_path = safe_join(settings.local_storage_path, filepath)
+
+    if file_path is None or is_private(filepath) or not os.path.isfile(file_path):
+        return jsonify({"error": "File not found"}), 404
+
+    mimetype = CONTENT_TYPES.get(os.path.splitext(file_path)[1].lstrip("."), "application/octet-stream")
+
+    if settings.storage_accel_redirect_prefix:
+        # nginx serves the bytes (with Range and conditional GET) from an
+        # internal location that maps onto LOCAL_STORAGE_PATH
+        response = Response(mimetype=mimetype)
+        response.headers["X-Accel-Redirect"] = settings.storage_accel_redirect_prefix.rstrip("/") + "/" + quote(filepath)
+    else:
+        # Handles Range requests (206) and If-None-Match/If-Modified-Since
+        # (304) with a strong ETag; USE_X_SENDFILE hands the body to the proxy
+        response = send_file(file_path, mimetype=mimetype, conditional=True, etag=True)
+
+    response.cache_control.public = True
+    if is_immutable(filepath):
+        response.cache_control.no_cache = False
+        response.cache_control.max_age = settings.storage_cache_max_age
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+
+    return response
@@ -1,15 +1,27 @@
-from .database import DatabaseService
-from .auth import AuthService
-from .storage import StorageService
-from .payment import PaymentService
-from .music_generator import MusicGenerator
-from .song import SongService
-
-__all__ = [
-    "DatabaseService",
-    "AuthService",
-    "StorageService",
-    "PaymentService",
-    "MusicGenerator",
-    "SongService",
-]
+"""Service classes, imported on first access.
+
+Importing one service (or the container) therefore does not pull in the
+others and their dependencies, such as scipy for MusicGenerator or the
+Supabase client for DatabaseService.
+"""
+import importlib
+
+_EXPORTS = {
+    "DatabaseService": ".database",
+    "AuthService": ".auth",
+    "StorageService": ".storage",
+    "PaymentService": ".payment",
+    "MusicGenerator": ".music_generator",
+    "SongService": ".song",
+    "ServiceContainer": ".container",
+    "get_services": ".container",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(importlib.import_module(module, __name__), name)
@@ -0,0 +1,118 @@
+import importlib.util
+import inspect
+import io
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from config import get_settings
+from services.audio_stream import to_pcm16
+
+
+@dataclass(frozen=True)
+class AudioFormat:
+    name: str
+    suffix: str
+    content_type: str
+    # soundfile format/subtype, or None for formats encoded with scipy
+    sf_format: Optional[str] = None
+    sf_subtype: Optional[str] = None
+    # Encoder sample rate when the codec does not accept the model's rate
+    sampling_rate: Optional[int] = None
+
+
+FORMATS: Dict[str, AudioFormat] = {
+    "wav16": AudioFormat("wav16", ".pcm16.wav", "audio/wav"),
+    "flac": AudioFormat("flac", ".flac", "audio/flac", "FLAC", "PCM_16"),
+    # Opus only runs at 8, 12, 16, 24 or 48 kHz
+    "opus": AudioFormat("opus", ".opus.ogg", "audio/ogg", "OGG", "OPUS", sampling_rate=48000),
+    "mp3": AudioFormat("mp3", ".mp3", "audio/mpeg", "MP3", "MPEG_LAYER_III"),
+}
+
+CONTENT_TYPES = {fmt.suffix.rsplit(".", 1)[-1]: fmt.content_type for fmt in FORMATS.values()}
+CONTENT_TYPES["wav"] = "audio/wav"
+
+
+@lru_cache()
+def available_formats() -> List[str]:
+    """Formats this process can encode; compressed ones need soundfile and
+    a libsndfile built with their codec (MP3 needs libsndfile 1.1)."""
+    if importlib.util.find_spec("soundfile") is None:
+        return ["wav16"]
+
+    import soundfile
+
+    return [
+        name for name, fmt in FORMATS.items()
+        if fmt.sf_format is None or soundfile.check_format(fmt.sf_format, fmt.sf_subtype)
+    ]
+
+
+@lru_cache()
+def _supports_compression_level() -> bool:
+    # soundfile.write only takes compression_level from 0.13 on
+    import soundfile
+
+    return "compression_level" in inspect.signature(soundfile.write).parameters
+
+
+def parse_formats(formats: Iterable[str]) -> List[str]:
+    """Normalize requested format names, raising ValueError for unknown ones."""
+    available = available_formats()
+    parsed = []
+    for name in formats:
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in FORMATS:
+            raise ValueError(f"Unsupported audio format: {name}")
+        if name not in available:
+            raise ValueError(f"Audio format {name} is not available on this server")
+        if name not in parsed:
+            parsed.append(name)
+    return parsed
+
+
+def default_formats() -> List[str]:
+    """AUDIO_OUTPUT_FORMATS, minus any format this process cannot encode."""
+    available = available_formats()
+    requested = get_settings().audio_output_formats.split(",")
+    return [name for name in (n.strip().lower() for n in requested) if name in available]
+
+
+def blob_name_for(source_blob_name: str, name: str) -> str:
+    """Where the ``name`` encoding of ``<id>.wav`` is stored, e.g. ``<id>.opus.ogg``."""
+    base = source_blob_name[:-len(".wav")] if source_blob_name.endswith(".wav") else source_blob_name
+    return base + FORMATS[name].suffix
+
+
+def encode(audio: np.ndarray, sampling_rate: int, name: str) -> bytes:
+    """Encode mono audio (float in [-1, 1] or int16) as the named format."""
+    fmt = FORMATS[name]
+    pcm = np.frombuffer(to_pcm16(audio), dtype="<i2")
+
+    if fmt.sf_format is None:
+        from scipy.io import wavfile
+
+        buffer = io.BytesIO()
+        wavfile.write(buffer, rate=sampling_rate, data=pcm)
+        return buffer.getvalue()
+
+    import soundfile
+
+    if fmt.sampling_rate and fmt.sampling_rate != sampling_rate:
+        from math import gcd
+        from scipy.signal import resample_poly
+
+        divisor = gcd(fmt.sampling_rate, sampling_rate)
+        pcm = resample_poly(pcm.astype(np.float32) / 32768.0, fmt.sampling_rate // divisor, sampling_rate // divisor)
+        pcm = np.frombuffer(to_pcm16(pcm), dtype="<i2")
+        sampling_rate = fmt.sampling_rate
+
+    options = {}
+    if _supports_compression_level():
+        options["compression_level"] = get_settings().audio_compression_level
+
+    buffer = io.BytesIO()
+    soundfile.write(buffer, pcm, sampling_rate, format=fmt.sf_format, subtype=fmt.sf_subtype, **options)
+    return buffer.getvalue()
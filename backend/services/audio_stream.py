@@ -0,0 +1,181 @@
+import struct
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Dict, Iterator, Optional
+import numpy as np
+
+
+class AudioChunkStreamer:
+    """Turns MusicGen tokens into audio every ``play_steps`` tokens.
+
+    Implements the ``put``/``end`` interface of transformers' BaseStreamer:
+    ``model.generate`` feeds it one step of codebook tokens at a time.
+    Every ``play_steps`` steps the tokens so far are run through the audio
+    encoder and the audio that is now final is passed to ``on_audio``.
+    The last ``stride`` samples are held back, because they change once the
+    following tokens are decoded.
+    """
+
+    def __init__(self, model, play_steps: int, on_audio: Callable[[np.ndarray], None]):
+        self.decoder = model.decoder
+        self.audio_encoder = model.audio_encoder
+        self.generation_config = model.generation_config
+        self.play_steps = play_steps
+        self.on_audio = on_audio
+
+        hop_length = int(np.prod(self.audio_encoder.config.upsampling_ratios))
+        self.stride = max(1, hop_length * (play_steps - self.decoder.num_codebooks) // 6)
+
+        self.token_cache = None
+        self.to_yield = 0
+
+    def _decode(self, input_ids) -> np.ndarray:
+        _, delay_pattern_mask = self.decoder.build_delay_pattern_mask(
+            input_ids[:, :1],
+            pad_token_id=self.generation_config.decoder_start_token_id,
+            max_length=input_ids.shape[-1],
+        )
+        input_ids = self.decoder.apply_delay_pattern_mask(input_ids, delay_pattern_mask)
+        input_ids = input_ids[input_ids != self.generation_config.pad_token_id]
+        input_ids = input_ids.reshape(1, 1, self.decoder.num_codebooks, -1).to(self.audio_encoder.device)
+
+        output_values = self.audio_encoder.decode(input_ids, audio_scales=[None])
+        return output_values.audio_values[0, 0].cpu().float().numpy()
+
+    def put(self, value):
+        import torch
+
+        if value.shape[0] // self.decoder.num_codebooks > 1:
+            raise ValueError("AudioChunkStreamer only supports a batch size of 1")
+
+        if self.token_cache is None:
+            self.token_cache = value
+        else:
+            self.token_cache = torch.concatenate([self.token_cache, value[:, None]], dim=-1)
+
+        if self.token_cache.shape[-1] % self.play_steps == 0:
+            audio = self._decode(self.token_cache)
+            if len(audio) - self.stride > self.to_yield:
+                self.on_audio(audio[self.to_yield:-self.stride])
+                self.to_yield = len(audio) - self.stride
+
+    def end(self):
+        if self.token_cache is None:
+            return
+        audio = self._decode(self.token_cache)
+        if len(audio) > self.to_yield:
+            self.on_audio(audio[self.to_yield:])
+
+
+class AudioChunkChannel:
+    """Replayable buffer of audio chunks for one song.
+
+    The generation job appends chunks; any number of listeners iterate from
+    the first chunk, so a listener that connects late still gets all audio.
+    """
+
+    def __init__(self, sampling_rate: int):
+        self.sampling_rate = sampling_rate
+        self.closed = False
+        self.error: Optional[str] = None
+        self._chunks = []
+        self._changed = threading.Condition()
+
+    def append(self, chunk: np.ndarray) -> None:
+        with self._changed:
+            self._chunks.append(chunk)
+            self._changed.notify_all()
+
+    def close(self, error: Optional[str] = None) -> None:
+        with self._changed:
+            self.closed = True
+            self.error = error
+            self._changed.notify_all()
+
+    def wait_for_data(self, timeout: float) -> bool:
+        """Wait until a chunk arrives or the channel closes; True if there is audio."""
+        with self._changed:
+            self._changed.wait_for(lambda: self._chunks or self.closed, timeout)
+            return bool(self._chunks)
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        index = 0
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: index < len(self._chunks) or self.closed)
+                pending = self._chunks[index:]
+                done = self.closed
+            for chunk in pending:
+                yield chunk
+            index += len(pending)
+            if done and not pending:
+                return
+
+
+class AudioStreamRegistry:
+    """Channels of songs being generated in this process, by song id.
+
+    Closed channels stay listed for ``linger_seconds`` so a listener that
+    arrives just as generation finishes still gets the audio.
+    """
+
+    def __init__(self, linger_seconds: float = 30.0):
+        self.linger_seconds = linger_seconds
+        self._channels: Dict[str, AudioChunkChannel] = {}
+        self._closed_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def open(self, song_id: str, sampling_rate: int) -> AudioChunkChannel:
+        channel = AudioChunkChannel(sampling_rate)
+        with self._lock:
+            self._purge()
+            self._channels[song_id] = channel
+            self._closed_at.pop(song_id, None)
+        return channel
+
+    def get(self, song_id: str) -> Optional[AudioChunkChannel]:
+        with self._lock:
+            self._purge()
+            return self._channels.get(song_id)
+
+    def close(self, song_id: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            channel = self._channels.get(song_id)
+            self._closed_at[song_id] = time.monotonic()
+        if channel is not None:
+            channel.close(error)
+
+    def _purge(self) -> None:
+        now = time.monotonic()
+        for song_id, closed_at in list(self._closed_at.items()):
+            if now - closed_at > self.linger_seconds:
+                self._channels.pop(song_id, None)
+                del self._closed_at[song_id]
+
+
+@lru_cache()
+def get_stream_registry() -> AudioStreamRegistry:
+    return AudioStreamRegistry()
+
+
+def wav_stream_header(sampling_rate: int, num_channels: int = 1, bits_per_sample: int = 16) -> bytes:
+    """RIFF header for 16-bit PCM of unknown length.
+
+    The sizes are set to the maximum so players keep reading until the
+    connection closes.
+    """
+    data_size = 0xFFFFFFFF - 36
+    byte_rate = sampling_rate * num_channels * bits_per_sample // 8
+    block_align = num_channels * bits_per_sample // 8
+    return (
+        b"RIFF" + struct.pack("<I", data_size + 36) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, num_channels, sampling_rate, byte_rate, block_align, bits_per_sample)
+        + b"data" + struct.pack("<I", data_size)
+    )
+
+
+def to_pcm16(chunk: np.ndarray) -> bytes:
+    if chunk.dtype != np.int16:
+        chunk = (np.clip(chunk, -1.0, 1.0) * 32767).astype(np.int16)
+    return chunk.astype("<i2", copy=False).tobytes()
@@ -1,22 +1,201 @@
 import bcrypt
-from typing import Optional
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Dict, Optional, Tuple
 from datetime import datetime
+from functools import lru_cache
 from flask_jwt_extended import create_access_token, create_refresh_token
 from models import User, UserCreate, UserLogin, UserResponse
-from services.database import DatabaseService
+from services.container import get_services
 from config import get_settings
 
 
+class UserCache:
+    """Short-lived cache of user profiles by id.
+    
+    Every authenticated request looks its user up, so this saves a Supabase
+    round trip on most of them. Writes through AuthService invalidate the
+    entry; other processes see the change once their entry expires.
+    """
+    
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, Tuple[float, UserResponse]] = {}
+        self._lock = threading.Lock()
+    
+    def get(self, user_id: str) -> Optional[UserResponse]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if time.monotonic() > expires_at:
+                del self._entries[user_id]
+                return None
+            return user
+    
+    def set(self, user: UserResponse) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl_seconds, user)
+    
+    def invalidate(self, user_id: str) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+
+@lru_cache()
+def get_user_cache() -> UserCache:
+    return UserCache(get_settings().user_cache_ttl_seconds)
+
+
+class PasswordHasherBusyError(Exception):
+    """Raised when too many password hashes are already waiting."""
+    
+    def __init__(self, retry_after: int):
+        super().__init__("Too many sign-ins in progress, please retry shortly")
+        self.retry_after = retry_after
+
+
+class LoginRateLimitedError(Exception):
+    """Raised when an email or client IP has made too many login attempts."""
+    
+    def __init__(self, retry_after: int):
+        super().__init__("Too many login attempts, please retry later")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """bcrypt on a small thread pool instead of the request threads.
+    
+    bcrypt releases the GIL, so ``num_workers`` caps how many cores password
+    hashing can take; request threads only wait on the result. At most
+    ``max_pending`` hashes may be queued or running, beyond that callers get
+    PasswordHasherBusyError instead of piling up behind a login spike.
+    """
+    
+    def __init__(self, rounds: int, num_workers: int, max_pending: int):
+        self.rounds = rounds
+        self._executor = ThreadPoolExecutor(max_workers=max(1, num_workers), thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(max(max_pending, num_workers, 1))
+    
+    def _submit(self, func, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusyError(retry_after=1)
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+    
+    def hash_async(self, password: str) -> Future:
+        def hash_password() -> str:
+            return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(self.rounds)).decode('utf-8')
+        
+        return self._submit(hash_password)
+    
+    def hash(self, password: str) -> str:
+        return self.hash_async(password).result()
+    
+    def verify(self, password: str, password_hash: str) -> bool:
+        return self._submit(bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8')).result()
+    
+    def needs_rehash(self, password_hash: str) -> bool:
+        """True if the hash was made with a cost other than BCRYPT_ROUNDS."""
+        try:
+            return int(password_hash.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+
+class LoginRateLimiter:
+    """Sliding-window limit on login attempts per email and per client IP.
+    
+    Every attempt costs a bcrypt check, so attempts are counted whether or
+    not they succeed; a successful login clears its email's window. Counts
+    are kept per process.
+    """
+    
+    def __init__(self, max_per_email: int, max_per_ip: int, window_seconds: int, max_keys: int = 100000):
+        self.limits = {"email": max_per_email, "ip": max_per_ip}
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._attempts: Dict[Tuple[str, str], Deque[float]] = {}
+        self._lock = threading.Lock()
+    
+    def hit(self, email: str, ip: Optional[str]) -> None:
+        """Record an attempt, raising LoginRateLimitedError if over a limit."""
+        now = time.monotonic()
+        keys = [("email", email.strip().lower())]
+        if ip:
+            keys.append(("ip", ip))
+        
+        with self._lock:
+            if len(self._attempts) > self.max_keys:
+                self._prune(now)
+            
+            retry_after = 0
+            for key in keys:
+                limit = self.limits[key[0]]
+                if limit <= 0:
+                    continue
+                attempts = self._attempts.setdefault(key, deque())
+                while attempts and now - attempts[0] >= self.window_seconds:
+                    attempts.popleft()
+                if len(attempts) >= limit:
+                    retry_after = max(retry_after, int(self.window_seconds - (now - attempts[0])) + 1)
+            
+            if retry_after:
+                raise LoginRateLimitedError(retry_after)
+            
+            for key in keys:
+                if self.limits[key[0]] > 0:
+                    self._attempts[key].append(now)
+    
+    def reset(self, email: str) -> None:
+        with self._lock:
+            self._attempts.pop(("email", email.strip().lower()), None)
+    
+    def _prune(self, now: float) -> None:
+        stale = [key for key, attempts in self._attempts.items() if not attempts or now - attempts[-1] >= self.window_seconds]
+        for key in stale:
+            del self._attempts[key]
+
+
+@lru_cache()
+def get_password_hasher() -> PasswordHasher:
+    settings = get_settings()
+    return PasswordHasher(settings.bcrypt_rounds, settings.password_hash_workers, settings.password_hash_max_pending)
+
+
+@lru_cache()
+def get_login_rate_limiter() -> LoginRateLimiter:
+    settings = get_settings()
+    return LoginRateLimiter(
+        settings.login_max_attempts_per_email,
+        settings.login_max_attempts_per_ip,
+        settings.login_rate_window_seconds,
+    )
+
+
 class AuthService:
     def __init__(self):
-        self.db = DatabaseService()
+        self.db = get_services().database
         self.settings = get_settings()
+        self.user_cache = get_user_cache()
+        self.hasher = get_password_hasher()
+        self.login_limiter = get_login_rate_limiter()
     
     def hash_password(self, password: str) -> str:
-        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        return self.hasher.hash(password)
     
     def verify_password(self, password: str, password_hash: str) -> bool:
-        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+        return self.hasher.verify(password, password_hash)
     
     def create_user(self, user_data: UserCreate) -> UserResponse:
         existing = self.db.select("users").eq("email", user_data.email).execute()
@@ -39,7 +218,9 @@ class AuthService:
         result = self.db.insert("users", user_dict)
         return UserResponse(**result.data[0])
     
-    def authenticate_user(self, login_data: UserLogin) -> tuple[UserResponse, str, str]:
+    def authenticate_user(self, login_data: UserLogin, client_ip: Optional[str] = None) -> tuple[UserResponse, str, str]:
+        self.login_limiter.hit(login_data.email, client_ip)
+        
         result = self.db.select("users").eq("email", login_data.email).execute()
         
         if not result.data:
@@ -50,29 +231,61 @@ class AuthService:
         if not self.verify_password(login_data.password, user_data["password_hash"]):
             raise ValueError("Invalid email or password")
         
+        self.login_limiter.reset(login_data.email)
+        
+        if self.hasher.needs_rehash(user_data["password_hash"]):
+            self._rehash_password(user_data["id"], login_data.password)
+        
         user = UserResponse(**user_data)
         access_token = create_access_token(identity=user.id)
         refresh_token = create_refresh_token(identity=user.id)
         
         return user, access_token, refresh_token
     
+    def _rehash_password(self, user_id: str, password: str) -> None:
+        """Store a hash with the current BCRYPT_ROUNDS in the background,
+        without delaying the login."""
+        def store(future: Future) -> None:
+            try:
+                self.db.update("users", {"password_hash": future.result()}).eq("id", user_id).execute()
+            except Exception as e:
+                print(f"WARNING: could not rehash password for user {user_id}: {e}")
+        
+        try:
+            self.hasher.hash_async(password).add_done_callback(store)
+        except PasswordHasherBusyError:
+            # Try again on a later login
+            pass
+    
     def get_user_by_id(self, user_id: str) -> Optional[UserResponse]:
+        user = self.user_cache.get(user_id)
+        if user:
+            return user
+        
         result = self.db.select("users").eq("id", user_id).execute()
         
         if not result.data:
             return None
         
-        return UserResponse(**result.data[0])
+        user = UserResponse(**result.data[0])
+        self.user_cache.set(user)
+        return user
+    
+    def invalidate_user(self, user_id: str) -> None:
+        self.user_cache.invalidate(user_id)
     
     def update_user(self, user_id: str, update_data: dict) -> UserResponse:
         update_data["updated_at"] = datetime.utcnow().isoformat()
         
+        self.invalidate_user(user_id)
         result = self.db.update("users", update_data).eq("id", user_id).execute()
         
         if not result.data:
             raise ValueError("User not found")
         
-        return UserResponse(**result.data[0])
+        user = UserResponse(**result.data[0])
+        self.user_cache.set(user)
+        return user
     
     def upgrade_to_paid(self, user_id: str, stripe_customer_id: str) -> UserResponse:
         update_data = {
@@ -0,0 +1,88 @@
+import math
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+from services.profiling import ProfileSession, get_profiler
+
+
+@dataclass
+class BatchRequest:
+    prompt: str
+    max_tokens: int
+    future: Future = field(default_factory=Future)
+    # The submitting job's profile, which gets the batch's torch trace
+    profile: Optional[ProfileSession] = None
+
+
+class MicroBatcher:
+    """Collects concurrent generation requests into padded batches.
+
+    The first request opens a window of ``max_wait_ms``; everything that
+    arrives before it closes (up to ``max_batch_size``) is grouped by
+    ``max_tokens`` rounded up to ``token_bucket`` and each group is handed to
+    ``run_batch(prompts, max_tokens)`` as a single call, which must return one
+    result per prompt in order. Batches with a profiled request run with
+    that profile attached, so its torch trace covers the batch.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[str], int], List[Any]],
+        max_batch_size: int = 4,
+        max_wait_ms: int = 50,
+        token_bucket: int = 256,
+    ):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.token_bucket = max(1, token_bucket)
+
+        self._requests: "queue.Queue[BatchRequest]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt: str, max_tokens: int) -> Future:
+        request = BatchRequest(prompt=prompt, max_tokens=max_tokens, profile=get_profiler().current())
+        self._requests.put(request)
+        return request.future
+
+    def _collect(self) -> List[BatchRequest]:
+        batch = [self._requests.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _group(self, batch: List[BatchRequest]) -> List[List[BatchRequest]]:
+        groups: Dict[int, List[BatchRequest]] = {}
+        for request in batch:
+            bucket = math.ceil(request.max_tokens / self.token_bucket)
+            groups.setdefault(bucket, []).append(request)
+        return list(groups.values())
+
+    def _run(self) -> None:
+        while True:
+            for group in self._group(self._collect()):
+                max_tokens = max(request.max_tokens for request in group)
+                profiles = [request.profile for request in group if request.profile is not None]
+                try:
+                    with get_profiler().attach(profiles):
+                        results = self.run_batch([request.prompt for request in group], max_tokens)
+                except Exception as exc:
+                    for request in group:
+                        request.future.set_exception(exc)
+                    continue
+
+                for request, result in zip(group, results):
+                    request.future.set_result(result)
@@ -0,0 +1,85 @@
+import threading
+from functools import lru_cache
+from typing import Any, Callable, Dict
+
+
+class ServiceContainer:
+    """Application-scoped services, built once and shared by every thread.
+
+    The services hold no per-request state, so request handlers, background
+    workers and other services all take them from here. That way their
+    clients (Supabase/httpx, GCS) and connection pools are only set up once.
+    """
+
+    def __init__(self):
+        self._instances: Dict[str, Any] = {}
+        # Re-entrant: building one service may ask for another
+        self._lock = threading.RLock()
+
+    def _get(self, name: str, factory: Callable[[], Any]) -> Any:
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    instance = factory()
+                    self._instances[name] = instance
+        return instance
+
+    def override(self, name: str, instance: Any) -> None:
+        """Use instance as the ``name`` service, e.g. an in-memory stand-in
+        in a benchmark. Must happen before anything takes the service."""
+        with self._lock:
+            self._instances[name] = instance
+
+    def lazy(self, name: str) -> "LazyService":
+        """A stand-in for the ``name`` service that builds it on first use.
+
+        Modules that keep a service in a global take it this way, so
+        importing them does not construct the service and its clients.
+        """
+        return LazyService(self, name)
+
+    @property
+    def database(self):
+        from services.database import DatabaseService
+        return self._get("database", DatabaseService)
+
+    @property
+    def auth(self):
+        from services.auth import AuthService
+        return self._get("auth", AuthService)
+
+    @property
+    def storage(self):
+        from services.storage import StorageService
+        return self._get("storage", StorageService)
+
+    @property
+    def song(self):
+        from services.song import SongService
+        return self._get("song", SongService)
+
+    @property
+    def payment(self):
+        from services.payment import PaymentService
+        return self._get("payment", PaymentService)
+
+
+class LazyService:
+    """Forwards attribute access to a container service, built on first use."""
+
+    def __init__(self, container: ServiceContainer, name: str):
+        self._container = container
+        self._name = name
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(getattr(self._container, self._name), attr)
+
+    def __repr__(self) -> str:
+        return f"<LazyService {self._name}>"
+
+
+@lru_cache()
+def get_services() -> ServiceContainer:
+    return ServiceContainer()
@@ -1,12 +1,67 @@
-from supabase import create_client, Client
+import importlib.util
+import time
 from config import get_settings
 from functools import lru_cache
+from typing import TYPE_CHECKING, List, Optional, Union
+from services.metrics import DB_ERRORS, DB_REQUEST_SECONDS
+
+if TYPE_CHECKING:
+    from supabase import Client
 
 
 @lru_cache()
-def get_supabase_client() -> Client:
+def get_supabase_client() -> "Client":
+    """One Supabase client per process, shared by all threads.
+
+    The PostgREST session is rebuilt with our own pool limits, so concurrent
+    requests reuse kept-alive connections instead of each paying a TLS
+    handshake. Every request it makes is timed for /metrics.
+    """
+    import httpx
+    from supabase import create_client
+    
     settings = get_settings()
-    return create_client(settings.supabase_url, settings.supabase_key)
+    client = create_client(settings.supabase_url, settings.supabase_key)
+    
+    postgrest = client.postgrest
+    session = postgrest.session
+    postgrest.session = type(session)(
+        base_url=session.base_url,
+        headers=session.headers,
+        timeout=session.timeout,
+        follow_redirects=True,
+        # postgrest installs httpx[http2]; fall back to HTTP/1.1 without h2
+        http2=importlib.util.find_spec("h2") is not None,
+        limits=httpx.Limits(
+            max_connections=settings.supabase_max_connections,
+            max_keepalive_connections=settings.supabase_max_keepalive_connections,
+            keepalive_expiry=settings.supabase_keepalive_expiry_seconds,
+        ),
+        event_hooks={"request": [_start_request_timer], "response": [_record_request]},
+    )
+    session.close()
+    return client
+
+
+def _start_request_timer(request) -> None:
+    request.extensions["musicgen_started"] = time.perf_counter()
+
+
+def _record_request(response) -> None:
+    """Time a PostgREST request up to its response headers.
+
+    Labelled by the table (or RPC function): the last segment of
+    /rest/v1/<table> and /rest/v1/rpc/<function>.
+    """
+    request = response.request
+    started = request.extensions.get("musicgen_started")
+    if started is None:
+        return
+    
+    table = request.url.path.rstrip("/").rsplit("/", 1)[-1]
+    DB_REQUEST_SECONDS.observe(time.perf_counter() - started, (request.method, table))
+    if response.status_code >= 400:
+        DB_ERRORS.inc(labels=(table, str(response.status_code)))
 
 
 class DatabaseService:
@@ -16,14 +71,17 @@ class DatabaseService:
     def execute_query(self, query):
         return query.execute()
     
-    def insert(self, table: str, data: dict):
+    def insert(self, table: str, data: Union[dict, List[dict]]):
         return self.client.table(table).insert(data).execute()
     
-    def select(self, table: str, columns: str = "*"):
-        return self.client.table(table).select(columns)
+    def select(self, table: str, columns: str = "*", count: Optional[str] = None):
+        return self.client.table(table).select(columns, count=count)
     
     def update(self, table: str, data: dict):
         return self.client.table(table).update(data)
     
     def delete(self, table: str):
         return self.client.table(table).delete()
+    
+    def rpc(self, function: str, params: dict):
+        return self.client.rpc(function, params)
@@ -0,0 +1,85 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Set, Tuple
+
+
+class EventBroker:
+    """In-process publish/subscribe for song status changes.
+
+    Channels are user ids. Subscribers get a bounded queue; a subscriber that
+    falls behind loses events rather than blocking the publisher. Only
+    subscribers in the same process see an event, so a multi-process
+    deployment should swap this for a broker (e.g. Redis pub/sub) behind the
+    same publish/subscribe/unsubscribe interface.
+    """
+
+    def __init__(self, max_queue_size: int = 100):
+        self.max_queue_size = max_queue_size
+        self._subscribers: Dict[str, Set[queue.Queue]] = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel: str) -> queue.Queue:
+        subscription = queue.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, channel: str, subscription: queue.Queue) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is None:
+                return
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[channel]
+
+    def publish(self, channel: str, event: dict) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait(event)
+            except queue.Full:
+                pass
+
+
+class SyncTokenCache:
+    """The latest sync token of each user, shared by that user's streams.
+
+    Every open event stream resyncs on its own timer; with the cache a user
+    costs one database read per ``max_age`` in this process however many
+    tabs they have open.
+    """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._tokens: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, max_age: float, load: Callable[[str], Optional[str]]) -> Optional[str]:
+        with self._lock:
+            cached = self._tokens.get(user_id)
+            if cached is not None and time.monotonic() - cached[1] < max_age:
+                return cached[0]
+
+        token = load(user_id)
+        with self._lock:
+            self._tokens[user_id] = (token, time.monotonic())
+            self._tokens.move_to_end(user_id)
+            while len(self._tokens) > self.max_entries:
+                self._tokens.popitem(last=False)
+        return token
+
+
+@lru_cache()
+def get_event_broker() -> EventBroker:
+    return EventBroker()
+
+
+@lru_cache()
+def get_sync_tokens() -> SyncTokenCache:
+    return SyncTokenCache()
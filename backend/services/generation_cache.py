@@ -0,0 +1,254 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+from config import get_settings
+from services.music_generator import MusicGenerator
+from services.container import get_services
+from services.storage import get_upload_pool
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    blob_name: str
+    size: int
+    created_at: float
+
+
+class GenerationCache:
+    """Content-addressed cache of generated audio.
+
+    Entries are keyed by a hash of the normalized prompt, ``max_tokens``, the
+    model id and the generation parameters, and each owns a ``cache/<key>.wav``
+    blob in storage. Songs get their own copy of the blob, so deleting a song
+    never affects the cache and evicting an entry frees its storage.
+
+    The index lives in memory, one per process, and is rebuilt from the
+    blobs under ``cache/`` by ``rebuild_index`` so a restart neither loses
+    nor orphans them. Each process applies ``max_bytes`` to its own index.
+    """
+
+    BLOB_PREFIX = "cache"
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl_seconds: int, generation_params: Optional[dict] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.generation_params = generation_params or {}
+        self.storage = get_services().storage
+
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize_prompt(prompt: str) -> str:
+        # Whitespace only: the text encoder is case-sensitive
+        return " ".join(prompt.split())
+
+    def key_for(self, prompt: str, max_tokens: int) -> str:
+        payload = json.dumps({
+            "prompt": self.normalize_prompt(prompt),
+            "max_tokens": max_tokens,
+            "model": MusicGenerator().model_id,
+            "params": self.generation_params,
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def rebuild_index(self) -> int:
+        """Index the cache blobs already in storage, oldest first, and delete
+        the expired ones and those over budget. Returns the entries indexed."""
+        prefix = f"{self.BLOB_PREFIX}/"
+        now = time.time()
+        found, expired = [], []
+        for blob_name, size, created_at in sorted(self.storage.list_file_stats(prefix), key=lambda stat: stat[2]):
+            if not blob_name.endswith(".wav"):
+                continue
+            entry = CacheEntry(key=blob_name[len(prefix):-len(".wav")], blob_name=blob_name, size=size, created_at=created_at)
+            (expired if now - created_at > self.ttl_seconds else found).append(entry)
+
+        with self._lock:
+            # Entries stored since startup are newer and stay at the end
+            for entry in reversed(found):
+                if entry.key not in self._entries:
+                    self._entries[entry.key] = entry
+                    self._entries.move_to_end(entry.key, last=False)
+                    self._bytes += entry.size
+            evicted = self._evict()
+            indexed = sum(1 for entry in found if self._entries.get(entry.key) is entry)
+
+        self._delete_blobs(expired + evicted)
+        return indexed
+
+    def copy_cached(self, key: str, blob_name: str) -> Optional[str]:
+        """Copy a cached result to blob_name and return its URL, or None on a miss."""
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+
+        try:
+            return self.storage.copy_file(entry.blob_name, blob_name)
+        except Exception:
+            # The blob went missing behind our back; treat it as a miss
+            self._discard(key)
+            return None
+
+    def render(self, prompt: str, max_tokens: int, blob_name: str, on_chunk: Optional[Callable] = None) -> str:
+        """Store audio for the prompt at blob_name and return its URL.
+
+        The model only runs on a miss, and identical requests that arrive
+        while a generation is in flight wait for it instead of running again.
+        on_chunk is passed to MusicGenerator.generate_audio and is only called
+        when this request is the one running the model.
+        """
+        return self.render_async(prompt, max_tokens, blob_name, on_chunk).result()
+
+    def render_async(self, prompt: str, max_tokens: int, blob_name: str, on_chunk: Optional[Callable] = None) -> Future:
+        """Like render, but only the model runs on the calling thread.
+
+        Storing the result is left to the upload pool; the returned Future
+        resolves to the URL once blob_name is written.
+        """
+        key = self.key_for(prompt, max_tokens)
+        result = Future()
+
+        url = self.copy_cached(key, blob_name)
+        if url:
+            result.set_result(url)
+            return result
+
+        def copy(entry_future: Future):
+            try:
+                result.set_result(self.storage.copy_file(entry_future.result().blob_name, blob_name))
+            except Exception as exc:
+                result.set_exception(exc)
+
+        self._get_or_generate(key, prompt, max_tokens, on_chunk).add_done_callback(copy)
+        return result
+
+    def _lookup(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            if time.time() - entry.created_at > self.ttl_seconds:
+                expired = self._pop(key)
+            else:
+                self._entries.move_to_end(key)
+                return entry
+
+        self._delete_blobs([expired])
+        return None
+
+    def _get_or_generate(self, key: str, prompt: str, max_tokens: int, on_chunk: Optional[Callable]) -> Future:
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                return future
+
+            future = Future()
+            entry = self._entries.get(key)
+            if entry is not None:
+                future.set_result(entry)
+                return future
+
+            self._in_flight[key] = future
+
+        try:
+            audio = MusicGenerator().generate_audio(prompt, max_tokens, on_chunk=on_chunk)
+        except Exception as exc:
+            self._finish(key, future, exc=exc)
+            raise
+
+        get_upload_pool().submit(self._store, key, audio, future)
+        return future
+
+    def _store(self, key: str, audio, future: Future) -> None:
+        try:
+            blob_name = f"{self.BLOB_PREFIX}/{key}.wav"
+            size = audio.size
+            self.storage.upload_audio(audio, blob_name)
+        except Exception as exc:
+            self._finish(key, future, exc=exc)
+            return
+        finally:
+            audio.close()
+
+        entry = CacheEntry(key=key, blob_name=blob_name, size=size, created_at=time.time())
+
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            self._entries[key] = entry
+            self._bytes += size
+            evicted = self._evict()
+
+        self._delete_blobs(evicted)
+        self._finish(key, future, entry=entry)
+
+    def _finish(self, key: str, future: Future, entry: Optional[CacheEntry] = None, exc: Optional[Exception] = None) -> None:
+        with self._lock:
+            self._in_flight.pop(key, None)
+        if exc is not None:
+            future.set_exception(exc)
+        else:
+            future.set_result(entry)
+
+    def _evict(self) -> List[CacheEntry]:
+        evicted = []
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            oldest = next(iter(self._entries))
+            evicted.append(self._pop(oldest))
+        return evicted
+
+    def _pop(self, key: str) -> CacheEntry:
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        return entry
+
+    def _discard(self, key: str) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+
+    def _delete_blobs(self, entries: List[CacheEntry]) -> None:
+        for entry in entries:
+            try:
+                self.storage.delete_file(entry.blob_name)
+            except Exception:
+                pass
+
+
+@lru_cache()
+def get_generation_cache() -> Optional[GenerationCache]:
+    settings = get_settings()
+    if not settings.generation_cache_enabled:
+        return None
+
+    cache = GenerationCache(
+        max_entries=settings.generation_cache_max_entries,
+        max_bytes=settings.generation_cache_max_mb * 1024 * 1024,
+        ttl_seconds=settings.generation_cache_ttl_seconds,
+    )
+    # Off the request path; until it finishes, older entries are misses
+    threading.Thread(target=_rebuild_index, args=(cache,), name="generation-cache-index", daemon=True).start()
+    return cache
+
+
+def _rebuild_index(cache: GenerationCache) -> None:
+    try:
+        indexed = cache.rebuild_index()
+        if indexed:
+            print(f"Generation cache: indexed {indexed} stored entries")
+    except Exception as e:
+        print(f"WARNING: could not index the generation cache: {e}")
@@ -0,0 +1,448 @@
+"""Dedicated MusicGen inference server shared by all web workers.
+
+Run it next to the app and point the app at it:
+
+    python -m services.inference_server
+    INFERENCE_SERVER_ADDRESS=/tmp/musicgen.sock gunicorn ...
+
+The server loads the weights once, moves them to shared memory and starts
+INFERENCE_SERVER_REPLICAS replica processes that map the same tensors, so
+model memory stays the same however many replicas and web workers there
+are. Replicas are spawned fresh rather than forked, because forking a
+process that has used torch (OpenMP) or runs threads can leave the child
+hung on a lock; the model is handed over through torch.multiprocessing,
+which sends the shared tensors as file descriptors instead of copies.
+Replicas take requests from one queue, so an idle replica always gets the
+next song, and each one can be pinned to its own share of the CPUs.
+
+Web workers connect over a Unix socket or a loopback port
+(multiprocessing.connection, authenticated with SECRET_KEY) and never import
+torch themselves. The protocol is pickle, so anyone who can connect and
+knows SECRET_KEY can run code in the server; it refuses to listen on other
+interfaces.
+"""
+import ipaddress
+import multiprocessing
+import os
+import queue
+import resource
+import signal
+import sys
+import threading
+import uuid
+from functools import lru_cache
+from multiprocessing.connection import Client, Listener
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import numpy as np
+from config import get_settings
+
+
+def parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    """``host:port`` for TCP, anything else is a Unix socket path."""
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def is_local_address(address: Union[str, Tuple[str, int]]) -> bool:
+    """True for Unix socket paths and loopback host:port addresses."""
+    if isinstance(address, str):
+        return True
+    host = address[0]
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class InferenceServerUnavailable(RuntimeError):
+    pass
+
+
+class InferenceClient:
+    """Runs MusicGenerator._synthesize on the inference server.
+
+    Each call opens its own connection, so any number of threads may use
+    one client.
+    """
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self._info: Optional[dict] = None
+
+    def _connect(self):
+        try:
+            return Client(self.address, authkey=self.authkey)
+        except (OSError, EOFError) as e:
+            raise InferenceServerUnavailable(f"Inference server at {self.address} is unavailable: {e}")
+
+    def info(self) -> dict:
+        """model_id, sampling_rate, state and replica counts of the server.
+
+        Cached once the server reports ready, since none of it changes after.
+        """
+        if self._info is not None:
+            return self._info
+
+        with self._connect() as conn:
+            conn.send(("info",))
+            _, info = conn.recv()
+
+        if info["state"] == "ready":
+            self._info = info
+        return info
+
+    def state(self) -> str:
+        try:
+            return self.info()["state"]
+        except InferenceServerUnavailable:
+            return "cold"
+
+    def synthesize(self, prompt: str, max_tokens: int, on_chunk: Optional[Callable[[np.ndarray], None]] = None) -> Tuple[np.ndarray, int]:
+        with self._connect() as conn:
+            conn.send(("synthesize", prompt, max_tokens, on_chunk is not None))
+            while True:
+                try:
+                    kind, *payload = conn.recv()
+                except EOFError:
+                    raise InferenceServerUnavailable("Inference server closed the connection")
+
+                if kind == "chunk":
+                    on_chunk(payload[0])
+                elif kind == "done":
+                    audio, sampling_rate = payload
+                    return audio, sampling_rate
+                else:
+                    raise RuntimeError(payload[0])
+
+
+@lru_cache()
+def get_inference_client() -> Optional[InferenceClient]:
+    """The client for INFERENCE_SERVER_ADDRESS, or None to run the model in process."""
+    settings = get_settings()
+    if not settings.inference_server_address:
+        return None
+    return InferenceClient(settings.inference_server_address, settings.secret_key.encode("utf-8"))
+
+
+def split_cpus(replicas: int) -> List[List[int]]:
+    """Divide the CPUs this process may use into one contiguous set per replica."""
+    cpus = sorted(os.sched_getaffinity(0))
+    per_replica = max(1, len(cpus) // replicas)
+    sets = []
+    for index in range(replicas):
+        start = (index * per_replica) % len(cpus)
+        sets.append(cpus[start:start + per_replica])
+    return sets
+
+
+def _run_replica(index: int, cpus: Optional[List[int]], conn, concurrency: int, processor, model) -> None:
+    """Main loop of a replica process: run the jobs the server sends over conn
+    with the model the server loaded."""
+    from services.music_generator import MusicGenerator
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    settings = get_settings()
+    # The replica runs the model itself instead of calling the server
+    MusicGenerator._serving = True
+
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+
+    generator = MusicGenerator()
+    generator._use_model(processor, model)
+    if generator._model != "mock":
+        import torch
+        threads = settings.torch_num_threads or len(cpus or os.sched_getaffinity(0))
+        # Batched jobs share one generate call on the MicroBatcher thread,
+        # so they get all the threads; only streamed jobs, which skip the
+        # batcher, run side by side and split them
+        parallel = concurrency if settings.audio_stream_chunk_tokens > 0 else 1
+        torch.set_num_threads(max(1, threads // parallel))
+
+    if settings.model_warmup:
+        generator.warm_up()
+
+    send_lock = threading.Lock()
+
+    def send(*message) -> None:
+        with send_lock:
+            conn.send(message)
+
+    jobs = queue.Queue()
+
+    def work():
+        while True:
+            request_id, prompt, max_tokens, stream = jobs.get()
+            on_chunk = (lambda chunk: send("chunk", request_id, chunk)) if stream else None
+            try:
+                audio, sampling_rate = generator._synthesize(prompt, max_tokens, on_chunk)
+            except Exception as e:
+                send("error", request_id, str(e))
+            else:
+                send("done", request_id, (audio, sampling_rate))
+
+    # With GENERATION_BATCH_SIZE > 1 the server sends that many jobs at once,
+    # so the replica's MicroBatcher can combine them into one generate call
+    for _ in range(concurrency):
+        threading.Thread(target=work, daemon=True).start()
+
+    send("ready", None, None)
+    while True:
+        try:
+            jobs.put(conn.recv())
+        except (EOFError, OSError):
+            # The server is gone
+            return
+
+
+class Replica:
+    """The server's end of one replica process."""
+
+    def __init__(self, index: int, process, conn, concurrency: int):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.concurrency = concurrency
+        # One slot per job the replica may run at a time
+        self.slots = threading.Semaphore(concurrency)
+        self.running = set()
+        self.ready = False
+        self.alive = True
+
+
+class InferenceServer:
+    """Accepts connections from web workers and hands songs to the replicas.
+
+    Each replica has its own pipe and is only sent a job when it has a free
+    slot, so songs go to whichever replica is idle and a replica that dies
+    cannot take the others down with it.
+    """
+
+    def __init__(self, address: str, replicas: int, pin_cpus: bool):
+        self.settings = get_settings()
+        self.address = parse_address(address)
+        if not is_local_address(self.address):
+            raise ValueError(
+                "INFERENCE_SERVER_ADDRESS must be a Unix socket path or a loopback host:port; "
+                "the protocol runs code sent by anyone who knows SECRET_KEY"
+            )
+        self.replicas = max(1, replicas)
+        self.cpu_sets = split_cpus(self.replicas) if pin_cpus and hasattr(os, "sched_setaffinity") else [None] * self.replicas
+        self.concurrency = max(1, self.settings.generation_batch_size)
+
+        # Never fork: see the module docstring
+        self._context = multiprocessing.get_context("spawn")
+        self._replicas: Dict[int, Replica] = {}
+        self._pending = queue.Queue()
+        # request id -> queue of result messages for the connection thread
+        self._waiting: Dict[str, "queue.Queue"] = {}
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def serve_forever(self) -> None:
+        from services.music_generator import MusicGenerator
+
+        MusicGenerator._serving = True
+        generator = MusicGenerator()
+        generator._ensure_loaded()
+        self.model_id = generator.model_id
+        self.sampling_rate = generator.sampling_rate
+        self._model = (generator._processor, generator._model)
+
+        if generator._model != "mock":
+            # Registers the reductions that pass tensors to the replicas as
+            # shared memory
+            import torch.multiprocessing  # noqa: F401
+
+            generator._model.share_memory()
+            # Every shared tensor holds a file descriptor open
+            _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+        for index in range(self.replicas):
+            self._spawn(index)
+
+        listener = Listener(self.address, authkey=self.settings.secret_key.encode("utf-8"))
+        print(f"Inference server for {self.model_id} listening on {listener.address} with {self.replicas} replica(s)")
+
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, multiprocessing.AuthenticationError) as e:
+                    print(f"WARNING: rejected inference connection: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        finally:
+            self._stopping = True
+            listener.close()
+            for replica in self._replicas.values():
+                replica.process.terminate()
+
+    def _spawn(self, index: int) -> None:
+        conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_run_replica,
+            args=(index, self.cpu_sets[index], child_conn, self.concurrency, *self._model),
+            name=f"inference-replica-{index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+
+        replica = Replica(index, process, conn, self.concurrency)
+        self._replicas[index] = replica
+        threading.Thread(target=self._feed, args=(replica,), name=f"inference-feed-{index}", daemon=True).start()
+        threading.Thread(target=self._read, args=(replica,), name=f"inference-read-{index}", daemon=True).start()
+
+    def _feed(self, replica: Replica) -> None:
+        """Send pending jobs to the replica whenever it has a free slot."""
+        while True:
+            replica.slots.acquire()
+            if not replica.alive:
+                return
+            job = self._pending.get()
+            if not replica.alive:
+                self._pending.put(job)
+                return
+
+            with self._lock:
+                replica.running.add(job[0])
+            try:
+                replica.conn.send(job)
+            except OSError:
+                with self._lock:
+                    replica.running.discard(job[0])
+                self._pending.put(job)
+                return
+
+    def _read(self, replica: Replica) -> None:
+        """Pass the replica's results on; replace it once it exits."""
+        while True:
+            try:
+                kind, request_id, payload = replica.conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if kind == "ready":
+                replica.ready = True
+                continue
+
+            with self._lock:
+                if kind != "chunk":
+                    replica.running.discard(request_id)
+                messages = self._waiting.get(request_id)
+            if kind != "chunk":
+                replica.slots.release()
+            if messages is not None:
+                messages.put((kind, payload))
+
+        replica.alive = False
+        replica.process.join()
+        # Wake the feeder so it notices
+        replica.slots.release()
+
+        with self._lock:
+            lost = [self._waiting.get(request_id) for request_id in replica.running]
+            replica.running.clear()
+        for messages in lost:
+            if messages is not None:
+                messages.put(("error", "Inference replica exited"))
+
+        if self._stopping:
+            return
+        if not replica.ready:
+            # Most likely the model failed to start, which a restart will not fix
+            print(f"ERROR: inference replica {replica.index} exited with {replica.process.exitcode} before it was ready")
+            return
+        print(f"WARNING: inference replica {replica.index} exited with {replica.process.exitcode}, restarting")
+        self._spawn(replica.index)
+
+    def _state(self) -> str:
+        replicas = list(self._replicas.values())
+        if any(replica.ready and replica.alive for replica in replicas):
+            return "ready"
+        if not any(replica.alive for replica in replicas):
+            return "failed"
+        return "warming" if self.settings.model_warmup else "loading"
+
+    def _handle(self, conn) -> None:
+        request_id = None
+        try:
+            request = conn.recv()
+            if request[0] == "info":
+                conn.send(("info", {
+                    "model_id": self.model_id,
+                    "sampling_rate": self.sampling_rate,
+                    "state": self._state(),
+                    "replicas": self.replicas,
+                    "ready_replicas": sum(1 for replica in list(self._replicas.values()) if replica.ready and replica.alive),
+                }))
+                return
+
+            _, prompt, max_tokens, stream = request
+            request_id = str(uuid.uuid4())
+            messages = queue.Queue()
+            with self._lock:
+                self._waiting[request_id] = messages
+            self._pending.put((request_id, prompt, max_tokens, stream))
+
+            while True:
+                kind, payload = messages.get()
+                if kind == "chunk":
+                    conn.send(("chunk", payload))
+                    continue
+                if kind == "done":
+                    conn.send(("done", *payload))
+                else:
+                    conn.send(("error", payload))
+                return
+        except (EOFError, OSError):
+            pass
+        finally:
+            if request_id is not None:
+                with self._lock:
+                    self._waiting.pop(request_id, None)
+            conn.close()
+
+
+def main():
+    settings = get_settings()
+    if not settings.inference_server_address:
+        raise SystemExit("Set INFERENCE_SERVER_ADDRESS to the socket path or host:port to listen on")
+
+    address = parse_address(settings.inference_server_address)
+    if isinstance(address, str) and os.path.exists(address):
+        # A socket left over from a previous run
+        os.remove(address)
+
+    # Stop (and take the replicas down) on SIGTERM as on Ctrl+C. Later
+    # SIGTERMs, e.g. one sent to the whole process group, must not interrupt
+    # the shutdown.
+    def stop(*_):
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        server = InferenceServer(
+            settings.inference_server_address,
+            replicas=settings.inference_server_replicas,
+            pin_cpus=settings.inference_server_pin_cpus,
+        )
+    except ValueError as e:
+        raise SystemExit(str(e))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
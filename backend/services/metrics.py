@@ -0,0 +1,232 @@
+"""Counters, gauges and histograms served on /metrics.
+
+Metrics are kept per process and rendered in the Prometheus text format.
+Recording one is a dict update under a lock, cheap enough to stay on around
+every stage of a song. Gauges that mirror state kept elsewhere, such as
+queue depth, are read when /metrics is scraped instead of on every change.
+"""
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TOKEN_RATE_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _labels(self, labels: LabelValues, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, labels: LabelValues = ()) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, labels: LabelValues = ()) -> float:
+        with self._lock:
+            return self._values.get(labels, 0.0)
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{self._labels(labels)} {_format_value(value)}"
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._functions: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set(self, value: float, labels: LabelValues = ()) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, amount: float = 1.0, labels: LabelValues = ()) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, labels: LabelValues = ()) -> None:
+        self.inc(-amount, labels)
+
+    def set_function(self, function: Callable[[], float], labels: LabelValues = ()) -> None:
+        """Report function() for these labels, called on every scrape."""
+        with self._lock:
+            self._functions[labels] = function
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+        for labels, function in functions:
+            try:
+                values[labels] = function()
+            except Exception:
+                continue
+        for labels, value in values.items():
+            yield f"{self.name}{self._labels(labels)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> observations per bucket (the last one is +Inf), then the sum
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, labels: LabelValues = ()) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def timer(self, labels: LabelValues = ()):
+        """Observe the seconds spent in the with block, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, labels)
+
+    def timed(self, labels: LabelValues = ()):
+        """Decorator form of timer."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count(self, labels: LabelValues = ()) -> int:
+        with self._lock:
+            state = self._values.get(labels)
+            return sum(state[:-1]) if state else 0
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = [(labels, list(state)) for labels, state in self._values.items()]
+        for labels, state in values:
+            cumulative = 0
+            for bound, observed in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += observed
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{self._labels(labels, le)} {cumulative}"
+            yield f"{self.name}_sum{self._labels(labels)} {_format_value(state[-1])}"
+            yield f"{self.name}_count{self._labels(labels)} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        """Add metric, or return the one already registered under its name."""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+QUEUE_DEPTH = REGISTRY.gauge(
+    "musicgen_queue_depth", "Jobs waiting in a worker pool queue", ["pool"])
+JOBS_IN_FLIGHT = REGISTRY.gauge(
+    "musicgen_jobs_in_flight", "Jobs a worker pool is running", ["pool"])
+QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "musicgen_queue_wait_seconds", "Time jobs waited in a worker pool queue", ["pool"])
+JOB_SECONDS = REGISTRY.histogram(
+    "musicgen_job_seconds", "Time a worker spent running a job", ["pool"])
+STAGE_SECONDS = REGISTRY.histogram(
+    "musicgen_stage_seconds",
+    "Time spent in each stage of making a song: model_load, tokenize, generate, "
+    "synthesize, wav_encode, upload, transcode",
+    ["stage"])
+GENERATED_TOKENS = REGISTRY.counter(
+    "musicgen_generated_tokens_total", "Audio tokens generated by the model")
+TOKENS_PER_SECOND = REGISTRY.histogram(
+    "musicgen_tokens_per_second", "Audio tokens per second of each model.generate call",
+    buckets=TOKEN_RATE_BUCKETS)
+SONGS = REGISTRY.counter(
+    "musicgen_songs_total", "Songs and anonymous jobs by final status", ["kind", "status"])
+UPLOAD_BYTES = REGISTRY.counter(
+    "musicgen_upload_bytes_total", "Bytes uploaded to storage")
+DB_REQUEST_SECONDS = REGISTRY.histogram(
+    "musicgen_db_request_seconds", "Supabase requests by method and table or function",
+    ["method", "table"])
+ENCODE_ERRORS = REGISTRY.counter(
+    "musicgen_encode_errors_total", "Song encodes that failed, by format", ["format"])
+DB_CALLS_PER_SONG = REGISTRY.gauge(
+    "musicgen_db_calls_per_song", "Database calls spent per finished song, from insert to completed/failed")
+DB_ERRORS = REGISTRY.counter(
+    "musicgen_db_errors_total", "Supabase requests answered with an error status",
+    ["table", "status"])
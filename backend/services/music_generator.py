@@ -1,80 +1,388 @@
-import scipy
+import io
 import os
+import importlib.util
 import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+import numpy as np
 from config import get_settings
+from services.batcher import MicroBatcher
+from services.metrics import GENERATED_TOKENS, STAGE_SECONDS, TOKENS_PER_SECOND
+from services.profiling import get_profiler
+
+
+@dataclass
+class GeneratedAudio:
+    """A WAV file held in ``buffer``, or at ``path`` when it was too large."""
+    buffer: Optional[io.BytesIO] = None
+    path: Optional[str] = None
+    
+    @property
+    def size(self) -> int:
+        if self.buffer is not None:
+            return self.buffer.getbuffer().nbytes
+        return os.path.getsize(self.path)
+    
+    def close(self) -> None:
+        if self.buffer is not None:
+            self.buffer.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
 
 
 class MusicGenerator:
+    MODEL_ID = "facebook/musicgen-small"
+    # Short names accepted by MUSICGEN_MODEL; anything else is used as a
+    # Hugging Face model id or a local directory
+    MODEL_VARIANTS = {
+        "small": "facebook/musicgen-small",
+        "medium": "facebook/musicgen-medium",
+        "large": "facebook/musicgen-large",
+        "melody": "facebook/musicgen-melody",
+    }
+    PRECISIONS = ("fp32", "bf16", "int8")
+    
     _instance = None
     _processor = None
     _model = None
-    _loading = False
+    _load_lock = threading.Lock()
+    _state = "cold"
+    # Set once warm_up has run its dummy generation in this process
+    _warmed = False
+    _batcher = None
+    _batcher_lock = threading.Lock()
+    _threads_configured = False
+    # True inside the inference server, which must run the model itself
+    _serving = False
     
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(MusicGenerator, cls).__new__(cls)
         return cls._instance
     
+    @classmethod
+    def _server(cls):
+        """The inference server client, or None when the model runs in this process."""
+        if cls._serving:
+            return None
+        from services.inference_server import get_inference_client
+        return get_inference_client()
+    
+    @property
+    def state(self) -> str:
+        """One of cold, loading, warming, ready or failed."""
+        server = self._server()
+        if server:
+            return server.state()
+        return self._state
+    
+    @property
+    def is_ready(self) -> bool:
+        return self.state == "ready"
+    
+    @classmethod
+    def model_name(cls) -> str:
+        """The model MUSICGEN_MODEL selects: a Hugging Face id or a local path."""
+        model = get_settings().musicgen_model.strip()
+        return cls.MODEL_VARIANTS.get(model.lower(), model) or cls.MODEL_ID
+    
+    @classmethod
+    def precision(cls) -> str:
+        precision = get_settings().musicgen_precision.strip().lower()
+        if precision not in cls.PRECISIONS:
+            raise ValueError(f"MUSICGEN_PRECISION must be one of: {', '.join(cls.PRECISIONS)}")
+        return precision
+    
+    @property
+    def model_id(self) -> str:
+        """Identifies what produced the audio, for cache keys."""
+        server = self._server()
+        if server:
+            try:
+                return server.info()["model_id"]
+            except Exception:
+                # Same settings as the server, so the same id unless it runs mock
+                pass
+        elif self._model == "mock":
+            return "mock"
+        elif self._model is None and (self.model_name() == "mock" or importlib.util.find_spec("transformers") is None):
+            return "mock"
+        
+        precision = self.precision()
+        # Reduced precision changes the output, so it is part of the id
+        return self.model_name() if precision == "fp32" else f"{self.model_name()}@{precision}"
+    
     def _ensure_loaded(self):
         if self._processor is not None and self._model is not None:
             return
         
-        if self._loading:
+        # Threads arriving during the load wait here instead of seeing a
+        # half-initialised model
+        with self._load_lock:
+            if self._processor is not None and self._model is not None:
+                return
+            
+            MusicGenerator._state = "loading"
+            try:
+                with STAGE_SECONDS.timer(("model_load",)):
+                    self._load()
+            except Exception:
+                MusicGenerator._state = "failed"
+                raise
+            
+            if MusicGenerator._state == "loading":
+                # With MODEL_WARMUP the model is not ready until warm_up
+                # has run, even when a request loaded it first
+                MusicGenerator._state = "warming" if self._needs_warm_up() else "ready"
+    
+    def _use_model(self, processor, model) -> None:
+        """Run a model loaded by another process, as the inference server's
+        replicas do with the weights it shares with them."""
+        with self._load_lock:
+            if model != "mock":
+                self._configure_threads()
+            self._processor = processor
+            self._model = model
+            MusicGenerator._state = "warming" if self._needs_warm_up() else "ready"
+    
+    def _needs_warm_up(self) -> bool:
+        return get_settings().model_warmup and not self._warmed and self._model != "mock"
+    
+    def _load(self):
+        if self.model_name() == "mock":
+            self._processor = "mock"
+            self._model = "mock"
+            print("Using MOCK mode (MUSICGEN_MODEL=mock) - synthetic audio, no model loaded")
             return
         
-        self._loading = True
-        
         try:
+            from transformers import AutoProcessor, MusicgenForConditionalGeneration
+            has_transformers = True
+        except ImportError:
+            has_transformers = False
+            print("WARNING: transformers not installed. Install with: pip install -r requirements-ml.txt")
+        
+        if not has_transformers:
+            self._processor = "mock"
+            self._model = "mock"
+            print("Using MOCK mode - no actual music will be generated!")
+            return
+        
+        import torch
+        from transformers import AutoConfig
+        
+        settings = get_settings()
+        os.environ['HF_HOME'] = settings.hf_home
+        self._configure_threads()
+        
+        model_name = self.model_name()
+        precision = self.precision()
+        
+        print(f"Loading MusicGen model {model_name} ({precision}, this may take a while on first run)...")
+        processor = AutoProcessor.from_pretrained(model_name)
+        
+        if AutoConfig.from_pretrained(model_name).model_type == "musicgen_melody":
+            from transformers import MusicgenMelodyForConditionalGeneration as model_class
+        else:
+            model_class = MusicgenForConditionalGeneration
+        model = model_class.from_pretrained(model_name)
+        
+        if precision == "bf16":
+            model = model.to(torch.bfloat16)
+        elif precision == "int8":
+            # Weights of the linear layers (nearly all of the decoder) are
+            # stored as int8 and activations quantized on the fly
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        model.eval()
+        
+        self._processor = processor
+        self._model = model
+        print("Model loaded successfully!")
+    
+    @classmethod
+    def _configure_threads(cls):
+        """Apply TORCH_NUM_THREADS and TORCH_INTEROP_THREADS once per process."""
+        if cls._threads_configured:
+            return
+        cls._threads_configured = True
+        
+        import torch
+        
+        settings = get_settings()
+        if settings.torch_num_threads > 0:
+            torch.set_num_threads(settings.torch_num_threads)
+        if settings.torch_interop_threads > 0:
             try:
-                from transformers import AutoProcessor, MusicgenForConditionalGeneration
-                has_transformers = True
-            except ImportError:
-                has_transformers = False
-                print("WARNING: transformers not installed. Install with: pip install -r requirements-ml.txt")
-            
-            if not has_transformers:
-                self._processor = "mock"
-                self._model = "mock"
-                print("Using MOCK mode - no actual music will be generated!")
-                return
-            
-            settings = get_settings()
-            os.environ['HF_HOME'] = settings.hf_home
-            
-            print("Loading MusicGen model (this may take a while on first run)...")
-            self._processor = AutoProcessor.from_pretrained("facebook/musicgen-small")
-            self._model = MusicgenForConditionalGeneration.from_pretrained("facebook/musicgen-small")
-            print("Model loaded successfully!")
-        finally:
-            self._loading = False
-    
-    def generate(self, prompt: str, max_tokens: int) -> str:
+                torch.set_num_interop_threads(settings.torch_interop_threads)
+            except RuntimeError as e:
+                # Only allowed before torch has run any parallel work
+                print(f"WARNING: could not set torch interop threads: {e}")
+    
+    def warm_up(self, max_tokens: int = 16):
+        """Load the model and run a short dummy generation so the first real
+        request does not pay for cold kernels and lazy allocations."""
+        if self._warmed or self._server():
+            # The inference server warms up its own replicas
+            return
+        
         self._ensure_loaded()
         
-        if self._processor == "mock" or self._model == "mock":
-            return self._generate_mock(prompt, max_tokens)
+        if self._model != "mock":
+            MusicGenerator._state = "warming"
+            try:
+                self._generate_batch(["warm-up"], max_tokens)
+            except Exception:
+                MusicGenerator._state = "failed"
+                raise
+            print("Model warmed up")
         
-        inputs = self._processor(
-            text=[prompt],
-            padding=True,
-            return_tensors="pt",
-        )
+        MusicGenerator._warmed = True
+        MusicGenerator._state = "ready"
+    
+    @property
+    def sampling_rate(self) -> int:
+        server = self._server()
+        if server:
+            return server.info()["sampling_rate"]
+        self._ensure_loaded()
+        if self._model == "mock":
+            return 32000
+        return self._model.config.audio_encoder.sampling_rate
+    
+    def generate(self, prompt: str, max_tokens: int, on_chunk: Optional[Callable[[np.ndarray], None]] = None) -> str:
+        """Generate audio for the prompt and return the path of a WAV file.
         
-        audio_values = self._model.generate(**inputs, max_new_tokens=max_tokens)
+        Prefer generate_audio, which keeps the WAV in memory.
+        """
+        from scipy.io import wavfile
         
-        sampling_rate = self._model.config.audio_encoder.sampling_rate
+        with STAGE_SECONDS.timer(("synthesize",)):
+            audio, sampling_rate = self._synthesize(prompt, max_tokens, on_chunk)
         
         with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_file:
-            scipy.io.wavfile.write(
+            wavfile.write(
                 tmp_file.name,
                 rate=sampling_rate,
-                data=audio_values[0, 0].numpy()
+                data=audio
             )
             return tmp_file.name
     
-    def _generate_mock(self, prompt: str, max_tokens: int) -> str:
-        import numpy as np
+    def generate_audio(self, prompt: str, max_tokens: int, on_chunk: Optional[Callable[[np.ndarray], None]] = None) -> "GeneratedAudio":
+        """Generate audio for the prompt and return it as an encoded WAV.
+        
+        The WAV is built in memory so it can go straight to storage. Outputs
+        larger than audio_in_memory_max_mb are written to a temp file instead;
+        call close() on the result once it has been stored.
+        
+        With on_chunk, audio is also handed over in chunks of
+        audio_stream_chunk_tokens tokens while the model is still decoding.
+        """
+        from scipy.io import wavfile
         
+        with STAGE_SECONDS.timer(("synthesize",)):
+            audio, sampling_rate = self._synthesize(prompt, max_tokens, on_chunk)
+        
+        with STAGE_SECONDS.timer(("wav_encode",)):
+            max_bytes = get_settings().audio_in_memory_max_mb * 1024 * 1024
+            if audio.nbytes > max_bytes:
+                with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_file:
+                    wavfile.write(tmp_file, rate=sampling_rate, data=audio)
+                    return GeneratedAudio(path=tmp_file.name)
+            
+            buffer = io.BytesIO()
+            wavfile.write(buffer, rate=sampling_rate, data=audio)
+            return GeneratedAudio(buffer=buffer)
+    
+    def _synthesize(self, prompt: str, max_tokens: int, on_chunk: Optional[Callable[[np.ndarray], None]] = None) -> Tuple[np.ndarray, int]:
+        server = self._server()
+        if server:
+            get_profiler().note("model.generate ran in the inference server; no torch trace was recorded")
+            return server.synthesize(prompt, max_tokens, on_chunk)
+        
+        self._ensure_loaded()
+        
+        if self._processor == "mock" or self._model == "mock":
+            return self._generate_mock(prompt, max_tokens, on_chunk)
+        
+        settings = get_settings()
+        if on_chunk is not None:
+            audio = self._generate_streaming(prompt, max_tokens, settings.audio_stream_chunk_tokens, on_chunk)
+        elif settings.generation_batch_size > 1:
+            audio = self._get_batcher().submit(prompt, max_tokens).result()
+        else:
+            audio = self._generate_batch([prompt], max_tokens)[0]
+        
+        sampling_rate = self._model.config.audio_encoder.sampling_rate
+        frame_rate = getattr(self._model.config.audio_encoder, "frame_rate", 50)
+        
+        # A batch runs to its longest request; trim back to what was asked for
+        return audio[:int(max_tokens * sampling_rate / frame_rate)], sampling_rate
+    
+    def _generate_batch(self, prompts: List[str], max_tokens: int) -> list:
+        import torch
+        
+        with STAGE_SECONDS.timer(("tokenize",)):
+            inputs = self._processor(
+                text=prompts,
+                padding=True,
+                return_tensors="pt",
+            )
+        
+        start = time.perf_counter()
+        with torch.inference_mode(), get_profiler().torch_trace(f"generate {len(prompts)} x {max_tokens} tokens"):
+            audio_values = self._model.generate(**inputs, max_new_tokens=max_tokens)
+        self._record_generate(max_tokens * len(prompts), time.perf_counter() - start)
+        
+        # bf16 models return bf16 audio, which numpy cannot hold
+        return [audio_values[i, 0].float().numpy() for i in range(len(prompts))]
+    
+    def _generate_streaming(self, prompt: str, max_tokens: int, chunk_tokens: int, on_chunk: Callable[[np.ndarray], None]) -> np.ndarray:
+        import torch
+        from services.audio_stream import AudioChunkStreamer
+        
+        with STAGE_SECONDS.timer(("tokenize",)):
+            inputs = self._processor(
+                text=[prompt],
+                padding=True,
+                return_tensors="pt",
+            )
+        
+        chunks = []
+        
+        def emit(chunk: np.ndarray):
+            chunks.append(chunk)
+            on_chunk(chunk)
+        
+        streamer = AudioChunkStreamer(self._model, play_steps=chunk_tokens, on_audio=emit)
+        start = time.perf_counter()
+        with torch.inference_mode(), get_profiler().torch_trace(f"generate {max_tokens} tokens, streaming"):
+            self._model.generate(**inputs, max_new_tokens=max_tokens, streamer=streamer)
+        self._record_generate(max_tokens, time.perf_counter() - start)
+        
+        return np.concatenate(chunks)
+    
+    @staticmethod
+    def _record_generate(tokens: int, seconds: float):
+        STAGE_SECONDS.observe(seconds, ("generate",))
+        GENERATED_TOKENS.inc(tokens)
+        if seconds > 0:
+            TOKENS_PER_SECOND.observe(tokens / seconds)
+    
+    def _get_batcher(self) -> MicroBatcher:
+        with self._batcher_lock:
+            if MusicGenerator._batcher is None:
+                settings = get_settings()
+                MusicGenerator._batcher = MicroBatcher(
+                    self._generate_batch,
+                    max_batch_size=settings.generation_batch_size,
+                    max_wait_ms=settings.generation_batch_wait_ms,
+                    token_bucket=settings.generation_batch_token_bucket,
+                )
+            return MusicGenerator._batcher
+    
+    def _generate_mock(self, prompt: str, max_tokens: int, on_chunk: Optional[Callable[[np.ndarray], None]] = None) -> Tuple[np.ndarray, int]:
         duration = max_tokens / 50.0
         sample_rate = 32000
         samples = int(sample_rate * duration)
@@ -84,10 +392,18 @@ class MusicGenerator:
         audio = np.sin(2 * np.pi * frequency * t) * 0.3
         audio = (audio * 32767).astype(np.int16)
         
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp_file:
-            scipy.io.wavfile.write(
-                tmp_file.name,
-                rate=sample_rate,
-                data=audio
-            )
-            return tmp_file.name
+        # Stand in for the model's time, see MOCK_GENERATION_MS_PER_TOKEN
+        settings = get_settings()
+        seconds_per_sample = settings.mock_generation_ms_per_token / 1000.0 * 50.0 / sample_rate
+        start = time.perf_counter()
+        if on_chunk is not None:
+            step = max(1, int(sample_rate * settings.audio_stream_chunk_tokens / 50.0))
+            for offset in range(0, len(audio), step):
+                chunk = audio[offset:offset + step]
+                time.sleep(len(chunk) * seconds_per_sample)
+                on_chunk(chunk)
+        elif seconds_per_sample > 0:
+            time.sleep(len(audio) * seconds_per_sample)
+        self._record_generate(max_tokens, time.perf_counter() - start)
+        
+        return audio, sample_rate
@@ -1,11 +1,13 @@
+from typing import Optional
 from config import get_settings
-from services.auth import AuthService
+from models import UserResponse
+from services.container import get_services
 
 
 class PaymentService:
     def __init__(self):
         self.settings = get_settings()
-        self.auth_service = AuthService()
+        self.auth_service = get_services().auth
         
         if self.settings.stripe_enabled:
             import stripe
@@ -14,11 +16,11 @@ class PaymentService:
         else:
             self.stripe = None
     
-    def create_checkout_session(self, user_id: str, success_url: str, cancel_url: str) -> dict:
+    def create_checkout_session(self, user_id: str, success_url: str, cancel_url: str, user: Optional[UserResponse] = None) -> dict:
         if not self.settings.stripe_enabled:
             raise ValueError("Payment processing is not configured. Contact administrator.")
         
-        user = self.auth_service.get_user_by_id(user_id)
+        user = user or self.auth_service.get_user_by_id(user_id)
         
         if not user:
             raise ValueError("User not found")
@@ -74,8 +76,7 @@ class PaymentService:
         elif event["type"] == "customer.subscription.deleted":
             customer_id = event["data"]["object"]["customer"]
             
-            from services.database import DatabaseService
-            db = DatabaseService()
+            db = get_services().database
             result = db.select("users").eq("stripe_customer_id", customer_id).execute()
             
             if result.data:
@@ -89,11 +90,11 @@ class PaymentService:
         
         return {"status": "ignored", "message": "Event type not handled"}
     
-    def cancel_subscription(self, user_id: str) -> dict:
+    def cancel_subscription(self, user_id: str, user: Optional[UserResponse] = None) -> dict:
         if not self.settings.stripe_enabled:
             raise ValueError("Payment processing is not configured")
         
-        user = self.auth_service.get_user_by_id(user_id)
+        user = user or self.auth_service.get_user_by_id(user_id)
         
         if not user or not user.stripe_customer_id:
             raise ValueError("User not found or not subscribed")
@@ -0,0 +1,364 @@
+"""On-demand profiles of requests and generation jobs.
+
+With PROFILING_ENABLED, a request carrying ``X-Profile: <ADMIN_TOKEN>`` is
+run under cProfile, as are sampled generation jobs (PROFILING_SAMPLE_RATE,
+or the next N jobs armed through the admin API) and the jobs a profiled
+request queues. While a job is profiled, each ``model.generate`` call also
+records a torch profiler trace, including calls the micro-batcher makes on
+its own thread for the job. Generation in the inference server happens in
+another process, so those profiles have no torch trace; their meta.json says
+so in ``notes``. Profiles are stored through StorageService under
+``private/profiles/<id>/``:
+
+    meta.json          what was profiled, when and for how long
+    profile.pstats     cProfile stats, for pstats or snakeviz
+    profile.txt        the slowest functions by cumulative time
+    torch-<n>.json.gz  Chrome trace of a model.generate call (open in Perfetto)
+    torch-<n>.txt      its operators by CPU time
+
+Up to MAX_ACTIVE profiles run at once per process (one on Python 3.12+,
+where cProfile can only be enabled once); triggers beyond that are skipped.
+When profiling is disabled no hook is installed, and the jobs only check one
+flag.
+"""
+import contextlib
+import cProfile
+import functools
+import gzip
+import hmac
+import io
+import json
+import marshal
+import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+from config import get_settings
+from services.storage import PRIVATE_PREFIX
+
+PROFILE_PREFIX = PRIVATE_PREFIX + "profiles/"
+PROFILE_ID = re.compile(r"^\d{8}T\d{6}Z-[0-9a-f]{8}$")
+ARTIFACT_NAME = re.compile(r"^[A-Za-z0-9_-]+(?:\.[A-Za-z0-9]+)+$")
+CONTENT_TYPES = {
+    "json": "application/json",
+    "gz": "application/gzip",
+    "txt": "text/plain",
+    "pstats": "application/octet-stream",
+}
+REPORT_LINES = 60
+MAX_ACTIVE = 4
+
+
+class ProfileSession:
+    def __init__(self, kind: str, target: str):
+        started = datetime.now(timezone.utc)
+        self.id = f"{started:%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}"
+        self.kind = kind
+        self.target = target
+        self.started_at = started.isoformat()
+        # (label, torch profiler) per traced block, exported once stopped
+        self.torch_traces: List[tuple] = []
+        # What this profile cannot show, stored in meta.json
+        self.notes: List[str] = []
+        self.profile = cProfile.Profile()
+        self.start_time = time.perf_counter()
+        self.duration_seconds: Optional[float] = None
+
+
+class Profiler:
+    def __init__(self):
+        settings = get_settings()
+        self.enabled = settings.profiling_enabled
+        self.torch_enabled = settings.profiling_torch
+        self.sample_rate = settings.profiling_sample_rate
+        self.next_jobs = 0
+        self.limitations = self._limitations(settings)
+        self._token = settings.admin_token
+        self._slots = threading.BoundedSemaphore(MAX_ACTIVE)
+        self.active = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # Ids of jobs queued by a profiled request
+        self._followed = set()
+        # Exporting a torch trace can take many seconds, so profiles are
+        # stored off the upload pool
+        self._store_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-store")
+
+    def authorized(self, token: Optional[str]) -> bool:
+        return bool(self._token and token) and hmac.compare_digest(token, self._token)
+
+    def configure(self, sample_rate: Optional[float] = None, next_jobs: Optional[int] = None) -> dict:
+        """Change job sampling at runtime, in this process."""
+        if sample_rate is not None:
+            if not 0.0 <= sample_rate <= 1.0:
+                raise ValueError("sample_rate must be between 0 and 1")
+            self.sample_rate = sample_rate
+        if next_jobs is not None:
+            if next_jobs < 0:
+                raise ValueError("next_jobs cannot be negative")
+            with self._lock:
+                self.next_jobs = next_jobs
+        return self.state()
+
+    def state(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "torch": self.torch_enabled,
+            "sample_rate": self.sample_rate,
+            "next_jobs": self.next_jobs,
+            "active": self.active,
+            "limitations": self.limitations,
+        }
+
+    @staticmethod
+    def _limitations(settings) -> List[str]:
+        """What job profiles on this worker cannot show, for the admin API."""
+        limitations = []
+        if settings.inference_server_address:
+            limitations.append(
+                "model.generate runs in the inference server: job profiles only show "
+                "the wait for it and have no torch traces"
+            )
+        elif settings.generation_batch_size > 1:
+            limitations.append(
+                "model.generate runs on the micro-batcher thread: cProfile shows the "
+                "job waiting for its batch, and torch traces cover the whole batch"
+            )
+        return limitations
+
+    def current(self) -> Optional[ProfileSession]:
+        return getattr(self._local, "session", None)
+
+    @contextlib.contextmanager
+    def attach(self, sessions: List[ProfileSession]):
+        """Record torch traces of the block into these sessions, for work
+        another thread does on behalf of profiled jobs."""
+        self._local.attached = sessions
+        try:
+            yield
+        finally:
+            self._local.attached = None
+
+    def note(self, text: str) -> None:
+        """Record something the current profile cannot show."""
+        session = self.current()
+        if session is not None and text not in session.notes:
+            session.notes.append(text)
+
+    def follow(self, job_ids: Iterable[str]) -> None:
+        """Profile these jobs too if the calling request is being profiled."""
+        session = self.current()
+        if session is not None and session.kind == "request":
+            with self._lock:
+                self._followed.update(job_ids)
+
+    def should_profile_job(self, job_id: str) -> bool:
+        if not self.enabled:
+            return False
+        with self._lock:
+            if job_id in self._followed:
+                self._followed.discard(job_id)
+                return True
+            if self.next_jobs > 0:
+                self.next_jobs -= 1
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, kind: str, target: str) -> Optional[ProfileSession]:
+        """Start profiling the calling thread, or None if too many profiles are running."""
+        if not self._slots.acquire(blocking=False):
+            return None
+
+        session = ProfileSession(kind, target)
+        try:
+            session.profile.enable()
+        except ValueError:
+            # Another profiler (a debugger, coverage, or on 3.12+ another
+            # session) holds the hook
+            self._slots.release()
+            return None
+        with self._lock:
+            self.active += 1
+        self._local.session = session
+        return session
+
+    def finish(self, session: ProfileSession, **details) -> None:
+        """Stop the session and store its artifacts in the background."""
+        session.profile.disable()
+        session.duration_seconds = time.perf_counter() - session.start_time
+        self._local.session = None
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+        self._store_executor.submit(self._store, session, details)
+
+    @contextlib.contextmanager
+    def session(self, kind: str, target: str):
+        session = self.start(kind, target)
+        error = None
+        try:
+            yield session
+        except Exception as exc:
+            error = repr(exc)
+            raise
+        finally:
+            if session is not None:
+                self.finish(session, error=error)
+
+    @contextlib.contextmanager
+    def torch_trace(self, label: str):
+        """Record a torch profiler trace of the block into the current session,
+        or into the sessions attached to this thread."""
+        sessions = getattr(self._local, "attached", None) or [self.current()]
+        sessions = [session for session in sessions if session is not None]
+        if not sessions or not self.torch_enabled:
+            yield
+            return
+
+        from torch.profiler import ProfilerActivity, profile
+
+        with profile(activities=[ProfilerActivity.CPU]) as trace:
+            yield
+
+        # Exporting is slow, more so under cProfile; _store does it later
+        for session in sessions:
+            session.torch_traces.append((label, trace))
+
+    def _store(self, session: ProfileSession, details: dict) -> None:
+        try:
+            artifacts = self._artifacts(session)
+            meta = {
+                "id": session.id,
+                "kind": session.kind,
+                "target": session.target,
+                "started_at": session.started_at,
+                "duration_seconds": round(session.duration_seconds, 4),
+                "artifacts": sorted(artifacts),
+                "notes": session.notes,
+                **{key: value for key, value in details.items() if value is not None},
+            }
+
+            from services.container import get_services
+
+            storage = get_services().storage
+            for name, data in artifacts.items():
+                storage.upload_from_bytes(data, f"{PROFILE_PREFIX}{session.id}/{name}", content_type=content_type(name))
+            # Written last, so listings only show complete profiles
+            storage.upload_from_bytes(
+                json.dumps(meta).encode("utf-8"),
+                f"{PROFILE_PREFIX}{session.id}/meta.json",
+                content_type="application/json",
+            )
+        except Exception as e:
+            print(f"WARNING: could not store profile {session.id}: {e}")
+
+    @staticmethod
+    def _artifacts(session: ProfileSession) -> Dict[str, bytes]:
+        session.profile.create_stats()
+        # The same format as Profile.dump_stats; taken first because
+        # pstats.Stats empties the profile it reads
+        dump = marshal.dumps(session.profile.stats)
+        report = io.StringIO()
+        pstats.Stats(session.profile, stream=report).sort_stats("cumulative").print_stats(REPORT_LINES)
+        artifacts = {
+            "profile.pstats": dump,
+            "profile.txt": report.getvalue().encode("utf-8"),
+        }
+
+        for index, (label, trace) in enumerate(session.torch_traces):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "trace.json")
+                trace.export_chrome_trace(path)
+                with open(path, "rb") as f:
+                    artifacts[f"torch-{index}.json.gz"] = gzip.compress(f.read())
+            table = trace.key_averages().table(sort_by="self_cpu_time_total", row_limit=REPORT_LINES)
+            artifacts[f"torch-{index}.txt"] = f"{label}\n\n{table}".encode("utf-8")
+        return artifacts
+
+    def list_profiles(self, limit: int = 20) -> List[dict]:
+        """The most recent stored profiles of all processes, newest first."""
+        from services.container import get_services
+
+        storage = get_services().storage
+        ids = {
+            name[len(PROFILE_PREFIX):].split("/", 1)[0]
+            for name in storage.list_files(PROFILE_PREFIX)
+            if name.endswith("/meta.json")
+        }
+
+        profiles = []
+        for profile_id in sorted(ids, reverse=True)[:limit]:
+            try:
+                profiles.append(json.loads(storage.download_bytes(f"{PROFILE_PREFIX}{profile_id}/meta.json")))
+            except Exception:
+                continue
+        return profiles
+
+    def artifact(self, profile_id: str, name: str) -> bytes:
+        if not PROFILE_ID.match(profile_id) or not ARTIFACT_NAME.match(name):
+            raise ValueError("Profile not found")
+
+        from services.container import get_services
+
+        try:
+            return get_services().storage.download_bytes(f"{PROFILE_PREFIX}{profile_id}/{name}")
+        except Exception:
+            raise ValueError("Profile not found")
+
+
+def content_type(name: str) -> str:
+    return CONTENT_TYPES.get(name.rsplit(".", 1)[-1], "application/octet-stream")
+
+
+@lru_cache()
+def get_profiler() -> Profiler:
+    return Profiler()
+
+
+def profiled_job(kind: str):
+    """Profile the decorated job when it is sampled; its last argument is the job id."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            profiler = get_profiler()
+            if not profiler.should_profile_job(args[-1]):
+                return func(*args)
+            with profiler.session("job", f"{kind} {args[-1]}"):
+                return func(*args)
+        return wrapper
+    return decorator
+
+
+def install_request_profiling(app) -> None:
+    """Profile requests that carry ``X-Profile: <ADMIN_TOKEN>``."""
+    from flask import g, request
+
+    profiler = get_profiler()
+
+    @app.before_request
+    def start_profile():
+        if profiler.authorized(request.headers.get("X-Profile")):
+            g.profile_session = profiler.start("request", f"{request.method} {request.path}")
+
+    @app.after_request
+    def finish_profile(response):
+        session = g.pop("profile_session", None)
+        if session is not None:
+            profiler.finish(session, status=response.status_code)
+            response.headers["X-Profile-Id"] = session.id
+        return response
+
+    @app.teardown_request
+    def abandon_profile(exc):
+        # Only reached with a session when the request failed before after_request
+        session = g.pop("profile_session", None)
+        if session is not None:
+            profiler.finish(session, error=repr(exc) if exc else None)
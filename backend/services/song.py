@@ -1,51 +1,276 @@
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 from datetime import datetime
-from models import Song, SongCreate, SongUpdate, SongResponse, SongStatus
-from services.database import DatabaseService
-from services.auth import AuthService
+from models import Song, SongCreate, SongUpdate, SongResponse, SongStatus, AnonymousJob, UserResponse
+from services.container import get_services
 from config import get_settings
+import base64
+import json
 import uuid
 import os
 
 
+def encode_cursor(created_at: str, song_id: str) -> str:
+    raw = json.dumps([created_at, song_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, song_id = json.loads(raw)
+        datetime.fromisoformat(created_at)
+        return created_at, str(uuid.UUID(song_id))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def encode_sync_token(updated_at: str, song_id: str) -> str:
+    # Readable on purpose: clients compare tokens to tell whether they are
+    # behind, and the timestamp comes first so later tokens sort higher
+    return f"{updated_at}|{song_id}"
+
+
+def decode_sync_token(token: str) -> Tuple[str, Optional[str]]:
+    """The updated_at and song id of a sync token; a bare timestamp (from
+    older clients) has no id."""
+    updated_at, _, song_id = token.partition("|")
+    try:
+        datetime.fromisoformat(updated_at)
+        return updated_at, str(uuid.UUID(song_id)) if song_id else None
+    except ValueError:
+        raise ValueError("updated_since must be a sync token or an ISO 8601 timestamp")
+
+
 class SongService:
     def __init__(self):
-        self.db = DatabaseService()
-        self.auth_service = AuthService()
+        self.db = get_services().database
+        self.auth_service = get_services().auth
         self.settings = get_settings()
     
-    def create_song(self, user_id: str, song_data: SongCreate) -> SongResponse:
-        user = self.auth_service.get_user_by_id(user_id)
+    def create_song(self, user_id: str, song_data: SongCreate, user: Optional[UserResponse] = None) -> SongResponse:
+        user = user or self.auth_service.get_user_by_id(user_id)
         
         if not user:
             raise ValueError("User not found")
         
-        max_tokens = song_data.max_tokens or user.max_tokens
+        max_allowed = self._max_tokens_for(user, song_data)
+        audio_formats = self._audio_formats_for(song_data)
+        
+        cached_song = self._create_song_from_cache(user_id, song_data, max_allowed, audio_formats)
+        if cached_song:
+            return cached_song
         
+        from tasks.background_processor import BackgroundTaskProcessor
+        from tasks.worker_pool import QueueFullError
+        
+        # Refuse early rather than inserting a song we cannot schedule
+        pool = BackgroundTaskProcessor.get_pool()
+        if pool.is_full():
+            raise QueueFullError(pool.queue_depth(), pool.retry_after)
+        
+        song_dict = self._song_dict(user_id, song_data, max_allowed, audio_formats)
+        
+        result = self.db.insert("songs", song_dict)
+        song = SongResponse(**result.data[0])
+        BackgroundTaskProcessor.record_db_calls()
+        
+        try:
+            BackgroundTaskProcessor.process_song_generation(song.id, is_paid=user.is_paid)
+        except QueueFullError:
+            # The queue filled up between the check and the insert
+            self.db.delete("songs").eq("id", song.id).execute()
+            raise
+        
+        self._publish(song)
+        return song
+    
+    def create_songs(self, user_id: str, items: List[dict], user: Optional[UserResponse] = None) -> List[dict]:
+        """Create several songs with a single insert.
+        
+        Each item is validated on its own, so one bad item does not fail the
+        rest. Cached songs are inserted as completed; the others are queued
+        for generation together, and those the queue has no room for are
+        not created.
+        
+        Args:
+            user_id: Owner of the songs
+            items: SongCreate fields, one dict per song
+            user: The authenticated user, if already loaded
+            
+        Returns:
+            One result per item, in order: {"status": 201, "song": SongResponse}
+            or {"status": 400 | 503, "error": str}
+        """
+        if not items:
+            raise ValueError("At least one song is required")
+        if len(items) > self.settings.song_batch_max_items:
+            raise ValueError(f"At most {self.settings.song_batch_max_items} songs can be created at once")
+        
+        user = user or self.auth_service.get_user_by_id(user_id)
+        
+        if not user:
+            raise ValueError("User not found")
+        
+        from tasks.background_processor import BackgroundTaskProcessor
+        
+        pool = BackgroundTaskProcessor.get_pool()
+        free_slots = pool.free_slots()
+        queue_full = {"status": 503, "error": "Generation queue is full, please retry later"}
+        
+        results: List[Optional[dict]] = [None] * len(items)
+        rows: Dict[int, dict] = {}
+        
+        for index, item in enumerate(items):
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Each song must be an object")
+                song_data = SongCreate(**item)
+                max_allowed = self._max_tokens_for(user, song_data)
+                audio_formats = self._audio_formats_for(song_data)
+            except ValueError as e:
+                results[index] = {"status": 400, "error": str(e)}
+                continue
+            
+            row = self._cached_song_dict(user_id, song_data, max_allowed, audio_formats)
+            if row is None:
+                # Refuse early rather than inserting songs we cannot schedule
+                if free_slots <= 0:
+                    results[index] = dict(queue_full)
+                    continue
+                free_slots -= 1
+                row = self._song_dict(user_id, song_data, max_allowed, audio_formats)
+            rows[index] = row
+        
+        if not rows:
+            return results
+        
+        result = self.db.insert("songs", list(rows.values()))
+        inserted = {row["id"]: row for row in result.data}
+        BackgroundTaskProcessor.record_db_calls()
+        
+        pending = [row["id"] for row in rows.values() if row["status"] == SongStatus.PENDING.value]
+        queued = BackgroundTaskProcessor.process_songs_generation(pending, is_paid=user.is_paid)
+        
+        # The queue filled up between the check and the insert
+        rejected = set(pending[queued:])
+        if rejected:
+            self.db.delete("songs").in_("id", list(rejected)).execute()
+        
+        for index, row in rows.items():
+            if row["id"] in rejected:
+                results[index] = dict(queue_full)
+                continue
+            
+            song = SongResponse(**inserted[row["id"]])
+            results[index] = {"status": 201, "song": song}
+            self._publish(song)
+            if song.status == SongStatus.COMPLETED:
+                BackgroundTaskProcessor.queue_encoding(inserted[row["id"]])
+        
+        return results
+    
+    def _max_tokens_for(self, user: UserResponse, song_data: SongCreate) -> int:
         if user.is_paid:
-            max_allowed = min(max_tokens, self.settings.max_configurable_tokens)
-        else:
-            max_allowed = self.settings.free_user_max_tokens
+            return min(song_data.max_tokens or user.max_tokens, self.settings.max_configurable_tokens)
+        return self.settings.free_user_max_tokens
+    
+    def _audio_formats_for(self, song_data: SongCreate) -> Dict[str, Optional[str]]:
+        from services.audio_encoder import default_formats, parse_formats
         
-        song_dict = {
+        formats = parse_formats(song_data.formats) if song_data.formats is not None else default_formats()
+        return {name: None for name in formats}
+    
+    def _song_dict(self, user_id: str, song_data: SongCreate, max_tokens: int, audio_formats: Dict[str, Optional[str]]) -> dict:
+        return {
+            "id": str(uuid.uuid4()),
             "user_id": user_id,
             "title": song_data.title,
             "description": song_data.description,
             "prompt": song_data.prompt,
-            "max_tokens": max_allowed,
+            "max_tokens": max_tokens,
             "status": SongStatus.PENDING.value,
+            "audio_formats": audio_formats,
             "created_at": datetime.utcnow().isoformat(),
             "updated_at": datetime.utcnow().isoformat(),
         }
+    
+    def _cached_song_dict(self, user_id: str, song_data: SongCreate, max_tokens: int, audio_formats: Dict[str, Optional[str]]) -> Optional[dict]:
+        """A completed song row pointing at a copy of the cached audio, or
+        None if the audio is not cached."""
+        from services.generation_cache import get_generation_cache
+        
+        cache = get_generation_cache()
+        if not cache:
+            return None
+        
+        song_dict = self._song_dict(user_id, song_data, max_tokens, audio_formats)
+        key = cache.key_for(song_data.prompt, max_tokens)
+        gcs_url = cache.copy_cached(key, f"{song_dict['id']}.wav")
+        
+        if not gcs_url:
+            return None
+        
+        song_dict["status"] = SongStatus.COMPLETED.value
+        song_dict["gcs_url"] = gcs_url
+        return song_dict
+    
+    def _create_song_from_cache(self, user_id: str, song_data: SongCreate, max_tokens: int, audio_formats: Dict[str, Optional[str]]) -> Optional[SongResponse]:
+        """Insert the song as already completed if identical audio is cached."""
+        song_dict = self._cached_song_dict(user_id, song_data, max_tokens, audio_formats)
+        
+        if not song_dict:
+            return None
         
         result = self.db.insert("songs", song_dict)
         song = SongResponse(**result.data[0])
+        self._publish(song)
         
         from tasks.background_processor import BackgroundTaskProcessor
-        BackgroundTaskProcessor.process_song_generation(song.id)
+        BackgroundTaskProcessor.queue_encoding(result.data[0])
         
         return song
     
+    def with_delivery_urls(self, songs: List[dict]) -> List[dict]:
+        """Swap the stored audio URLs of serialized songs for ones clients can fetch.
+        
+        Only signed delivery changes anything; all URLs in the list are signed
+        in one batch.
+        """
+        from services.storage import signed_delivery_enabled
+        
+        if not songs or not signed_delivery_enabled():
+            return songs
+        
+        urls = []
+        for song in songs:
+            urls.append(song.get("gcs_url"))
+            urls.extend((song.get("audio_formats") or {}).values())
+        
+        delivered = get_services().storage.delivery_urls(urls)
+        
+        def swap(url):
+            return delivered.get(url, url) if url else url
+        
+        signed = []
+        for song in songs:
+            song = dict(song)
+            if "gcs_url" in song:
+                song["gcs_url"] = swap(song["gcs_url"])
+            if song.get("audio_formats"):
+                song["audio_formats"] = {name: swap(url) for name, url in song["audio_formats"].items()}
+            signed.append(song)
+        return signed
+    
+    def job_with_delivery_url(self, job: AnonymousJob) -> dict:
+        job = job.model_dump()
+        if job["download_url"]:
+            job["download_url"] = get_services().storage.delivery_url(job["download_url"])
+        return job
+    
+    def _publish(self, song: SongResponse) -> None:
+        from services.events import get_event_broker
+        get_event_broker().publish(song.user_id, song.model_dump(mode="json"))
+    
     def get_song(self, song_id: str, user_id: str) -> Optional[SongResponse]:
         result = self.db.select("songs").eq("id", song_id).eq("user_id", user_id).execute()
         
@@ -54,9 +279,131 @@ class SongService:
         
         return SongResponse(**result.data[0])
     
-    def get_user_songs(self, user_id: str) -> List[SongResponse]:
-        result = self.db.select("songs").eq("user_id", user_id).order("created_at", desc=True).execute()
-        return [SongResponse(**song) for song in result.data]
+    def get_user_songs(
+        self,
+        user_id: str,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        statuses: Optional[List[str]] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """One page of the user's songs, newest first.
+        
+        Pages are keyed on (created_at, id), so each page is an index range
+        scan no matter how deep the client has paged.
+        
+        Args:
+            user_id: Owner of the songs
+            limit: Page size, capped at song_page_size_max
+            cursor: next_cursor from the previous page
+            fields: Columns to return; id and created_at are always included
+            statuses: Only return songs in these statuses
+            
+        Returns:
+            The songs and the cursor for the next page, or None on the last page
+        """
+        limit = min(limit or self.settings.song_page_size, self.settings.song_page_size_max)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        
+        columns = self._columns(fields, "created_at")
+        
+        query = self.db.select("songs", columns).eq("user_id", user_id)
+        
+        if statuses:
+            valid = {status.value for status in SongStatus}
+            if not set(statuses) <= valid:
+                raise ValueError(f"status must be one of: {', '.join(sorted(valid))}")
+            query = query.in_("status", statuses)
+        
+        if cursor:
+            created_at, song_id = decode_cursor(cursor)
+            query = query.or_(
+                f'created_at.lt."{created_at}",'
+                f'and(created_at.eq."{created_at}",id.lt.{song_id})'
+            )
+        
+        # Fetch one extra row to learn whether there is a next page
+        result = query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute()
+        rows = result.data[:limit]
+        
+        next_cursor = None
+        if len(result.data) > limit:
+            next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+        
+        if not fields:
+            rows = [SongResponse(**row).model_dump() for row in rows]
+        
+        return rows, next_cursor
+    
+    def get_songs_version(self, user_id: str) -> Tuple[str, Optional[str]]:
+        """A version of the user's song list, served from the
+        (user_id, updated_at) index.
+        
+        Returns:
+            A value that changes whenever a song is created, updated or
+            deleted, and the sync token of the latest change
+        """
+        result = self.db.select("songs", "id,updated_at", count="exact").eq("user_id", user_id).order("updated_at", desc=True).order("id", desc=True).limit(1).execute()
+        latest = encode_sync_token(result.data[0]["updated_at"], result.data[0]["id"]) if result.data else None
+        return f"{result.count}:{latest}", latest
+    
+    def get_sync_token(self, user_id: str) -> Optional[str]:
+        """The sync token of the user's latest song change, without the count
+        get_songs_version pays for."""
+        result = self.db.select("songs", "id,updated_at").eq("user_id", user_id).order("updated_at", desc=True).order("id", desc=True).limit(1).execute()
+        return encode_sync_token(result.data[0]["updated_at"], result.data[0]["id"]) if result.data else None
+    
+    def get_songs_changed_since(
+        self,
+        user_id: str,
+        since: str,
+        limit: Optional[int] = None,
+        fields: Optional[List[str]] = None,
+    ) -> Tuple[List[dict], str]:
+        """Songs changed after the sync token since, oldest change first.
+        
+        Changes are ordered by (updated_at, id), so songs that share a
+        timestamp (a batched status write gives them the same NOW()) are
+        never skipped at a page boundary.
+        
+        Deleted songs are not reported; clients reconcile those on a full
+        reload.
+        
+        Returns:
+            The changed songs and the sync token to pass as since next time
+        """
+        updated_at, song_id = decode_sync_token(since)
+        
+        limit = min(limit or self.settings.song_page_size, self.settings.song_page_size_max)
+        columns = self._columns(fields, "updated_at")
+        
+        query = self.db.select("songs", columns).eq("user_id", user_id)
+        if song_id:
+            query = query.or_(
+                f'updated_at.gt."{updated_at}",'
+                f'and(updated_at.eq."{updated_at}",id.gt.{song_id})'
+            )
+        else:
+            query = query.gt("updated_at", updated_at)
+        
+        result = query.order("updated_at").order("id").limit(limit).execute()
+        rows = result.data
+        sync_token = encode_sync_token(rows[-1]["updated_at"], rows[-1]["id"]) if rows else since
+        
+        if not fields:
+            rows = [SongResponse(**row).model_dump() for row in rows]
+        
+        return rows, sync_token
+    
+    def _columns(self, fields: Optional[List[str]], *required: str) -> str:
+        if not fields:
+            return "*"
+        
+        unknown = set(fields) - set(SongResponse.model_fields)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        return ",".join(dict.fromkeys(["id", *required, *fields]))
     
     def update_song(self, song_id: str, user_id: str, update_data: SongUpdate) -> SongResponse:
         update_dict = update_data.model_dump(exclude_unset=True)
@@ -75,16 +422,63 @@ class SongService:
         if not song:
             raise ValueError("Song not found")
         
-        if song.gcs_url:
-            from services.storage import StorageService
-            storage = StorageService()
-            blob_name = song.gcs_url.split("/")[-1]
+        get_services().storage.delete_files(self._blob_names(song.model_dump()))
+        
+        self.db.delete("songs").eq("id", song_id).eq("user_id", user_id).execute()
+    
+    def delete_songs(self, song_ids: List[str], user_id: str) -> List[dict]:
+        """Delete several of the user's songs with one select and one delete.
+        
+        The audio of all songs is removed from storage in bulk.
+        
+        Returns:
+            One result per id, in order: {"id", "status": 200} or
+            {"id", "status": 404, "error": str}
+        """
+        if not song_ids:
+            raise ValueError("At least one song id is required")
+        if len(song_ids) > self.settings.song_batch_max_items:
+            raise ValueError(f"At most {self.settings.song_batch_max_items} songs can be deleted at once")
+        
+        # Malformed ids would make Postgres reject the whole query
+        canonical_ids = {}
+        for song_id in song_ids:
             try:
-                storage.delete_file(blob_name)
-            except Exception:
+                canonical_ids[song_id] = str(uuid.UUID(str(song_id)))
+            except ValueError:
                 pass
         
-        self.db.delete("songs").eq("id", song_id).eq("user_id", user_id).execute()
+        songs = []
+        if canonical_ids:
+            valid_ids = list(set(canonical_ids.values()))
+            result = self.db.select("songs", "id, gcs_url, audio_formats").in_("id", valid_ids).eq("user_id", user_id).execute()
+            songs = result.data
+        
+        found = {song["id"] for song in songs}
+        
+        if songs:
+            get_services().storage.delete_files(
+                name for song in songs for name in self._blob_names(song)
+            )
+            self.db.delete("songs").in_("id", list(found)).eq("user_id", user_id).execute()
+        
+        results = []
+        for song_id in song_ids:
+            if canonical_ids.get(song_id) in found:
+                results.append({"id": song_id, "status": 200})
+            else:
+                results.append({"id": song_id, "status": 404, "error": "Song not found"})
+        return results
+    
+    def _blob_names(self, song: dict) -> List[str]:
+        """The stored audio of a song: the original WAV and its encodings."""
+        if not song.get("gcs_url"):
+            return []
+        
+        from services.audio_encoder import blob_name_for
+        
+        blob_name = song["gcs_url"].split("/")[-1]
+        return [blob_name] + [blob_name_for(blob_name, name) for name in (song.get("audio_formats") or {})]
     
     def update_song_status(self, song_id: str, status: SongStatus, gcs_url: Optional[str] = None, error_message: Optional[str] = None) -> SongResponse:
         update_dict = {
@@ -105,35 +499,74 @@ class SongService:
         
         return SongResponse(**result.data[0])
     
-    def generate_anonymous_song(self, prompt: str) -> Dict[str, str]:
+    def create_anonymous_job(self, prompt: str) -> AnonymousJob:
+        """Queue a song for an anonymous user and return the job to poll.
+        
+        Cached prompts complete immediately without touching the queue.
+        
+        Args:
+            prompt: The text prompt for song generation
+            
+        Returns:
+            The AnonymousJob, pending or already completed
+        """
+        from services.generation_cache import get_generation_cache
+        from tasks.background_processor import BackgroundTaskProcessor
+        from tasks.job_store import get_job_store
+        
+        # Use free tier limits for anonymous users
+        max_tokens = self.settings.free_user_max_tokens
+        
+        store = get_job_store()
+        job = store.create(prompt, max_tokens)
+        
+        cache = get_generation_cache()
+        if cache:
+            key = cache.key_for(prompt, max_tokens)
+            download_url = cache.copy_cached(key, f"anonymous/{job.id}.wav")
+            if download_url:
+                return store.update(job.id, status=SongStatus.COMPLETED, download_url=download_url)
+        
+        # Raises QueueFullError when saturated; the orphaned job simply expires
+        BackgroundTaskProcessor.process_anonymous_generation(job.id)
+        
+        return job
+    
+    def generate_anonymous_song(self, prompt: str, song_id: Optional[str] = None) -> Dict[str, str]:
         """Generate a song for anonymous users without saving to database.
         
         Args:
             prompt: The text prompt for song generation
+            song_id: Optional ID for the song, defaults to a new UUID
             
         Returns:
             Dict with download_url and song_id
         """
         from services.music_generator import MusicGenerator
-        from services.storage import StorageService
+        from services.generation_cache import get_generation_cache
         
         # Use free tier limits for anonymous users
         max_tokens = self.settings.free_user_max_tokens
         
         # Generate unique ID for this song
-        song_id = str(uuid.uuid4())
-        
-        # Generate the song
-        generator = MusicGenerator()
-        audio_file_path = generator.generate(prompt, max_tokens)
-        
-        # Upload to storage
-        storage = StorageService()
+        song_id = song_id or str(uuid.uuid4())
         blob_name = f"anonymous/{song_id}.wav"
-        download_url = storage.upload_file(audio_file_path, blob_name)
         
-        # Clean up temp file
-        os.remove(audio_file_path)
+        cache = get_generation_cache()
+        if cache:
+            # Popular prompts are served from the cache without running the model
+            download_url = cache.render(prompt, max_tokens, blob_name)
+        else:
+            # Generate the song
+            generator = MusicGenerator()
+            audio = generator.generate_audio(prompt, max_tokens)
+            
+            # Upload to storage straight from memory
+            storage = get_services().storage
+            try:
+                download_url = storage.upload_audio(audio, blob_name)
+            finally:
+                audio.close()
         
         return {
             "download_url": download_url,
@@ -1,7 +1,122 @@
 from config import get_settings
+import io
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from datetime import timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote
+from services.metrics import STAGE_SECONDS, UPLOAD_BYTES
+
+# Blobs under this prefix are never made public or served from /storage
+PRIVATE_PREFIX = "private/"
+
+
+class SignedUrlCache:
+    """Signed URLs by blob name, reused until they are close to expiring.
+
+    A URL is handed out again only while it has more than
+    ``refresh_margin_seconds`` left, so clients always get some time to use it.
+    """
+
+    def __init__(self, refresh_margin_seconds: int, max_entries: int = 10000):
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.max_entries = max_entries
+        self._urls: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, blob_name: str) -> Optional[str]:
+        with self._lock:
+            cached = self._urls.get(blob_name)
+            if cached is None:
+                return None
+            url, expires_at = cached
+            if expires_at - time.time() <= self.refresh_margin_seconds:
+                del self._urls[blob_name]
+                return None
+            self._urls.move_to_end(blob_name)
+            return url
+
+    def put(self, blob_name: str, url: str, expires_at: float) -> None:
+        with self._lock:
+            self._urls[blob_name] = (url, expires_at)
+            self._urls.move_to_end(blob_name)
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+
+
+class UploadPool:
+    """Threads that write to storage, apart from the generation workers.
+
+    A generation worker hands its audio over and moves on to the next job.
+    At most ``max_pending`` uploads may be queued or running; beyond that
+    submit blocks, so the audio buffers waiting for upload stay bounded.
+    """
+
+    def __init__(self, num_workers: int, max_pending: int):
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="storage-upload")
+        self._slots = threading.BoundedSemaphore(max(max_pending, num_workers))
+
+    def submit(self, func: Callable[..., Any], *args) -> Future:
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+@lru_cache()
+def get_gcs_client():
+    """One GCS client per process, with a connection pool sized for the
+    upload workers and URL signing threads that share it."""
+    import google.auth
+    from google.auth.transport.requests import AuthorizedSession
+    from google.cloud import storage
+    from requests.adapters import HTTPAdapter
+
+    settings = get_settings()
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = settings.google_application_credentials
+    credentials, _ = google.auth.default(scopes=storage.Client.SCOPE)
+
+    session = AuthorizedSession(credentials)
+    session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=settings.gcs_max_connections))
+    return storage.Client(project=settings.gcs_project_id, credentials=credentials, _http=session)
+
+
+@lru_cache()
+def get_upload_pool() -> UploadPool:
+    settings = get_settings()
+    return UploadPool(settings.storage_upload_workers, settings.storage_upload_max_pending)
+
+
+@lru_cache()
+def get_signed_url_cache() -> SignedUrlCache:
+    settings = get_settings()
+    return SignedUrlCache(settings.gcs_signed_url_refresh_seconds)
+
+
+def signed_delivery_enabled() -> bool:
+    settings = get_settings()
+    return not settings.use_local_storage and settings.gcs_delivery == "signed"
+
+
+def delivery_epoch() -> str:
+    """Changes whenever cached signed URLs may have been refreshed.
+
+    Fold it into ETags of responses that carry signed URLs, so a client never
+    revalidates a body whose URLs are about to expire. Empty when blobs are
+    public.
+    """
+    if not signed_delivery_enabled():
+        return ""
+    return str(int(time.time() // get_settings().gcs_signed_url_refresh_seconds))
 
 
 class StorageService:
@@ -13,14 +128,44 @@ class StorageService:
             os.makedirs(self.settings.local_storage_path, exist_ok=True)
             self.client = None
             self.bucket = None
+            self.retry = None
         else:
             self.local_mode = False
-            from google.cloud import storage
-            os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = self.settings.google_application_credentials
-            self.client = storage.Client(project=self.settings.gcs_project_id)
+            self.client = get_gcs_client()
             self.bucket = self.client.bucket(self.settings.gcs_bucket_name)
+            
+            from google.api_core.retry import Retry, if_transient_error
+            # Uploads are resumable (see _blob), so a retry resumes from the
+            # last chunk GCS acknowledged instead of starting over
+            self.retry = Retry(
+                predicate=if_transient_error,
+                initial=self.settings.storage_retry_initial_seconds,
+                maximum=self.settings.storage_retry_max_seconds,
+                multiplier=2.0,
+                timeout=self.settings.storage_retry_timeout_seconds,
+            )
+        
+        self.signed_delivery = signed_delivery_enabled()
+    
+    def _blob(self, blob_name: str):
+        """A blob handle that uploads in resumable chunks of STORAGE_UPLOAD_CHUNK_MB."""
+        return self.bucket.blob(blob_name, chunk_size=self.settings.storage_upload_chunk_mb * 1024 * 1024)
     
+    def _published_url(self, blob) -> str:
+        """The URL stored for a new blob.
+        
+        With signed delivery the blob stays private: the public URL is only
+        kept as its identifier and delivery_urls signs it when it is served.
+        Blobs under PRIVATE_PREFIX always stay private.
+        """
+        if not self.signed_delivery and not blob.name.startswith(PRIVATE_PREFIX):
+            blob.make_public()
+        return blob.public_url
+    
+    @STAGE_SECONDS.timed(("upload",))
     def upload_file(self, source_path: str, destination_blob_name: str) -> str:
+        UPLOAD_BYTES.inc(os.path.getsize(source_path))
+        
         if self.local_mode:
             dest_path = os.path.join(self.settings.local_storage_path, destination_blob_name)
             os.makedirs(os.path.dirname(dest_path), exist_ok=True)
@@ -30,12 +175,14 @@ class StorageService:
             
             return f"/storage/{destination_blob_name}"
         else:
-            blob = self.bucket.blob(destination_blob_name)
-            blob.upload_from_filename(source_path)
-            blob.make_public()
-            return blob.public_url
+            blob = self._blob(destination_blob_name)
+            blob.upload_from_filename(source_path, retry=self.retry)
+            return self._published_url(blob)
     
+    @STAGE_SECONDS.timed(("upload",))
     def upload_from_bytes(self, data: bytes, destination_blob_name: str, content_type: str = "audio/wav") -> str:
+        UPLOAD_BYTES.inc(len(data))
+        
         if self.local_mode:
             dest_path = os.path.join(self.settings.local_storage_path, destination_blob_name)
             os.makedirs(os.path.dirname(dest_path), exist_ok=True)
@@ -45,10 +192,102 @@ class StorageService:
             
             return f"/storage/{destination_blob_name}"
         else:
-            blob = self.bucket.blob(destination_blob_name)
-            blob.upload_from_string(data, content_type=content_type)
-            blob.make_public()
-            return blob.public_url
+            blob = self._blob(destination_blob_name)
+            blob.upload_from_string(data, content_type=content_type, retry=self.retry)
+            return self._published_url(blob)
+    
+    @STAGE_SECONDS.timed(("upload",))
+    def upload_buffer(self, buffer: io.BytesIO, destination_blob_name: str, content_type: str = "audio/wav") -> str:
+        """Upload the contents of an in-memory buffer without copying it to bytes first."""
+        UPLOAD_BYTES.inc(buffer.getbuffer().nbytes)
+        
+        if self.local_mode:
+            dest_path = os.path.join(self.settings.local_storage_path, destination_blob_name)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            
+            with open(dest_path, 'wb') as f:
+                f.write(buffer.getbuffer())
+            
+            return f"/storage/{destination_blob_name}"
+        else:
+            blob = self._blob(destination_blob_name)
+            blob.upload_from_file(buffer, rewind=True, content_type=content_type, retry=self.retry)
+            return self._published_url(blob)
+    
+    def upload_audio(self, audio, destination_blob_name: str) -> str:
+        """Upload a GeneratedAudio from MusicGenerator.generate_audio.
+        
+        Audio held in memory is uploaded straight from its buffer; audio that
+        was spilled to a temp file is uploaded from disk.
+        """
+        if audio.buffer is not None:
+            return self.upload_buffer(audio.buffer, destination_blob_name)
+        return self.upload_file(audio.path, destination_blob_name)
+    
+    def upload_audio_async(self, audio, destination_blob_name: str) -> Future:
+        """upload_audio on the upload pool; the audio is closed once stored.
+        
+        Returns a Future with the URL.
+        """
+        def upload() -> str:
+            try:
+                return self.upload_audio(audio, destination_blob_name)
+            finally:
+                audio.close()
+        
+        return get_upload_pool().submit(upload)
+    
+    def download_bytes(self, blob_name: str) -> bytes:
+        if self.local_mode:
+            file_path = os.path.join(self.settings.local_storage_path, blob_name)
+            with open(file_path, 'rb') as f:
+                return f.read()
+        else:
+            blob = self.bucket.blob(blob_name)
+            return blob.download_as_bytes(retry=self.retry)
+    
+    def list_files(self, prefix: str) -> List[str]:
+        """Names of the blobs under prefix."""
+        if self.local_mode:
+            root = os.path.join(self.settings.local_storage_path, prefix)
+            names = []
+            for directory, _, files in os.walk(root):
+                for file_name in files:
+                    path = os.path.join(directory, file_name)
+                    names.append(os.path.relpath(path, self.settings.local_storage_path).replace(os.sep, "/"))
+            return names
+        else:
+            return [blob.name for blob in self.client.list_blobs(self.bucket, prefix=prefix)]
+    
+    def list_file_stats(self, prefix: str) -> List[Tuple[str, int, float]]:
+        """Name, size in bytes and creation time (Unix seconds) of the blobs under prefix."""
+        if self.local_mode:
+            stats = []
+            for name in self.list_files(prefix):
+                stat = os.stat(os.path.join(self.settings.local_storage_path, name))
+                stats.append((name, stat.st_size, stat.st_mtime))
+            return stats
+        else:
+            return [
+                (blob.name, blob.size, blob.time_created.timestamp())
+                for blob in self.client.list_blobs(self.bucket, prefix=prefix)
+            ]
+    
+    def copy_file(self, source_blob_name: str, destination_blob_name: str) -> str:
+        if self.local_mode:
+            source_path = os.path.join(self.settings.local_storage_path, source_blob_name)
+            dest_path = os.path.join(self.settings.local_storage_path, destination_blob_name)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            
+            import shutil
+            shutil.copyfile(source_path, dest_path)
+            
+            return f"/storage/{destination_blob_name}"
+        else:
+            # Server-side copy, the bytes never leave GCS
+            source_blob = self.bucket.blob(source_blob_name)
+            blob = self.bucket.copy_blob(source_blob, self.bucket, destination_blob_name, retry=self.retry)
+            return self._published_url(blob)
     
     def delete_file(self, blob_name: str) -> None:
         if self.local_mode:
@@ -59,6 +298,52 @@ class StorageService:
             blob = self.bucket.blob(blob_name)
             blob.delete()
     
+    def delete_files(self, blob_names: Iterable[str]) -> None:
+        """Delete many blobs at once; missing blobs are ignored.
+        
+        Local files are unlinked in parallel. On GCS the deletes go out as
+        batch requests of up to 100 calls, a few batches at a time. Failures
+        are logged, like delete_song ignores them, rather than raised.
+        """
+        blob_names = list(dict.fromkeys(name for name in blob_names if name))
+        if not blob_names:
+            return
+        
+        if self.local_mode:
+            def delete(blob_name: str) -> None:
+                try:
+                    os.remove(os.path.join(self.settings.local_storage_path, blob_name))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print(f"WARNING: could not delete {blob_name}: {e}")
+            
+            tasks = blob_names
+        else:
+            from google.api_core.exceptions import GoogleAPICallError, NotFound
+            
+            def delete(names) -> None:
+                # Every delete of the batch is sent; leaving the block raises
+                # the first one that failed
+                try:
+                    with self.client.batch():
+                        for blob_name in names:
+                            self.bucket.blob(blob_name).delete()
+                except NotFound:
+                    pass
+                except GoogleAPICallError as e:
+                    print(f"WARNING: could not delete some of {len(names)} blob(s): {e}")
+                except Exception as e:
+                    print(f"WARNING: could not delete {len(names)} blob(s): {e}")
+            
+            tasks = [blob_names[i:i + 100] for i in range(0, len(blob_names), 100)]
+        
+        if len(tasks) == 1:
+            delete(tasks[0])
+        else:
+            with ThreadPoolExecutor(max_workers=min(8, len(tasks))) as executor:
+                list(executor.map(delete, tasks))
+    
     def get_signed_url(self, blob_name: str, expiration: int = 3600) -> str:
         if self.local_mode:
             return f"/storage/{blob_name}"
@@ -70,3 +355,58 @@ class StorageService:
                 method="GET"
             )
             return url
+    
+    def delivery_urls(self, urls: Iterable[str]) -> Dict[str, str]:
+        """Map stored blob URLs to URLs a client can fetch.
+        
+        Public and local URLs map to themselves. With signed delivery each
+        blob gets a signed URL, cached until it is close to expiry; the
+        misses of one call are signed together on a small thread pool.
+        """
+        urls = [url for url in dict.fromkeys(urls) if url]
+        if not self.signed_delivery:
+            return {url: url for url in urls}
+        
+        cache = get_signed_url_cache()
+        delivered = {}
+        missing = {}
+        for url in urls:
+            blob_name = self._blob_name_from_url(url)
+            if blob_name is None:
+                delivered[url] = url
+                continue
+            signed = cache.get(blob_name)
+            if signed:
+                delivered[url] = signed
+            else:
+                missing[url] = blob_name
+        
+        if missing:
+            expiration = self.settings.gcs_signed_url_ttl_seconds
+            expires_at = time.time() + expiration
+            
+            def sign(blob_name: str) -> str:
+                return self.get_signed_url(blob_name, expiration=expiration)
+            
+            if len(missing) == 1:
+                signed_urls = [sign(blob_name) for blob_name in missing.values()]
+            else:
+                with ThreadPoolExecutor(max_workers=min(8, len(missing))) as executor:
+                    signed_urls = list(executor.map(sign, missing.values()))
+            
+            for (url, blob_name), signed in zip(missing.items(), signed_urls):
+                cache.put(blob_name, signed, expires_at)
+                delivered[url] = signed
+        
+        return delivered
+    
+    def delivery_url(self, url: Optional[str]) -> Optional[str]:
+        if not url:
+            return url
+        return self.delivery_urls([url])[url]
+    
+    def _blob_name_from_url(self, url: str) -> Optional[str]:
+        prefix = f"https://storage.googleapis.com/{self.bucket.name}/"
+        if not url.startswith(prefix):
+            return None
+        return unquote(url[len(prefix):])
@@ -1,3 +1,4 @@
 from .background_processor import BackgroundTaskProcessor
+from .worker_pool import WorkerPool, QueueFullError
 
-__all__ = ["BackgroundTaskProcessor"]
+__all__ = ["BackgroundTaskProcessor", "WorkerPool", "QueueFullError"]
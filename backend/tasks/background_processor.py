@@ -1,52 +1,409 @@
+import io
+import logging
 import threading
+import time
 import os
+from typing import Optional
 from services.music_generator import MusicGenerator
-from services.storage import StorageService
-from services.database import DatabaseService
-from models import SongStatus
-from datetime import datetime
+from services.container import get_services
+from services.generation_cache import get_generation_cache
+from services.events import get_event_broker
+from services.audio_stream import get_stream_registry
+from services.metrics import DB_CALLS_PER_SONG, ENCODE_ERRORS, SONGS, STAGE_SECONDS
+from services.profiling import get_profiler, profiled_job
+from models import SongStatus, SongResponse
+from config import get_settings
+from tasks.worker_pool import WorkerPool, QueueFullError, PRIORITY_PAID, PRIORITY_FREE, PRIORITY_ANONYMOUS
+from tasks.job_store import get_job_store
+from tasks.status_writer import get_status_writer
+from datetime import datetime, timedelta
+
+
+logger = logging.getLogger(__name__)
 
 
 class BackgroundTaskProcessor:
+    _pool: Optional[WorkerPool] = None
+    _pool_lock = threading.Lock()
+    _encode_pool: Optional[WorkerPool] = None
+    _stats = {"songs": 0, "db_calls": 0}
+    _stats_lock = threading.Lock()
+    # Songs this process is generating, whose leases the heartbeat renews
+    _leases: set = set()
+    _lease_lock = threading.Lock()
+    _heartbeat: Optional[threading.Thread] = None
+
+    @classmethod
+    def get_pool(cls) -> WorkerPool:
+        if cls._pool is None:
+            with cls._pool_lock:
+                if cls._pool is None:
+                    settings = get_settings()
+                    cls._pool = WorkerPool(
+                        num_workers=settings.generation_workers,
+                        max_queue_size=settings.generation_queue_size,
+                        max_attempts=settings.generation_max_attempts,
+                        retry_after=settings.generation_retry_after_seconds,
+                        name="song-generation",
+                    )
+        return cls._pool
+
+    @classmethod
+    def get_encode_pool(cls) -> WorkerPool:
+        """Workers that transcode finished songs, apart from the model workers."""
+        if cls._encode_pool is None:
+            with cls._pool_lock:
+                if cls._encode_pool is None:
+                    settings = get_settings()
+                    cls._encode_pool = WorkerPool(
+                        num_workers=settings.encoding_workers,
+                        max_queue_size=settings.encoding_queue_size,
+                        name="song-encoding",
+                    )
+        return cls._encode_pool
+
+    @classmethod
+    def process_song_generation(cls, song_id: str, is_paid: bool = False):
+        priority = PRIORITY_PAID if is_paid else PRIORITY_FREE
+        get_profiler().follow([song_id])
+        cls.get_pool().submit(cls._generate_song, song_id, priority=priority)
+
+    @classmethod
+    def process_songs_generation(cls, song_ids, is_paid: bool = False) -> int:
+        """Queue several songs at once. Returns how many fit in the queue;
+        those are the first ones of song_ids."""
+        priority = PRIORITY_PAID if is_paid else PRIORITY_FREE
+        get_profiler().follow(song_ids)
+        return cls.get_pool().submit_many(cls._generate_song, [(song_id,) for song_id in song_ids], priority=priority)
+
+    @classmethod
+    def process_anonymous_generation(cls, job_id: str):
+        get_profiler().follow([job_id])
+        cls.get_pool().submit(cls._generate_anonymous, job_id, priority=PRIORITY_ANONYMOUS)
+
+    @classmethod
+    def queue_encoding(cls, song: dict) -> None:
+        """Queue the encodes still missing from a completed song's audio_formats.
+
+        The encoder works from this row rather than reading the song again.
+        """
+        if not any(url is None for url in (song.get("audio_formats") or {}).values()):
+            return
+
+        try:
+            cls.get_encode_pool().submit(cls._encode_song, song)
+        except QueueFullError:
+            print(f"Encoding queue full, song {song['id']} is only available as WAV")
+
+    @classmethod
+    def recover_pending_songs(cls, stale_only: bool = False) -> int:
+        """Re-enqueue songs left pending by a previous process, and songs
+        whose processing lease has expired because their process died.
+
+        With stale_only, pending songs are left alone, since another live
+        process may have them queued. Paid users' songs are queued first.
+        Returns the number of songs queued.
+        """
+        conditions = [] if stale_only else [f"status.eq.{SongStatus.PENDING.value}"]
+        stale = cls._stale_claim_filter()
+        if stale:
+            conditions.append(stale)
+        if not conditions:
+            return 0
+
+        db = get_services().database
+        result = db.select("songs", "id, user_id").or_(",".join(conditions)).order("created_at").execute()
+
+        if not result.data:
+            return 0
+
+        user_ids = list({song["user_id"] for song in result.data})
+        users = db.select("users", "id, is_paid").in_("id", user_ids).execute()
+        paid_users = {user["id"] for user in users.data if user.get("is_paid")}
+
+        pool = cls.get_pool()
+        queued = 0
+        for song in sorted(result.data, key=lambda s: s["user_id"] not in paid_users):
+            if pool.is_full():
+                break
+            cls.process_song_generation(song["id"], is_paid=song["user_id"] in paid_users)
+            queued += 1
+
+        return queued
+
+    @staticmethod
+    def _stale_claim_filter() -> Optional[str]:
+        """An or_() term for processing songs whose lease has expired.
+
+        Rows claimed before lease_expires_at existed fall back to updated_at.
+        """
+        lease = get_settings().generation_lease_seconds
+        if lease <= 0:
+            return None
+        now = datetime.utcnow()
+        cutoff = (now - timedelta(seconds=lease)).isoformat()
+        return (
+            f"and(status.eq.{SongStatus.PROCESSING.value},"
+            f'or(lease_expires_at.lt."{now.isoformat()}",'
+            f'and(lease_expires_at.is.null,updated_at.lt."{cutoff}")))'
+        )
+
     @staticmethod
-    def process_song_generation(song_id: str):
-        def task():
-            db = DatabaseService()
-            
+    def _lease_expiry() -> Optional[str]:
+        lease = get_settings().generation_lease_seconds
+        if lease <= 0:
+            return None
+        return (datetime.utcnow() + timedelta(seconds=lease)).isoformat()
+
+    @classmethod
+    def _hold_lease(cls, song_id: str):
+        """Keep renewing the song's lease until _release_lease."""
+        lease = get_settings().generation_lease_seconds
+        if lease <= 0:
+            return
+        with cls._lease_lock:
+            cls._leases.add(song_id)
+            if cls._heartbeat is None:
+                cls._heartbeat = threading.Thread(
+                    target=cls._renew_leases_forever, args=(lease,), name="song-leases", daemon=True
+                )
+                cls._heartbeat.start()
+
+    @classmethod
+    def _release_lease(cls, song_id: str):
+        with cls._lease_lock:
+            cls._leases.discard(song_id)
+
+    @classmethod
+    def _renew_leases_forever(cls, lease: int):
+        while True:
+            time.sleep(lease / 3)
             try:
-                song_result = db.select("songs").eq("id", song_id).execute()
-                
-                if not song_result.data:
-                    return
-                
-                song = song_result.data[0]
-                
-                db.update("songs", {
-                    "status": SongStatus.PROCESSING.value,
-                    "updated_at": datetime.utcnow().isoformat()
-                }).eq("id", song_id).execute()
-                
+                cls.renew_leases()
+            except Exception as e:
+                print(f"WARNING: could not renew song leases: {e}")
+
+    @classmethod
+    def renew_leases(cls) -> int:
+        """Push back the lease of every song this process is still working on,
+        in one update. Returns the number of leases renewed."""
+        with cls._lease_lock:
+            song_ids = list(cls._leases)
+        if not song_ids:
+            return 0
+
+        renewed = get_services().database.update("songs", {
+            "lease_expires_at": cls._lease_expiry()
+        }).in_("id", song_ids).eq("status", SongStatus.PROCESSING.value).execute()
+        cls.record_db_calls()
+
+        # Deleted, or finished by a write still waiting on its callback
+        lost = set(song_ids) - {song["id"] for song in renewed.data}
+        with cls._lease_lock:
+            cls._leases -= lost
+        return len(renewed.data)
+
+    @classmethod
+    @profiled_job("song")
+    def _generate_song(cls, song_id: str):
+        db = get_services().database
+        settings = get_settings()
+        streams = get_stream_registry()
+
+        # Claim the song atomically so a song recovered by several processes
+        # is only generated once. The claim takes a fresh lease, so a stale
+        # song is re-claimed by one process only; the heartbeat then renews
+        # it until the song is completed or failed.
+        claimable = [f"status.eq.{SongStatus.PENDING.value}"]
+        stale = cls._stale_claim_filter()
+        if stale:
+            claimable.append(stale)
+
+        try:
+            claimed = db.update("songs", {
+                "status": SongStatus.PROCESSING.value,
+                "lease_expires_at": cls._lease_expiry(),
+                "updated_at": datetime.utcnow().isoformat()
+            }).eq("id", song_id).or_(",".join(claimable)).execute()
+            cls.record_db_calls()
+
+            if not claimed.data:
+                return
+            cls._hold_lease(song_id)
+
+            song = claimed.data[0]
+            cls._publish(song)
+
+            blob_name = f"{song_id}.wav"
+            cache = get_generation_cache()
+
+            # Listeners on /api/songs/<id>/stream hear audio as it is decoded
+            on_chunk = None
+            if settings.audio_stream_chunk_tokens > 0:
+                on_chunk = streams.open(song_id, MusicGenerator().sampling_rate).append
+
+            # Only the model runs on this worker; storing the audio happens on
+            # the upload pool so the next job can start right away
+            if cache:
+                upload = cache.render_async(song["prompt"], song["max_tokens"], blob_name, on_chunk=on_chunk)
+            else:
                 generator = MusicGenerator()
-                audio_file_path = generator.generate(song["prompt"], song["max_tokens"])
-                
-                storage = StorageService()
-                blob_name = f"{song_id}.wav"
-                gcs_url = storage.upload_file(audio_file_path, blob_name)
-                
-                os.remove(audio_file_path)
-                
-                db.update("songs", {
-                    "status": SongStatus.COMPLETED.value,
-                    "gcs_url": gcs_url,
-                    "updated_at": datetime.utcnow().isoformat()
-                }).eq("id", song_id).execute()
-                
-            except Exception as exc:
-                db.update("songs", {
-                    "status": SongStatus.FAILED.value,
-                    "error_message": str(exc),
-                    "updated_at": datetime.utcnow().isoformat()
-                }).eq("id", song_id).execute()
-        
-        thread = threading.Thread(target=task, daemon=True)
-        thread.start()
+                audio = generator.generate_audio(song["prompt"], song["max_tokens"], on_chunk=on_chunk)
+                upload = get_services().storage.upload_audio_async(audio, blob_name)
+
+            upload.add_done_callback(lambda future: cls._finish_song(song_id, future))
+
+        except Exception as exc:
+            cls._fail_song(song_id, exc)
+
+    @classmethod
+    def _finish_song(cls, song_id: str, upload):
+        """Mark the song completed once its upload is done."""
+        try:
+            gcs_url = upload.result()
+        except Exception as exc:
+            cls._fail_song(song_id, exc)
+            return
+
+        def completed(written):
+            cls._release_lease(song_id)
+            if written.exception():
+                # Left processing, so it is generated again once its lease expires
+                get_stream_registry().close(song_id, error="Could not save the song")
+                return
+            song = written.result()
+            get_stream_registry().close(song_id)
+            cls._record_song_finished(SongStatus.COMPLETED)
+            if song:
+                cls._publish(song)
+                cls.queue_encoding(song)
+
+        get_status_writer().write(
+            song_id,
+            status=SongStatus.COMPLETED.value,
+            gcs_url=gcs_url,
+            updated_at=datetime.utcnow().isoformat()
+        ).add_done_callback(completed)
+
+    @classmethod
+    def _fail_song(cls, song_id: str, exc: Exception):
+        def failed(written):
+            cls._release_lease(song_id)
+            get_stream_registry().close(song_id, error=str(exc))
+            if written.exception():
+                return
+            song = written.result()
+            cls._record_song_finished(SongStatus.FAILED)
+            if song:
+                cls._publish(song)
+
+        get_status_writer().write(
+            song_id,
+            status=SongStatus.FAILED.value,
+            error_message=str(exc),
+            updated_at=datetime.utcnow().isoformat()
+        ).add_done_callback(failed)
+
+    @classmethod
+    def _encode_song(cls, song: dict):
+        from scipy.io import wavfile
+        from services.audio_encoder import FORMATS, blob_name_for, encode
+
+        song_id = song["id"]
+        audio_formats = dict(song.get("audio_formats") or {})
+        pending = [name for name, url in audio_formats.items() if url is None]
+        if not pending:
+            return
+
+        storage = get_services().storage
+        source_blob_name = f"{song_id}.wav"
+        sampling_rate, audio = wavfile.read(io.BytesIO(storage.download_bytes(source_blob_name)))
+
+        for name in pending:
+            try:
+                with STAGE_SECONDS.timer(("transcode",)):
+                    data = encode(audio, sampling_rate, name)
+                audio_formats[name] = storage.upload_from_bytes(
+                    data,
+                    blob_name_for(source_blob_name, name),
+                    content_type=FORMATS[name].content_type,
+                )
+            except Exception:
+                # Drop the format so clients stop waiting for it
+                ENCODE_ERRORS.inc(labels=(name,))
+                logger.exception("Encoding song %s as %s failed", song_id, name)
+                del audio_formats[name]
+
+        def encoded(written):
+            # A write that was given up on is cleaned up like a deleted song
+            updated = None if written.exception() else written.result()
+            if updated:
+                cls._publish(updated)
+                return
+
+            # Deleted while we were encoding
+            for name in audio_formats:
+                try:
+                    storage.delete_file(blob_name_for(source_blob_name, name))
+                except Exception:
+                    pass
+
+        get_status_writer().write(
+            song_id,
+            audio_formats=audio_formats,
+            updated_at=datetime.utcnow().isoformat()
+        ).add_done_callback(encoded)
+
+    @classmethod
+    def record_db_calls(cls, count: int = 1):
+        with cls._stats_lock:
+            cls._stats["db_calls"] += count
+
+    @classmethod
+    def _record_song_finished(cls, status: SongStatus):
+        SONGS.inc(labels=("song", status.value))
+        with cls._stats_lock:
+            cls._stats["songs"] += 1
+
+    @classmethod
+    def lifecycle_stats(cls) -> dict:
+        """Database calls made per song, from insert to completed/failed.
+
+        Counts the insert and claim of each song plus the status writer's
+        batched calls (which also carry the encoders' updates).
+        """
+        with cls._stats_lock:
+            songs = cls._stats["songs"]
+            db_calls = cls._stats["db_calls"]
+        db_calls += get_status_writer().calls
+        return {
+            "songs": songs,
+            "db_calls": db_calls,
+            "db_calls_per_song": round(db_calls / songs, 2) if songs else None,
+        }
+
+    @staticmethod
+    def _publish(*songs: dict):
+        broker = get_event_broker()
+        for song in songs:
+            broker.publish(song["user_id"], SongResponse(**song).model_dump(mode="json"))
+
+    @staticmethod
+    @profiled_job("anonymous")
+    def _generate_anonymous(job_id: str):
+        store = get_job_store()
+        job = store.update(job_id, status=SongStatus.PROCESSING)
+
+        if job is None:
+            return
+
+        try:
+            result = get_services().song.generate_anonymous_song(job.prompt, song_id=job.id)
+            store.update(job_id, status=SongStatus.COMPLETED, download_url=result["download_url"])
+            SONGS.inc(labels=("anonymous", SongStatus.COMPLETED.value))
+        except Exception as exc:
+            store.update(job_id, status=SongStatus.FAILED, error_message=str(exc))
+            SONGS.inc(labels=("anonymous", SongStatus.FAILED.value))
+
+
+DB_CALLS_PER_SONG.set_function(lambda: BackgroundTaskProcessor.lifecycle_stats()["db_calls_per_song"] or 0)
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+from models import AnonymousJob, SongStatus
+from config import get_settings
+
+
+TERMINAL_STATUSES = {SongStatus.COMPLETED, SongStatus.FAILED}
+
+
+class AnonymousJobStore:
+    """Ephemeral store for anonymous generation jobs, which have no songs row.
+
+    Each job is a small JSON file so that every gunicorn worker on the host
+    sees the same jobs; files older than ``ttl_seconds`` are purged.
+    """
+
+    def __init__(self, path: str, ttl_seconds: int, poll_interval: float = 0.5):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.poll_interval = poll_interval
+        os.makedirs(self.path, exist_ok=True)
+
+        self._changed = threading.Condition()
+        self._last_purge = 0.0
+
+    def create(self, prompt: str, max_tokens: int) -> AnonymousJob:
+        now = datetime.utcnow()
+        job = AnonymousJob(
+            id=str(uuid.uuid4()),
+            prompt=prompt,
+            max_tokens=max_tokens,
+            created_at=now,
+            updated_at=now,
+        )
+        self._write(job)
+        self._maybe_purge()
+        return job
+
+    def get(self, job_id: str) -> Optional[AnonymousJob]:
+        file_path = self._file_path(job_id)
+        if file_path is None:
+            return None
+
+        try:
+            with open(file_path, "r") as f:
+                job = AnonymousJob.model_validate_json(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if self._expired(job):
+            self._remove(job_id)
+            return None
+
+        return job
+
+    def update(self, job_id: str, **fields) -> Optional[AnonymousJob]:
+        job = self.get(job_id)
+        if job is None:
+            return None
+
+        job = job.model_copy(update={**fields, "updated_at": datetime.utcnow()})
+        self._write(job)
+        return job
+
+    def wait(self, job_id: str, timeout: float) -> Optional[AnonymousJob]:
+        """Block until the job finishes or ``timeout`` seconds pass.
+
+        Updates made in this process wake waiters immediately; updates made by
+        another process are picked up on the next poll.
+        """
+        deadline = time.monotonic() + timeout
+        job = self.get(job_id)
+
+        while job is not None and job.status not in TERMINAL_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            with self._changed:
+                self._changed.wait(min(remaining, self.poll_interval))
+            job = self.get(job_id)
+
+        return job
+
+    def _file_path(self, job_id: str) -> Optional[str]:
+        try:
+            # Only accept canonical UUIDs so a job id can never escape the store
+            job_id = str(uuid.UUID(job_id))
+        except ValueError:
+            return None
+        return os.path.join(self.path, f"{job_id}.json")
+
+    def _write(self, job: AnonymousJob) -> None:
+        file_path = self._file_path(job.id)
+        tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(job.model_dump_json())
+        os.replace(tmp_path, file_path)
+
+        with self._changed:
+            self._changed.notify_all()
+
+    def _remove(self, job_id: str) -> None:
+        try:
+            os.remove(self._file_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def _expired(self, job: AnonymousJob) -> bool:
+        return (datetime.utcnow() - job.created_at).total_seconds() > self.ttl_seconds
+
+    def _maybe_purge(self) -> None:
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+
+        for name in os.listdir(self.path):
+            file_path = os.path.join(self.path, name)
+            try:
+                if now - os.path.getmtime(file_path) > self.ttl_seconds:
+                    os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+
+@lru_cache()
+def get_job_store() -> AnonymousJobStore:
+    settings = get_settings()
+    return AnonymousJobStore(settings.anonymous_job_path, settings.anonymous_job_ttl_seconds)
@@ -0,0 +1,189 @@
+import atexit
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from config import get_settings
+from services.container import get_services
+
+
+@dataclass
+class PendingWrite:
+    fields: dict = field(default_factory=dict)
+    futures: List[Future] = field(default_factory=list)
+
+
+class StatusWriter:
+    """Write-behind buffer for song state transitions.
+
+    ``write`` records the new fields of a song and returns at once. Writes
+    to the same song are merged, and a background thread flushes up to
+    ``max_batch_size`` songs per database call every ``flush_interval_ms``
+    (or as soon as a batch fills up) through the ``update_songs`` function
+    in db/schema.sql. A failed flush is retried with backoff, merged with
+    anything written in the meantime. After ``max_attempts`` failures in a
+    row the batch is written one song at a time, so one bad row cannot hold
+    up the others, and the songs that still fail are given up on.
+    ``close`` drains the buffer on exit.
+
+    The Future returned by ``write`` resolves to the updated row after the
+    flush, or None if the song no longer exists. It raises the database
+    error if the write was given up on. Futures are resolved on a separate
+    callback thread, so the work chained onto them (events, encodes) never
+    holds up the next flush.
+    """
+
+    def __init__(self, flush_interval_ms: int = 100, max_batch_size: int = 100, retry_max_seconds: float = 30.0, max_attempts: int = 5):
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self.retry_max_seconds = retry_max_seconds
+        self.max_attempts = max(1, max_attempts)
+
+        self.calls = 0
+        self.rows = 0
+
+        self._pending: "OrderedDict[str, PendingWrite]" = OrderedDict()
+        self._in_flight = 0
+        # Batches whose futures are still being resolved
+        self._resolving = 0
+        self._callbacks = ThreadPoolExecutor(max_workers=1, thread_name_prefix="status-callbacks")
+        self._changed = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="status-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, song_id: str, **fields) -> Future:
+        future = Future()
+        with self._changed:
+            pending = self._pending.setdefault(song_id, PendingWrite())
+            pending.fields.update(fields)
+            pending.futures.append(future)
+            if len(self._pending) >= self.max_batch_size:
+                self._changed.notify_all()
+        return future
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything written so far is stored and its futures
+        resolved; False on timeout."""
+        with self._changed:
+            self._changed.notify_all()
+            return self._changed.wait_for(
+                lambda: not self._pending and not self._in_flight and not self._resolving, timeout
+            )
+
+    def close(self, timeout: float = 10.0) -> None:
+        self.flush(timeout)
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+    def _take_batch(self) -> Dict[str, PendingWrite]:
+        batch = {}
+        while self._pending and len(batch) < self.max_batch_size:
+            song_id, pending = self._pending.popitem(last=False)
+            batch[song_id] = pending
+        self._in_flight = len(batch)
+        return batch
+
+    def _requeue(self, batch: Dict[str, PendingWrite]) -> None:
+        # Back to the front, in their original order
+        for song_id, failed in reversed(list(batch.items())):
+            newer = self._pending.pop(song_id, None)
+            if newer is not None:
+                failed.fields.update(newer.fields)
+                failed.futures.extend(newer.futures)
+            self._pending[song_id] = failed
+            self._pending.move_to_end(song_id, last=False)
+
+    def _run(self) -> None:
+        failures = 0
+        while True:
+            with self._changed:
+                self._changed.wait_for(
+                    lambda: self._closed or len(self._pending) >= self.max_batch_size,
+                    self.flush_interval,
+                )
+                if self._closed and not self._pending:
+                    self._callbacks.shutdown(wait=True)
+                    return
+                batch = self._take_batch()
+
+            if not batch:
+                continue
+
+            try:
+                rows = self._store(batch)
+            except Exception as exc:
+                failures += 1
+                if failures < self.max_attempts:
+                    delay = min(self.retry_max_seconds, 0.5 * 2 ** failures)
+                    print(f"WARNING: flushing {len(batch)} song update(s) failed, retrying in {delay:.1f}s: {exc}")
+                    with self._changed:
+                        self._requeue(batch)
+                        self._in_flight = 0
+                    time.sleep(delay)
+                    continue
+                print(f"WARNING: flushing {len(batch)} song update(s) failed {failures} times, writing them one by one: {exc}")
+                rows, outcomes = self._store_each(batch)
+            else:
+                outcomes = []
+
+            failures = 0
+            by_id = {row["id"]: row for row in rows}
+            for song_id, pending in batch.items():
+                outcomes.extend((future, by_id.get(song_id), None) for future in pending.futures)
+
+            with self._changed:
+                self._in_flight = 0
+                self._resolving += 1
+            self._callbacks.submit(self._resolve, outcomes)
+
+    def _resolve(self, outcomes: List[Tuple[Future, Any, Optional[Exception]]]) -> None:
+        try:
+            for future, result, exc in outcomes:
+                if exc is not None:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+        finally:
+            with self._changed:
+                self._resolving -= 1
+                self._changed.notify_all()
+
+    def _store_each(self, batch: Dict[str, PendingWrite]) -> Tuple[List[dict], list]:
+        """Store the songs of a failing batch separately.
+
+        Songs that fail again are removed from the batch; the futures to fail
+        with their error are returned along with the stored rows.
+        """
+        rows = []
+        failed = []
+        for song_id, pending in list(batch.items()):
+            try:
+                rows.extend(self._store({song_id: pending}))
+            except Exception as exc:
+                print(f"ERROR: giving up on update of song {song_id}: {exc}")
+                del batch[song_id]
+                failed.extend((future, None, exc) for future in pending.futures)
+        return rows, failed
+
+    def _store(self, batch: Dict[str, PendingWrite]) -> List[dict]:
+        updates = [{"id": song_id, **pending.fields} for song_id, pending in batch.items()]
+        result = get_services().database.rpc("update_songs", {"updates": updates}).execute()
+        self.calls += 1
+        self.rows += len(updates)
+        return result.data or []
+
+
+@lru_cache()
+def get_status_writer() -> StatusWriter:
+    settings = get_settings()
+    writer = StatusWriter(
+        flush_interval_ms=settings.status_flush_interval_ms,
+        max_batch_size=settings.status_flush_batch_size,
+    )
+    atexit.register(writer.close)
+    return writer
@@ -0,0 +1,157 @@
+import itertools
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+from services.metrics import JOB_SECONDS, JOBS_IN_FLIGHT, QUEUE_DEPTH, QUEUE_WAIT_SECONDS
+
+
+PRIORITY_PAID = 0
+PRIORITY_FREE = 1
+PRIORITY_ANONYMOUS = 2
+
+
+class QueueFullError(Exception):
+    """Raised when a job cannot be accepted because the queue is at capacity."""
+
+    def __init__(self, queue_depth: int, retry_after: int):
+        super().__init__("Generation queue is full, please retry later")
+        self.queue_depth = queue_depth
+        self.retry_after = retry_after
+
+
+@dataclass(order=True)
+class Job:
+    priority: int
+    sequence: int
+    func: Callable[..., Any] = field(compare=False)
+    args: tuple = field(default=(), compare=False)
+    attempt: int = field(default=1, compare=False)
+    enqueued_at: float = field(default_factory=time.monotonic, compare=False)
+
+
+class WorkerPool:
+    """Fixed-size pool of worker threads fed by a bounded priority queue.
+
+    Lower priority values are served first; jobs with equal priority run in
+    submission order. A job that raises is re-queued, up to ``max_attempts``
+    times in all.
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        max_queue_size: int,
+        max_attempts: int = 2,
+        retry_after: int = 30,
+        name: str = "worker",
+    ):
+        self.num_workers = max(1, num_workers)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_after = retry_after
+        self.name = name
+
+        self._queue: "queue.PriorityQueue[Job]" = queue.PriorityQueue(maxsize=max_queue_size)
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._workers: Dict[int, threading.Thread] = {}
+        self._current: Dict[int, Optional[Job]] = {}
+        self._started = False
+        self._stopping = threading.Event()
+
+        QUEUE_DEPTH.set_function(self.queue_depth, (name,))
+        JOBS_IN_FLIGHT.set_function(self.in_flight, (name,))
+
+    def start(self) -> None:
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for slot in range(self.num_workers):
+                self._spawn(slot)
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def submit(self, func: Callable[..., Any], *args, priority: int = PRIORITY_FREE) -> Job:
+        self.start()
+        job = Job(priority=priority, sequence=next(self._sequence), func=func, args=args)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise QueueFullError(self.queue_depth(), self.retry_after)
+        return job
+
+    def submit_many(self, func: Callable[..., Any], args_list, priority: int = PRIORITY_FREE) -> int:
+        """Queue one job per args tuple, stopping at the first that does not fit.
+
+        Returns how many were queued; those are the first ones of args_list.
+        """
+        self.start()
+        queued = 0
+        for args in args_list:
+            job = Job(priority=priority, sequence=next(self._sequence), func=func, args=tuple(args))
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                break
+            queued += 1
+        return queued
+
+    def free_slots(self) -> int:
+        """Jobs that can still be queued right now."""
+        if self._queue.maxsize <= 0:
+            return 2 ** 31
+        return max(0, self._queue.maxsize - self._queue.qsize())
+
+    def is_full(self) -> bool:
+        return self._queue.full()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._current.values() if job is not None)
+
+    def _spawn(self, slot: int) -> None:
+        thread = threading.Thread(
+            target=self._run, args=(slot,), name=f"{self.name}-{slot}", daemon=True
+        )
+        self._workers[slot] = thread
+        self._current[slot] = None
+        thread.start()
+
+    def _run(self, slot: int) -> None:
+        while not self._stopping.is_set():
+            try:
+                job = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+            with self._lock:
+                self._current[slot] = job
+            started = time.monotonic()
+            QUEUE_WAIT_SECONDS.observe(started - job.enqueued_at, (self.name,))
+            try:
+                job.func(*job.args)
+            except Exception as exc:
+                print(f"{self.name}: job {job.func.__name__}{job.args} raised {exc!r}")
+                self._requeue(job)
+            finally:
+                JOB_SECONDS.observe(time.monotonic() - started, (self.name,))
+                with self._lock:
+                    self._current[slot] = None
+                self._queue.task_done()
+
+    def _requeue(self, job: Job) -> None:
+        if job.attempt >= self.max_attempts:
+            print(f"{self.name}: dropping {job.func.__name__}{job.args} after {job.attempt} attempts")
+            return
+        job.attempt += 1
+        job.sequence = next(self._sequence)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            print(f"{self.name}: queue full, could not requeue {job.func.__name__}{job.args}")
@@ -0,0 +1,88 @@
+"""Shared fixtures. The services run on the in-memory database from
+benchmarks/local_backends.py, with local storage in a temp directory and
+the mock model, so no test needs Supabase, GCS or torch."""
+import os
+import tempfile
+
+_directory = tempfile.mkdtemp(prefix="musicgen-tests-")
+os.environ.update({
+    "SECRET_KEY": "test-secret-key",
+    "JWT_SECRET_KEY": "test-jwt-secret-key-that-is-at-least-32-bytes",
+    "SUPABASE_URL": "http://supabase.invalid",
+    "SUPABASE_KEY": "test",
+    "GCS_BUCKET_NAME": "",
+    "LOCAL_STORAGE_PATH": os.path.join(_directory, "storage"),
+    "ANONYMOUS_JOB_PATH": os.path.join(_directory, "jobs"),
+    "MUSICGEN_MODEL": "mock",
+    "INFERENCE_SERVER_ADDRESS": "",
+    "MODEL_WARMUP": "false",
+    "RECOVER_PENDING_SONGS": "false",
+    "PROFILING_ENABLED": "false",
+    "GENERATION_CACHE_ENABLED": "false",
+})
+
+import uuid
+
+import pytest
+
+from benchmarks.local_backends import InMemoryDatabaseService, InMemorySupabase
+from config import get_settings
+from services.container import get_services
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    """The settings, with overrides applied by set(name=value, ...)."""
+    class Overrides:
+        def set(self, **values):
+            for name, value in values.items():
+                monkeypatch.setattr(get_settings(), name, value)
+            return get_settings()
+
+    return Overrides()
+
+
+@pytest.fixture
+def database():
+    """A fresh in-memory database behind the service container.
+
+    Services are rebuilt on first use, so they pick it up.
+    """
+    services = get_services()
+    with services._lock:
+        services._instances.clear()
+    client = InMemorySupabase()
+    services.override("database", InMemoryDatabaseService(client))
+    yield client
+    with services._lock:
+        services._instances.clear()
+
+
+@pytest.fixture
+def user(database):
+    row = {
+        "id": str(uuid.uuid4()),
+        "email": f"{uuid.uuid4().hex[:12]}@example.com",
+        "password_hash": "-",
+        "first_name": "Test",
+        "last_name": "User",
+    }
+    database.seed("users", [row])
+    return row
+
+
+@pytest.fixture
+def app(database):
+    from app import create_app
+
+    app = create_app()
+    app.config["TESTING"] = True
+    return app
+
+
+@pytest.fixture
+def auth_headers(app, user):
+    from flask_jwt_extended import create_access_token
+
+    with app.app_context():
+        return {"Authorization": f"Bearer {create_access_token(identity=user['id'])}"}
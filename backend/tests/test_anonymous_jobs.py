@@ -0,0 +1,47 @@
+import time
+
+from tasks.job_store import get_job_store
+
+
+def test_anonymous_job_lifecycle(app):
+    client = app.test_client()
+
+    created = client.post("/api/songs/anonymous", json={"prompt": "a calm piano"})
+    assert created.status_code == 202
+    job = created.get_json()["job"]
+    assert job["status"] == "pending"
+
+    # Held until the worker has generated the song
+    response = client.get(f"/api/songs/anonymous/{job['id']}?wait=20")
+    assert response.status_code == 200
+    finished = response.get_json()["job"]
+    assert finished["status"] == "completed"
+    assert finished["download_url"]
+
+
+def test_wait_returns_the_unfinished_job_after_the_timeout(app):
+    job = get_job_store().create("a calm piano", 32)
+
+    started = time.monotonic()
+    response = app.test_client().get(f"/api/songs/anonymous/{job.id}?wait=0.3")
+
+    assert response.status_code == 200
+    assert response.get_json()["job"]["status"] == "pending"
+    assert 0.3 <= time.monotonic() - started < 5
+
+
+def test_wait_is_capped(app, settings):
+    settings.set(anonymous_job_max_wait_seconds=0.2)
+    job = get_job_store().create("a calm piano", 32)
+
+    started = time.monotonic()
+    response = app.test_client().get(f"/api/songs/anonymous/{job.id}?wait=600")
+
+    assert response.get_json()["job"]["status"] == "pending"
+    assert time.monotonic() - started < 5
+
+
+def test_unknown_job(app):
+    response = app.test_client().get("/api/songs/anonymous/no-such-job?wait=1")
+
+    assert response.status_code == 404
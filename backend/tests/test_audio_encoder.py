@@ -0,0 +1,46 @@
+import io
+
+import numpy as np
+import pytest
+
+from services import audio_encoder
+from services.audio_encoder import FORMATS, encode
+
+soundfile = pytest.importorskip("soundfile")
+
+SAMPLING_RATE = 32000
+
+
+def _tone(seconds=1.0):
+    t = np.arange(int(SAMPLING_RATE * seconds)) / SAMPLING_RATE
+    return (0.5 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+
+
+@pytest.mark.parametrize("name", list(FORMATS))
+def test_round_trip(name):
+    if name not in audio_encoder.available_formats():
+        pytest.skip(f"libsndfile cannot encode {name} here")
+
+    data = encode(_tone(), SAMPLING_RATE, name)
+    audio, sampling_rate = soundfile.read(io.BytesIO(data), dtype="float32")
+
+    assert sampling_rate == (FORMATS[name].sampling_rate or SAMPLING_RATE)
+    # Lossy codecs pad the start and end a little
+    assert abs(len(audio) / sampling_rate - 1.0) < 0.1
+    assert 0.3 < np.abs(audio).max() < 0.6
+
+
+def test_compression_level_is_only_passed_when_supported(monkeypatch):
+    calls = []
+
+    def old_write(file, data, samplerate, subtype=None, endian=None, format=None, closefd=True):
+        calls.append(subtype)
+
+    monkeypatch.setattr(soundfile, "write", old_write)
+    audio_encoder._supports_compression_level.cache_clear()
+    try:
+        encode(_tone(0.1), SAMPLING_RATE, "flac")
+    finally:
+        audio_encoder._supports_compression_level.cache_clear()
+
+    assert calls == ["PCM_16"]
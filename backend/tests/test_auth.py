@@ -0,0 +1,94 @@
+import bcrypt
+import pytest
+
+from services.auth import LoginRateLimiter, PasswordHasher
+from services.container import get_services
+
+
+def stream_token(client, auth_headers):
+    response = client.post("/api/songs/stream-token", headers=auth_headers)
+    assert response.status_code == 200
+    return response.get_json()["token"]
+
+
+def test_access_token_is_not_read_from_the_query_string(app, auth_headers):
+    access_token = auth_headers["Authorization"].split()[1]
+    client = app.test_client()
+
+    assert client.get(f"/api/auth/me?jwt={access_token}").status_code == 401
+    assert client.get(f"/api/songs/events?jwt={access_token}").status_code == 401
+    assert client.get("/api/auth/me", headers=auth_headers).status_code == 200
+
+
+def test_stream_token_only_opens_streams(app, auth_headers, settings):
+    settings.set(sse_max_stream_seconds=0)
+    client = app.test_client()
+    token = stream_token(client, auth_headers)
+
+    assert client.get(f"/api/songs/events?jwt={token}").status_code == 200
+    assert client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"}).status_code == 401
+    assert client.get(f"/api/auth/me?jwt={token}").status_code == 401
+    # The stream routes do not take tokens from headers
+    assert client.get("/api/songs/events", headers={"Authorization": f"Bearer {token}"}).status_code == 401
+
+
+
+@pytest.fixture
+def auth(database, user):
+    """The auth service with a fresh rate limiter (2 attempts per email, 4 per
+    IP) and a user whose password is "secret"."""
+    database.tables["users"].rows[user["id"]]["password_hash"] = bcrypt.hashpw(b"secret", bcrypt.gensalt(4)).decode()
+    service = get_services().auth
+    service.login_limiter = LoginRateLimiter(max_per_email=2, max_per_ip=4, window_seconds=300)
+    service.hasher = PasswordHasher(rounds=4, num_workers=1, max_pending=1)
+    return service
+
+
+def login(client, email, password):
+    return client.post("/api/auth/login", json={"email": email, "password": password})
+
+
+def test_login_is_rate_limited_per_email(app, auth, user):
+    client = app.test_client()
+
+    assert [login(client, user["email"], "wrong").status_code for _ in range(2)] == [401, 401]
+    # Refused before the password is checked, so even the right one is
+    limited = login(client, user["email"], "secret")
+    assert limited.status_code == 429
+    assert int(limited.headers["Retry-After"]) > 0
+    assert limited.get_json()["retry_after"] == int(limited.headers["Retry-After"])
+
+
+def test_successful_login_clears_the_email_window(app, auth, user):
+    client = app.test_client()
+
+    assert login(client, user["email"], "wrong").status_code == 401
+    assert login(client, user["email"], "secret").status_code == 200
+    assert login(client, user["email"], "wrong").status_code == 401
+    assert login(client, user["email"], "secret").status_code == 200
+
+
+def test_login_is_rate_limited_per_client_ip(app, auth, user):
+    client = app.test_client()
+
+    statuses = [login(client, f"nobody-{i}@example.com", "wrong").status_code for i in range(5)]
+
+    assert statuses == [401, 401, 401, 401, 429]
+
+
+def test_busy_password_hasher_answers_503(app, auth, user):
+    client = app.test_client()
+    # The one hashing slot is taken
+    auth.hasher._slots.acquire()
+    try:
+        response = login(client, user["email"], "secret")
+        signup = client.post("/api/auth/signup", json={
+            "email": "new@example.com", "password": "secret123", "first_name": "N", "last_name": "U",
+        })
+    finally:
+        auth.hasher._slots.release()
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert signup.status_code == 503
+    assert login(client, user["email"], "secret").status_code == 200
@@ -0,0 +1,144 @@
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from tasks import BackgroundTaskProcessor
+from tasks.worker_pool import WorkerPool
+
+
+def _song(user, status, age_seconds=0, lease_seconds=None):
+    now = datetime.utcnow()
+    updated_at = (now - timedelta(seconds=age_seconds)).isoformat()
+    song = {
+        "id": str(uuid.uuid4()),
+        "user_id": user["id"],
+        "prompt": "a calm piano",
+        "max_tokens": 32,
+        "status": status,
+        "created_at": updated_at,
+        "updated_at": updated_at,
+    }
+    if lease_seconds is not None:
+        song["lease_expires_at"] = (now + timedelta(seconds=lease_seconds)).isoformat()
+    return song
+
+
+@pytest.fixture
+def songs(database, user, settings):
+    settings.set(generation_lease_seconds=600)
+    rows = {
+        "pending": _song(user, "pending"),
+        "stale": _song(user, "processing", age_seconds=3600),
+        "running": _song(user, "processing", age_seconds=60),
+        # Renewed by its heartbeat long after the claim
+        "renewed": _song(user, "processing", age_seconds=3600, lease_seconds=300),
+        "expired": _song(user, "processing", age_seconds=60, lease_seconds=-1),
+        "completed": _song(user, "completed", age_seconds=3600),
+    }
+    database.seed("songs", list(rows.values()))
+    return rows
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    queued = []
+    monkeypatch.setattr(BackgroundTaskProcessor, "_pool", WorkerPool(num_workers=1, max_queue_size=10))
+    monkeypatch.setattr(
+        BackgroundTaskProcessor,
+        "process_song_generation",
+        classmethod(lambda cls, song_id, is_paid=False: queued.append(song_id)),
+    )
+    return queued
+
+
+def test_recover_queues_pending_and_stale_songs(songs, queued):
+    assert BackgroundTaskProcessor.recover_pending_songs() == 3
+    assert set(queued) == {songs["pending"]["id"], songs["stale"]["id"], songs["expired"]["id"]}
+
+
+def test_periodic_recovery_leaves_pending_songs(songs, queued):
+    assert BackgroundTaskProcessor.recover_pending_songs(stale_only=True) == 2
+    assert set(queued) == {songs["stale"]["id"], songs["expired"]["id"]}
+
+
+def test_recovery_without_lease(songs, queued, settings):
+    settings.set(generation_lease_seconds=0)
+
+    assert BackgroundTaskProcessor.recover_pending_songs() == 1
+    assert queued == [songs["pending"]["id"]]
+
+
+@pytest.fixture
+def claims(monkeypatch):
+    """Songs the worker claimed; generation stops right after the claim."""
+    claims = []
+    monkeypatch.setattr(BackgroundTaskProcessor, "_leases", set())
+    # Leases are renewed by calling renew_leases, not by a heartbeat thread
+    monkeypatch.setattr(BackgroundTaskProcessor, "_heartbeat", threading.current_thread())
+    monkeypatch.setattr(BackgroundTaskProcessor, "_publish", staticmethod(lambda *songs: claims.extend(songs)))
+    monkeypatch.setattr(BackgroundTaskProcessor, "_fail_song", classmethod(lambda cls, song_id, exc: None))
+    monkeypatch.setattr("tasks.background_processor.get_generation_cache", lambda: None)
+    monkeypatch.setattr("tasks.background_processor.MusicGenerator.generate_audio", lambda *args, **kwargs: 1 / 0)
+    return claims
+
+
+def test_claim(songs, claims, database):
+    for name in ("pending", "stale", "running", "renewed", "expired", "completed"):
+        BackgroundTaskProcessor._generate_song(songs[name]["id"])
+
+    claimed = ["pending", "stale", "expired"]
+    assert [song["id"] for song in claims] == [songs[name]["id"] for name in claimed]
+    rows = database.tables["songs"].rows
+    now = datetime.utcnow().isoformat()
+    for name in claimed:
+        assert rows[songs[name]["id"]]["lease_expires_at"] > now
+    assert rows[songs["running"]["id"]]["updated_at"] == songs["running"]["updated_at"]
+    assert rows[songs["renewed"]["id"]]["updated_at"] == songs["renewed"]["updated_at"]
+
+
+def test_claim_is_taken_once(songs, claims):
+    BackgroundTaskProcessor._generate_song(songs["stale"]["id"])
+    # A second process that found the same stale song
+    BackgroundTaskProcessor._generate_song(songs["stale"]["id"])
+
+    assert len(claims) == 1
+
+
+def test_heartbeat_renews_leases_until_the_song_is_done(songs, claims, database, queued):
+    song_id = songs["pending"]["id"]
+    BackgroundTaskProcessor._generate_song(song_id)
+    row = database.tables["songs"].rows[song_id]
+
+    # Long after the claim, the heartbeat keeps the song from being re-claimed
+    row["lease_expires_at"] = (datetime.utcnow() - timedelta(seconds=1)).isoformat()
+    assert BackgroundTaskProcessor.renew_leases() == 1
+    assert row["lease_expires_at"] > datetime.utcnow().isoformat()
+    BackgroundTaskProcessor.recover_pending_songs(stale_only=True)
+    assert song_id not in queued
+
+    row["status"] = "completed"
+    assert BackgroundTaskProcessor.renew_leases() == 0
+    assert song_id not in BackgroundTaskProcessor._leases
+
+
+def test_pool_retries_jobs_that_raise():
+    pool = WorkerPool(num_workers=1, max_queue_size=10, max_attempts=3)
+    attempts = []
+    done = threading.Event()
+
+    def job():
+        attempts.append(1)
+        if len(attempts) == 3:
+            done.set()
+        raise RuntimeError("boom")
+
+    try:
+        pool.submit(job)
+        assert done.wait(5)
+        pool._queue.join()
+    finally:
+        pool.stop()
+
+    assert len(attempts) == 3
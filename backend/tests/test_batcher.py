@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+from services.batcher import MicroBatcher
+
+
+class RecordingRun:
+    """run_batch that records each call and holds the first one until released,
+    so the requests submitted meanwhile queue up for the next window."""
+
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+
+    def __call__(self, prompts, max_tokens):
+        self.calls.append((list(prompts), max_tokens))
+        if len(self.calls) == 1:
+            self.release.wait(5)
+        return [f"{prompt}:{max_tokens}" for prompt in prompts]
+
+
+def submit_while_busy(batcher, run, requests):
+    """Submit a blocker, then requests while it runs; returns their futures."""
+    blocker = batcher.submit("blocker", 1)
+    while not run.calls:
+        run.release.wait(0.001)
+    futures = [batcher.submit(prompt, max_tokens) for prompt, max_tokens in requests]
+    run.release.set()
+    blocker.result(timeout=5)
+    return futures
+
+
+def test_concurrent_requests_share_one_call():
+    run = RecordingRun()
+    batcher = MicroBatcher(run, max_batch_size=4, max_wait_ms=50, token_bucket=256)
+
+    futures = submit_while_busy(batcher, run, [("a", 100), ("b", 200), ("c", 256)])
+
+    assert [future.result(timeout=5) for future in futures] == ["a:256", "b:256", "c:256"]
+    assert run.calls[1:] == [(["a", "b", "c"], 256)]
+
+
+def test_requests_are_grouped_by_token_bucket():
+    run = RecordingRun()
+    batcher = MicroBatcher(run, max_batch_size=4, max_wait_ms=50, token_bucket=256)
+
+    futures = submit_while_busy(batcher, run, [("short", 64), ("long", 1000), ("short too", 200)])
+
+    # Each prompt is padded only to the longest request of its own bucket
+    assert [future.result(timeout=5) for future in futures] == ["short:200", "long:1000", "short too:200"]
+    assert sorted(run.calls[1:]) == [(["long"], 1000), (["short", "short too"], 200)]
+
+
+def test_batches_are_split_at_max_batch_size():
+    run = RecordingRun()
+    batcher = MicroBatcher(run, max_batch_size=2, max_wait_ms=50, token_bucket=256)
+
+    futures = submit_while_busy(batcher, run, [(prompt, 32) for prompt in "abcde"])
+
+    assert [future.result(timeout=5) for future in futures] == [f"{prompt}:32" for prompt in "abcde"]
+    assert [prompts for prompts, _ in run.calls[1:]] == [["a", "b"], ["c", "d"], ["e"]]
+
+
+def test_a_failed_batch_fails_only_its_own_requests():
+    def run(prompts, max_tokens):
+        if max_tokens > 256:
+            raise RuntimeError("out of memory")
+        return prompts
+
+    batcher = MicroBatcher(run, max_batch_size=4, max_wait_ms=50, token_bucket=256)
+    long = batcher.submit("long", 1000)
+    short = batcher.submit("short", 32)
+
+    with pytest.raises(RuntimeError):
+        long.result(timeout=5)
+    assert short.result(timeout=5) == "short"
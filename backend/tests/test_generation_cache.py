@@ -0,0 +1,81 @@
+import io
+import os
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from services.container import get_services
+from services.generation_cache import GenerationCache
+from services.music_generator import GeneratedAudio
+
+
+def _store_blob(key, size, age_seconds=0):
+    storage = get_services().storage
+    blob_name = f"{GenerationCache.BLOB_PREFIX}/{key}.wav"
+    storage.upload_from_bytes(b"\0" * size, blob_name, content_type="audio/wav")
+    path = os.path.join(storage.settings.local_storage_path, blob_name)
+    created_at = time.time() - age_seconds
+    os.utime(path, (created_at, created_at))
+    return blob_name
+
+
+def _blob_exists(blob_name):
+    return os.path.exists(os.path.join(get_services().storage.settings.local_storage_path, blob_name))
+
+
+@pytest.fixture
+def cache(database):
+    storage = get_services().storage
+    for blob_name in storage.list_files(f"{GenerationCache.BLOB_PREFIX}/"):
+        storage.delete_file(blob_name)
+
+    def make(**options):
+        return GenerationCache(**{"max_entries": 10, "max_bytes": 10000, "ttl_seconds": 3600, **options})
+
+    return make
+
+
+def test_keys_keep_case_and_collapse_whitespace(cache):
+    generation_cache = cache()
+
+    assert generation_cache.key_for("Calm  piano ", 32) == generation_cache.key_for("Calm piano", 32)
+    assert generation_cache.key_for("Calm piano", 32) != generation_cache.key_for("calm piano", 32)
+
+
+def test_eviction_is_least_recently_used(cache):
+    generation_cache = cache(max_entries=2)
+    _store_blob("a", 10, age_seconds=10)
+    _store_blob("b", 10)
+    generation_cache.rebuild_index()
+
+    # "a" is older but was used last, so "b" goes when "c" comes in
+    assert generation_cache._lookup("a") is not None
+    stored = Future()
+    generation_cache._store("c", GeneratedAudio(buffer=io.BytesIO(b"\0" * 10)), stored)
+
+    assert stored.result().blob_name == "cache/c.wav"
+    assert list(generation_cache._entries) == ["a", "c"]
+    assert not _blob_exists("cache/b.wav")
+
+
+def test_eviction_by_size(cache):
+    generation_cache = cache(max_bytes=250)
+    for age, key in enumerate(("newest", "middle", "oldest")):
+        _store_blob(key, 100, age_seconds=age * 10)
+
+    assert generation_cache.rebuild_index() == 2
+    assert list(generation_cache._entries) == ["middle", "newest"]
+    assert generation_cache._bytes == 200
+    assert not _blob_exists("cache/oldest.wav")
+
+
+def test_rebuild_drops_expired_blobs(cache):
+    generation_cache = cache(ttl_seconds=60)
+    fresh = _store_blob("fresh", 10)
+    expired = _store_blob("expired", 10, age_seconds=120)
+
+    assert generation_cache.rebuild_index() == 1
+    assert list(generation_cache._entries) == ["fresh"]
+    assert _blob_exists(fresh)
+    assert not _blob_exists(expired)
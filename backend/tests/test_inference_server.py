@@ -0,0 +1,21 @@
+import pytest
+
+from services.inference_server import InferenceServer, is_local_address, parse_address
+
+
+@pytest.mark.parametrize("address, local", [
+    ("/tmp/musicgen.sock", True),
+    ("127.0.0.1:9000", True),
+    ("localhost:9000", True),
+    ("::1:9000", True),
+    ("0.0.0.0:9000", False),
+    ("10.0.0.5:9000", False),
+    ("inference:9000", False),
+])
+def test_only_local_addresses_are_local(address, local):
+    assert is_local_address(parse_address(address)) is local
+
+
+def test_server_refuses_public_addresses():
+    with pytest.raises(ValueError):
+        InferenceServer("0.0.0.0:9000", replicas=1, pin_cpus=False)
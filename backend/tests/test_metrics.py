@@ -0,0 +1,88 @@
+import re
+import time
+
+METRICS = {
+    "musicgen_queue_depth": "gauge",
+    "musicgen_jobs_in_flight": "gauge",
+    "musicgen_queue_wait_seconds": "histogram",
+    "musicgen_job_seconds": "histogram",
+    "musicgen_stage_seconds": "histogram",
+    "musicgen_generated_tokens_total": "counter",
+    "musicgen_tokens_per_second": "histogram",
+    "musicgen_songs_total": "counter",
+    "musicgen_upload_bytes_total": "counter",
+    "musicgen_db_request_seconds": "histogram",
+    "musicgen_encode_errors_total": "counter",
+    "musicgen_db_calls_per_song": "gauge",
+    "musicgen_db_errors_total": "counter",
+}
+
+
+def scrape(app, headers=None):
+    response = app.test_client().get("/metrics", headers=headers)
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    return response.get_data(as_text=True)
+
+
+def sample(text, name, **labels):
+    """The value of the sample with exactly these labels, or None."""
+    wanted = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    pattern = re.escape(name + (f"{{{wanted}}}" if wanted else "")) + r" (\S+)$"
+    match = re.search(pattern, text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+def test_every_metric_is_declared(app):
+    text = scrape(app)
+
+    for name, kind in METRICS.items():
+        assert f"# TYPE {name} {kind}\n" in text
+        assert f"# HELP {name} " in text
+
+
+def test_a_generated_song_is_counted_by_stage_and_status(app, auth_headers):
+    before = scrape(app)
+    client = app.test_client()
+    job = client.post("/api/songs/anonymous", json={"prompt": "a calm piano"}).get_json()["job"]
+    assert client.get(f"/api/songs/anonymous/{job['id']}?wait=20").get_json()["job"]["status"] == "completed"
+    client.get("/api/auth/me", headers=auth_headers)
+
+    def grew(text, name, **labels):
+        return (sample(text, name, **labels) or 0) > (sample(before, name, **labels) or 0)
+
+    # The job is counted once the worker returns, just after the job is marked completed
+    deadline = time.monotonic() + 5
+    text = scrape(app)
+    while not grew(text, "musicgen_job_seconds_count", pool="song-generation") and time.monotonic() < deadline:
+        time.sleep(0.01)
+        text = scrape(app)
+
+    assert grew(text, "musicgen_job_seconds_count", pool="song-generation")
+    assert grew(text, "musicgen_queue_wait_seconds_count", pool="song-generation")
+    assert grew(text, "musicgen_songs_total", kind="anonymous", status="completed")
+    assert grew(text, "musicgen_stage_seconds_count", stage="synthesize")
+    assert grew(text, "musicgen_stage_seconds_count", stage="upload")
+    assert grew(text, "musicgen_db_request_seconds_count", method="GET", table="users")
+    assert sample(text, "musicgen_queue_depth", pool="song-generation") == 0
+    assert sample(text, "musicgen_stage_seconds_bucket", stage="synthesize", le="+Inf") == sample(
+        text, "musicgen_stage_seconds_count", stage="synthesize")
+
+
+def test_metrics_token(app, settings):
+    settings.set(metrics_token="scrape-me")
+    client = app.test_client()
+
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert scrape(app, {"Authorization": "Bearer scrape-me"})
+
+
+def test_metrics_can_be_turned_off(app, settings):
+    settings.set(metrics_enabled=False)
+
+    assert app.test_client().get("/metrics").status_code == 404
+
+
+def test_health_does_not_expose_lifecycle_stats(app):
+    assert "lifecycle" not in app.test_client().get("/health").get_json()
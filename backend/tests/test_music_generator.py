@@ -0,0 +1,76 @@
+import pytest
+
+from services.music_generator import MusicGenerator
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    """A MusicGenerator that loads a stand-in model and records generate calls."""
+    monkeypatch.setattr(MusicGenerator, "_instance", None)
+    monkeypatch.setattr(MusicGenerator, "_processor", None)
+    monkeypatch.setattr(MusicGenerator, "_model", None)
+    monkeypatch.setattr(MusicGenerator, "_state", "cold")
+    monkeypatch.setattr(MusicGenerator, "_warmed", False)
+
+    def load(self):
+        self._processor = object()
+        self._model = object()
+
+    calls = []
+    monkeypatch.setattr(MusicGenerator, "_load", load)
+    monkeypatch.setattr(MusicGenerator, "_generate_batch", lambda self, prompts, max_tokens: calls.append(prompts))
+
+    generator = MusicGenerator()
+    generator.calls = calls
+    return generator
+
+
+def test_load_without_warm_up_is_ready(generator, settings):
+    settings.set(model_warmup=False)
+
+    generator._ensure_loaded()
+
+    assert generator.state == "ready"
+    assert generator.calls == []
+
+
+def test_warm_up_runs_after_an_earlier_load(generator, settings):
+    settings.set(model_warmup=True)
+
+    # A request loads the model before the warm-up thread gets to it
+    generator._ensure_loaded()
+    assert generator.state == "warming"
+
+    generator.warm_up()
+    assert generator.calls == [["warm-up"]]
+    assert generator.state == "ready"
+
+    generator.warm_up()
+    assert generator.calls == [["warm-up"]]
+
+
+def test_failed_warm_up(generator, settings, monkeypatch):
+    settings.set(model_warmup=True)
+
+    def fail(self, prompts, max_tokens):
+        raise RuntimeError("out of memory")
+
+    monkeypatch.setattr(MusicGenerator, "_generate_batch", fail)
+
+    with pytest.raises(RuntimeError):
+        generator.warm_up()
+    assert generator.state == "failed"
+    assert not MusicGenerator._warmed
+
+
+def test_replica_model_is_warmed_up(generator, settings, monkeypatch):
+    settings.set(model_warmup=True)
+    monkeypatch.setattr(MusicGenerator, "_configure_threads", classmethod(lambda cls: None))
+
+    # The inference server hands a replica the model it loaded
+    generator._use_model(object(), object())
+    assert generator.state == "warming"
+
+    generator.warm_up()
+    assert generator.calls == [["warm-up"]]
+    assert generator.state == "ready"
@@ -0,0 +1,52 @@
+import pytest
+
+from services.batcher import MicroBatcher
+from services.profiling import get_profiler
+
+torch = pytest.importorskip("torch")
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    profiler = get_profiler()
+    monkeypatch.setattr(profiler, "torch_enabled", True)
+    return profiler
+
+
+def test_batched_generate_is_traced_into_the_job_profile(profiler):
+    def run_batch(prompts, max_tokens):
+        with profiler.torch_trace(f"generate {len(prompts)} x {max_tokens} tokens"):
+            torch.ones(4) + 1
+        return prompts
+
+    batcher = MicroBatcher(run_batch, max_batch_size=2, max_wait_ms=1)
+    session = profiler.start("job", "song 1")
+    try:
+        assert batcher.submit("a calm piano", 8).result(timeout=30) == "a calm piano"
+    finally:
+        profiler.finish(session)
+
+    assert [label for label, _ in session.torch_traces] == ["generate 1 x 8 tokens"]
+
+
+def test_unprofiled_batch_is_not_traced(profiler):
+    traced = []
+
+    def run_batch(prompts, max_tokens):
+        with profiler.torch_trace("generate"):
+            traced.append(profiler.current())
+        return prompts
+
+    MicroBatcher(run_batch, max_batch_size=2, max_wait_ms=1).submit("a calm piano", 8).result(timeout=30)
+
+    assert traced == [None]
+
+
+def test_limitations(profiler, settings):
+    assert profiler._limitations(settings.set(generation_batch_size=1)) == []
+
+    batched = settings.set(generation_batch_size=4)
+    assert "micro-batcher" in profiler._limitations(batched)[0]
+
+    served = settings.set(inference_server_address="/tmp/musicgen.sock")
+    assert "inference server" in profiler._limitations(served)[0]
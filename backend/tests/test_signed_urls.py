@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+import pytest
+
+from benchmarks.local_backends import FakeGcsClient, FakeGcsStorageService
+from services import storage as storage_module
+from services.storage import SignedUrlCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Stands in for time.time in services.storage; advance with clock.now += s."""
+    clock = SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(storage_module, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def test_cache_hands_out_a_url_until_the_refresh_margin(clock):
+    cache = SignedUrlCache(refresh_margin_seconds=300)
+    cache.put("song.wav", "signed-1", expires_at=clock.now + 3600)
+
+    clock.now += 3600 - 301
+    assert cache.get("song.wav") == "signed-1"
+
+    clock.now += 1
+    assert cache.get("song.wav") is None
+
+
+def test_cache_drops_the_least_recently_used_url():
+    cache = SignedUrlCache(refresh_margin_seconds=0, max_entries=2)
+    cache.put("a", "signed-a", expires_at=float("inf"))
+    cache.put("b", "signed-b", expires_at=float("inf"))
+    cache.get("a")
+    cache.put("c", "signed-c", expires_at=float("inf"))
+
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == ("signed-a", "signed-c")
+
+
+@pytest.fixture
+def gcs(settings, clock, monkeypatch):
+    settings.set(gcs_bucket_name="songs", gcs_signed_url_ttl_seconds=3600, gcs_signed_url_refresh_seconds=300)
+    cache = SignedUrlCache(refresh_margin_seconds=300)
+    monkeypatch.setattr(storage_module, "get_signed_url_cache", lambda: cache)
+    service = FakeGcsStorageService(FakeGcsClient())
+    service.signed_delivery = True
+    return service
+
+
+def test_signed_urls_are_reused_then_refreshed(gcs, clock):
+    urls = [f"https://storage.googleapis.com/songs/{name}.wav" for name in ("a", "b")]
+
+    first = gcs.delivery_urls(urls)
+    assert set(first) == set(urls)
+    assert all("X-Goog-Signature=" in signed for signed in first.values())
+    assert gcs.delivery_urls(urls) == first
+
+    # Within GCS_SIGNED_URL_REFRESH_SECONDS of expiring, the blobs are signed again
+    clock.now += 3600 - 300
+    refreshed = gcs.delivery_urls(urls)
+    assert all(refreshed[url] != first[url] for url in urls)
+
+
+def test_urls_outside_the_bucket_are_left_alone(gcs):
+    url = "https://example.com/song.wav"
+
+    assert gcs.delivery_urls([url, None]) == {url: url}
@@ -0,0 +1,118 @@
+import uuid
+
+import pytest
+
+from tasks import BackgroundTaskProcessor
+from tasks.worker_pool import WorkerPool
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """A generation queue with room for ``pool.slots`` more songs; queued ids
+    are recorded instead of generated."""
+    pool = WorkerPool(num_workers=1, max_queue_size=10, retry_after=7)
+    pool.slots = 10
+    pool.queued = []
+    monkeypatch.setattr(pool, "free_slots", lambda: pool.slots)
+    monkeypatch.setattr(BackgroundTaskProcessor, "_pool", pool)
+
+    def queue(cls, song_ids, is_paid=False):
+        pool.queued.extend(song_ids)
+        return len(song_ids)
+
+    monkeypatch.setattr(BackgroundTaskProcessor, "process_songs_generation", classmethod(queue))
+    yield pool
+    pool.stop()
+
+
+def create(app, auth_headers, songs):
+    return app.test_client().post("/api/songs/batch", json={"songs": songs}, headers=auth_headers)
+
+
+def test_create_reports_each_item(app, auth_headers, database, pool):
+    response = create(app, auth_headers, [
+        {"title": "one", "prompt": "a calm piano"},
+        {"title": "no prompt"},
+        {"title": "two", "prompt": "fast drums"},
+    ])
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [result["status"] for result in body["results"]] == [201, 400, 201]
+    assert (body["created"], body["failed"]) == (2, 1)
+    assert [result["index"] for result in body["results"]] == [0, 1, 2]
+    created = [body["results"][0]["song"]["id"], body["results"][2]["song"]["id"]]
+    assert pool.queued == created
+    assert set(database.tables["songs"].rows) == set(created)
+
+
+def test_create_refuses_what_the_queue_has_no_room_for(app, auth_headers, database, pool):
+    pool.slots = 1
+
+    response = create(app, auth_headers, [
+        {"title": "one", "prompt": "a calm piano"},
+        {"title": "two", "prompt": "fast drums"},
+    ])
+
+    body = response.get_json()
+    assert [result["status"] for result in body["results"]] == [201, 503]
+    assert response.headers["Retry-After"] == "7"
+    assert len(database.tables["songs"].rows) == 1
+
+
+def test_create_limit(app, auth_headers, database, pool, settings):
+    settings.set(song_batch_max_items=2)
+
+    response = create(app, auth_headers, [{"title": str(i), "prompt": "p"} for i in range(3)])
+
+    assert response.status_code == 400
+    assert "At most 2" in response.get_json()["error"]
+    assert "songs" not in database.tables
+
+
+@pytest.mark.parametrize("body", [{}, {"songs": []}, {"songs": "one"}])
+def test_create_needs_a_list_of_songs(app, auth_headers, pool, body):
+    response = app.test_client().post("/api/songs/batch", json=body, headers=auth_headers)
+
+    assert response.status_code == 400
+
+
+def _song(user_id):
+    return {"id": str(uuid.uuid4()), "user_id": user_id, "title": "t", "prompt": "p", "max_tokens": 8}
+
+
+def delete(app, auth_headers, ids):
+    return app.test_client().delete("/api/songs/batch", json={"ids": ids}, headers=auth_headers)
+
+
+def test_delete_only_removes_the_users_own_songs(app, auth_headers, database, user):
+    mine = [_song(user["id"]), _song(user["id"])]
+    theirs = _song(str(uuid.uuid4()))
+    database.seed("songs", mine + [theirs])
+    ids = [mine[0]["id"], theirs["id"], "not-a-uuid", str(uuid.uuid4()), mine[1]["id"].upper()]
+
+    response = delete(app, auth_headers, ids)
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [(result["id"], result["status"]) for result in body["results"]] == list(zip(ids, [200, 404, 404, 404, 200]))
+    assert (body["deleted"], body["failed"]) == (2, 3)
+    assert set(database.tables["songs"].rows) == {theirs["id"]}
+
+
+def test_delete_limit(app, auth_headers, database, user, settings):
+    settings.set(song_batch_max_items=2)
+    songs = [_song(user["id"]) for _ in range(3)]
+    database.seed("songs", songs)
+
+    response = delete(app, auth_headers, [song["id"] for song in songs])
+
+    assert response.status_code == 400
+    assert len(database.tables["songs"].rows) == 3
+
+
+@pytest.mark.parametrize("body", [{}, {"ids": []}, {"ids": [1, 2]}])
+def test_delete_needs_a_list_of_ids(app, auth_headers, body):
+    response = app.test_client().delete("/api/songs/batch", json=body, headers=auth_headers)
+
+    assert response.status_code == 400
@@ -0,0 +1,61 @@
+import json
+import time
+
+from services.events import SyncTokenCache
+
+
+def open_stream(app, auth_headers):
+    client = app.test_client()
+    token = client.post("/api/songs/stream-token", headers=auth_headers).get_json()["token"]
+    return client.get(f"/api/songs/events?jwt={token}", buffered=False)
+
+
+def read_events(response, count):
+    events = []
+    for chunk in response.response:
+        events.append(chunk.decode("utf-8"))
+        if len(events) == count:
+            break
+    response.close()
+    return events
+
+
+def test_stream_sends_resync_with_sync_token(app, auth_headers, user, database, settings):
+    settings.set(sse_resync_seconds=1, sse_heartbeat_seconds=30)
+    database.seed("songs", [{
+        "user_id": user["id"], "title": "t", "prompt": "p", "max_tokens": 8,
+        "updated_at": "2026-01-01T00:00:00",
+    }])
+
+    started = time.monotonic()
+    response = open_stream(app, auth_headers)
+    retry, resync = read_events(response, 2)
+
+    assert retry.startswith("retry:")
+    assert resync.startswith("event: resync\n")
+    song_id = next(iter(database.tables["songs"].rows))
+    assert json.loads(resync.split("data: ", 1)[1]) == {"sync_token": f"2026-01-01T00:00:00|{song_id}"}
+    assert time.monotonic() - started < 5
+
+
+def test_stream_without_resync_sends_keep_alive(app, auth_headers, settings):
+    settings.set(sse_resync_seconds=0, sse_heartbeat_seconds=0.2)
+
+    response = open_stream(app, auth_headers)
+    assert read_events(response, 2)[1] == ": keep-alive\n\n"
+
+
+
+def test_sync_token_is_read_once_per_period():
+    cache = SyncTokenCache()
+    reads = []
+
+    def load(user_id):
+        reads.append(user_id)
+        return f"token-{len(reads)}"
+
+    assert [cache.get("u1", 60, load) for _ in range(3)] == ["token-1"] * 3
+    assert cache.get("u2", 60, load) == "token-2"
+    # Past max_age the token is read again
+    assert cache.get("u1", 0, load) == "token-3"
+    assert reads == ["u1", "u2", "u1"]
@@ -0,0 +1,57 @@
+import uuid
+
+import pytest
+
+from services.container import get_services
+
+
+@pytest.fixture
+def songs(database, user):
+    """Seven songs, five of them changed in the same batched write."""
+    rows = []
+    for index in range(7):
+        updated_at = "2026-01-01T00:00:00+00:00" if index < 5 else f"2026-01-01T00:00:0{index}+00:00"
+        rows.append({
+            "id": str(uuid.uuid4()),
+            "user_id": user["id"],
+            "title": f"Song {index}",
+            "prompt": f"song {index}",
+            "max_tokens": 32,
+            "status": "completed",
+            "created_at": "2025-12-31T00:00:00+00:00",
+            "updated_at": updated_at,
+        })
+    database.seed("songs", rows)
+    return rows
+
+
+def test_sync_pages_through_songs_that_share_a_timestamp(songs, user):
+    song_service = get_services().song
+    seen = []
+    token = "2025-12-31T00:00:00+00:00"
+
+    for _ in range(10):
+        changed, token = song_service.get_songs_changed_since(user["id"], token, limit=2)
+        if not changed:
+            break
+        seen.extend(song["id"] for song in changed)
+
+    assert sorted(seen) == sorted(song["id"] for song in songs)
+    assert len(seen) == len(songs)
+
+
+def test_version_token_catches_later_changes(songs, user, database):
+    song_service = get_services().song
+    _, token = song_service.get_songs_version(user["id"])
+
+    assert song_service.get_songs_changed_since(user["id"], token) == ([], token)
+
+    database.seed("songs", [{**songs[0], "id": str(uuid.uuid4()), "updated_at": "2026-01-01T00:01:00+00:00"}])
+    changed, newer = song_service.get_songs_changed_since(user["id"], token)
+    assert len(changed) == 1
+    assert newer > token
+
+
+def test_invalid_token(songs, user):
+    with pytest.raises(ValueError):
+        get_services().song.get_songs_changed_since(user["id"], "yesterday|nope")
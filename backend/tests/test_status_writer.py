@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from tasks.status_writer import StatusWriter
+
+
+class FlakyDatabase:
+    """Fails every update_songs call that includes a song in ``bad``, and
+    the first ``outages`` calls."""
+
+    def __init__(self, bad=(), outages=0):
+        self.bad = set(bad)
+        self.outages = outages
+        self.calls = []
+
+    def rpc(self, function, params):
+        updates = params["updates"]
+        self.calls.append([update["id"] for update in updates])
+        database = self
+
+        class Request:
+            def execute(self):
+                if database.outages > 0:
+                    database.outages -= 1
+                    raise ConnectionError("database unavailable")
+                if any(update["id"] in database.bad for update in updates):
+                    raise ValueError("invalid input syntax")
+                return type("Result", (), {"data": updates})()
+
+        return Request()
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    writers = []
+
+    def make(database, **options):
+        monkeypatch.setattr("tasks.status_writer.get_services", lambda: type("Services", (), {"database": database})())
+        monkeypatch.setattr("tasks.status_writer.time.sleep", lambda seconds: None)
+        writers.append(StatusWriter(flush_interval_ms=10, **options))
+        return writers[-1]
+
+    yield make
+    for created in writers:
+        created.close()
+
+
+def test_retries_a_batch_until_it_goes_through(writer):
+    database = FlakyDatabase(outages=2)
+    status_writer = writer(database, max_attempts=5)
+
+    future = status_writer.write("a", status="completed")
+
+    assert future.result(timeout=5) == {"id": "a", "status": "completed"}
+    assert database.calls == [["a"], ["a"], ["a"]]
+
+
+def test_gives_up_on_rows_that_keep_failing(writer):
+    database = FlakyDatabase(bad={"b"})
+    status_writer = writer(database, max_attempts=2)
+
+    good = status_writer.write("a", status="completed")
+    bad = status_writer.write("b", status="completed")
+
+    assert good.result(timeout=5) == {"id": "a", "status": "completed"}
+    with pytest.raises(ValueError):
+        bad.result(timeout=5)
+    assert database.calls == [["a", "b"], ["a", "b"], ["a"], ["b"]]
+    assert status_writer.flush(timeout=5)
+
+
+
+def test_slow_callbacks_do_not_hold_up_flushes(writer):
+    database = FlakyDatabase()
+    status_writer = writer(database)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow(future):
+        started.set()
+        release.wait(5)
+
+    status_writer.write("a", status="completed").add_done_callback(slow)
+    assert started.wait(5)
+    try:
+        # Stored while a's callback is still running
+        status_writer.write("b", status="completed")
+        deadline = time.monotonic() + 5
+        while ["b"] not in database.calls and time.monotonic() < deadline:
+            # time.sleep is patched out by the fixture
+            release.wait(0.01)
+        assert database.calls == [["a"], ["b"]]
+    finally:
+        release.set()
+    assert status_writer.flush(timeout=5)
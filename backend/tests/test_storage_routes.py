@@ -0,0 +1,74 @@
+import os
+import uuid
+
+import pytest
+
+from config import get_settings
+
+
+@pytest.fixture
+def stored():
+    """Writes a blob into local storage and returns its name."""
+    def store(name, data=b"0123456789" * 100):
+        path = os.path.join(get_settings().local_storage_path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return name
+    return store
+
+
+def test_range_request(app, stored):
+    name = stored(f"{uuid.uuid4()}.wav")
+
+    response = app.test_client().get(f"/storage/{name}", headers={"Range": "bytes=10-19"})
+
+    assert response.status_code == 206
+    assert response.data == b"0123456789"
+    assert response.headers["Content-Range"] == "bytes 10-19/1000"
+    assert response.headers["Content-Type"] == "audio/wav"
+
+
+def test_conditional_get(app, stored):
+    name = stored(f"{uuid.uuid4()}.wav")
+    client = app.test_client()
+
+    first = client.get(f"/storage/{name}")
+    assert first.status_code == 200
+    assert "immutable" in first.headers["Cache-Control"]
+
+    again = client.get(f"/storage/{name}", headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert again.data == b""
+
+
+def test_mutable_names_are_revalidated(app, stored):
+    name = stored("cover art.wav")
+
+    response = app.test_client().get(f"/storage/{name}")
+
+    assert response.status_code == 200
+    assert "no-cache" in response.headers["Cache-Control"]
+
+
+def test_accel_redirect(app, stored, settings):
+    settings.set(storage_accel_redirect_prefix="/protected-storage/")
+    name = stored(f"anonymous/{uuid.uuid4()}.mp3")
+
+    response = app.test_client().get(f"/storage/{name}")
+
+    assert response.status_code == 200
+    assert response.headers["X-Accel-Redirect"] == f"/protected-storage/{name}"
+    assert response.headers["Content-Type"] == "audio/mpeg"
+    assert response.data == b""
+
+
+@pytest.mark.parametrize("path", ["private/profiles/x/meta.json", "anonymous/../private/profiles/x/meta.json"])
+def test_private_blobs_are_not_served(app, stored, path):
+    stored("private/profiles/x/meta.json", b"{}")
+
+    assert app.test_client().get(f"/storage/{path}").status_code == 404
+
+
+def test_missing_blob(app):
+    assert app.test_client().get(f"/storage/{uuid.uuid4()}.wav").status_code == 404
@@ -1,5 +1,6 @@
 import React from 'react';
 import { Link } from 'react-router-dom';
+import { audioSources } from '../services/audioFormats';
 
 const SongCard = ({ song }) => {
   const getStatusBadge = () => {
@@ -49,7 +50,9 @@ const SongCard = ({ song }) => {
             className="w-full"
             aria-label={`Audio player for ${song.title}`}
           >
-            <source src={song.gcs_url} type="audio/wav" />
+            {audioSources(song).map((source) => (
+              <source key={source.name} src={source.src} type={source.type} />
+            ))}
             Your browser does not support the audio element.
           </audio>
         </div>
@@ -27,6 +27,15 @@ const CreateSong = () => {
     });
   };
 
+  // Long-poll the job until it finishes; each request is held server-side
+  const waitForAnonymousJob = async (job) => {
+    while (job.status !== 'completed' && job.status !== 'failed') {
+      const response = await songAPI.getAnonymousJob(job.id, 25);
+      job = response.data.job;
+    }
+    return job;
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     setError('');
@@ -56,11 +65,17 @@ const CreateSong = () => {
         };
 
         const response = await songAPI.createAnonymousSong(payload);
-        setDownloadUrl(response.data.download_url);
+        const job = await waitForAnonymousJob(response.data.job);
+
+        if (job.status === 'failed') {
+          throw new Error(job.error_message || 'Failed to generate song');
+        }
+
+        setDownloadUrl(job.download_url);
         setSuccess(true);
       }
     } catch (err) {
-      setError(err.response?.data?.error || 'Failed to create song. Please try again.');
+      setError(err.response?.data?.error || err.message || 'Failed to create song. Please try again.');
     } finally {
       setLoading(false);
     }
@@ -1,7 +1,8 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import Layout from '../components/Layout';
-import { songAPI } from '../services/api';
+import { songAPI, subscribeToSongEvents } from '../services/api';
+import { audioSources } from '../services/audioFormats';
 
 const SongDetails = () => {
   const { id } = useParams();
@@ -12,13 +13,59 @@ const SongDetails = () => {
   const [editing, setEditing] = useState(false);
   const [editData, setEditData] = useState({ title: '', description: '' });
   const [deleting, setDeleting] = useState(false);
+  const [previewUrl, setPreviewUrl] = useState(null);
+  const syncToken = useRef(null);
 
   useEffect(() => {
+    let interval = null;
+
     loadSong();
-    const interval = setInterval(loadSong, 5000);
-    return () => clearInterval(interval);
+    const unsubscribe = subscribeToSongEvents({
+      songId: id,
+      onSong: setSong,
+      // Reload when any of the user's songs changed, possibly in another process
+      onResync: (token) => {
+        if (token !== syncToken.current) {
+          syncToken.current = token;
+          loadSong();
+        }
+      },
+      onReconnect: loadSong,
+      onFallback: () => {
+        if (!interval) {
+          interval = setInterval(loadSong, 5000);
+        }
+      },
+    });
+
+    return () => {
+      unsubscribe();
+      if (interval) {
+        clearInterval(interval);
+      }
+    };
   }, [id]);
 
+  // The live preview URL needs a stream token, fetched while the song is processing
+  useEffect(() => {
+    if (song?.status !== 'processing') {
+      setPreviewUrl(null);
+      return undefined;
+    }
+
+    let cancelled = false;
+    songAPI.getStreamToken()
+      .then((response) => {
+        if (!cancelled) {
+          setPreviewUrl(songAPI.getStreamUrl(id, response.data.token));
+        }
+      })
+      .catch(() => {});
+    return () => {
+      cancelled = true;
+    };
+  }, [id, song?.status]);
+
   const loadSong = async () => {
     try {
       const response = await songAPI.getSong(id);
@@ -184,6 +231,20 @@ const SongDetails = () => {
             </div>
           </div>
 
+          {song.status === 'processing' && previewUrl && (
+            <div className="mb-6">
+              <p className="text-sm font-medium text-gray-700 mb-2">Live Preview</p>
+              <audio
+                controls
+                className="w-full"
+                src={previewUrl}
+                aria-label={`Live preview of ${song.title} while it is generated`}
+              >
+                Your browser does not support the audio element.
+              </audio>
+            </div>
+          )}
+
           {song.gcs_url && (
             <div className="mb-6">
               <p className="text-sm font-medium text-gray-700 mb-2">Generated Audio</p>
@@ -192,17 +253,24 @@ const SongDetails = () => {
                 className="w-full"
                 aria-label={`Audio player for ${song.title}`}
               >
-                <source src={song.gcs_url} type="audio/wav" />
+                {audioSources(song).map((source) => (
+                  <source key={source.name} src={source.src} type={source.type} />
+                ))}
                 Your browser does not support the audio element.
               </audio>
-              <a
-                href={song.gcs_url}
-                download
-                className="mt-3 inline-block btn-secondary text-sm"
-                aria-label={`Download ${song.title}`}
-              >
-                Download
-              </a>
+              <div className="mt-3 flex flex-wrap gap-2">
+                {audioSources(song).map((source) => (
+                  <a
+                    key={source.name}
+                    href={source.src}
+                    download
+                    className="inline-block btn-secondary text-sm"
+                    aria-label={`Download ${song.title} as ${source.label}`}
+                  >
+                    Download {source.label}
+                  </a>
+                ))}
+              </div>
             </div>
           )}
 
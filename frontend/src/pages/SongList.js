@@ -1,27 +1,57 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import Layout from '../components/Layout';
 import SongCard from '../components/SongCard';
-import { songAPI } from '../services/api';
+import { songAPI, subscribeToSongEvents } from '../services/api';
 import { useAuth } from '../context/AuthContext';
 
 const SongList = () => {
   const [songs, setSongs] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const syncToken = useRef(null);
   const navigate = useNavigate();
   const { user } = useAuth();
 
   useEffect(() => {
+    let interval = null;
+
     loadSongs();
-    const interval = setInterval(loadSongs, 5000);
-    return () => clearInterval(interval);
+    const unsubscribe = subscribeToSongEvents({
+      onSong: (song) => mergeSongs([song]),
+      onResync: (token) => {
+        // Tokens start with a timestamp, so they compare in order; an older
+        // one only means a song was deleted
+        if (token && (!syncToken.current || token > syncToken.current)) {
+          syncSongs();
+        }
+      },
+      // Catch up in place, so the pages already loaded stay loaded
+      onReconnect: () => syncSongs({ catchUp: true }),
+      onFallback: () => {
+        if (!interval) {
+          interval = setInterval(syncSongs, 5000);
+        }
+      },
+    });
+
+    return () => {
+      unsubscribe();
+      if (interval) {
+        clearInterval(interval);
+      }
+    };
   }, []);
 
+  // Reloads the first page; older pages are fetched on demand
   const loadSongs = async () => {
     try {
       const response = await songAPI.getSongs();
       setSongs(response.data.songs);
+      setNextCursor(response.data.next_cursor);
+      syncToken.current = response.data.sync_token;
       setError('');
     } catch (err) {
       setError('Failed to load songs');
@@ -30,6 +60,53 @@ const SongList = () => {
     }
   };
 
+  const mergeSongs = (changed) => {
+    setSongs((current) => {
+      const updated = current.map((s) => changed.find((song) => song.id === s.id) || s);
+      const added = changed.filter((song) => !current.some((s) => s.id === song.id));
+      return [...added.reverse(), ...updated];
+    });
+  };
+
+  // Only fetch songs changed since the last sync. With catchUp, keep
+  // fetching until there are no more changes, e.g. after being disconnected
+  const syncSongs = async ({ catchUp = false } = {}) => {
+    if (!syncToken.current) {
+      loadSongs();
+      return;
+    }
+
+    try {
+      do {
+        const response = await songAPI.getSongChanges(syncToken.current);
+        if (response.status === 304) {
+          break;
+        }
+        mergeSongs(response.data.songs);
+        syncToken.current = response.data.sync_token;
+      } while (catchUp);
+      setError('');
+    } catch (err) {
+      setError('Failed to load songs');
+    }
+  };
+
+  const loadMoreSongs = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await songAPI.getSongs({ cursor: nextCursor });
+      setSongs((current) => [
+        ...current,
+        ...response.data.songs.filter((song) => !current.some((s) => s.id === song.id)),
+      ]);
+      setNextCursor(response.data.next_cursor);
+    } catch (err) {
+      setError('Failed to load more songs');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   if (loading) {
     return (
       <Layout>
@@ -79,11 +156,25 @@ const SongList = () => {
             </button>
           </div>
         ) : (
-          <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
-            {songs.map((song) => (
-              <SongCard key={song.id} song={song} />
-            ))}
-          </div>
+          <>
+            <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
+              {songs.map((song) => (
+                <SongCard key={song.id} song={song} />
+              ))}
+            </div>
+            {nextCursor && (
+              <div className="mt-8 text-center">
+                <button
+                  onClick={loadMoreSongs}
+                  disabled={loadingMore}
+                  className="btn-secondary"
+                  aria-busy={loadingMore}
+                >
+                  {loadingMore ? 'Loading...' : 'Load More'}
+                </button>
+              </div>
+            )}
+          </>
         )}
       </div>
     </Layout>
@@ -42,10 +42,98 @@ export const authAPI = {
 export const songAPI = {
   createSong: (data) => api.post('/songs', data),
   createAnonymousSong: (data) => api.post('/songs/anonymous', data),
-  getSongs: () => api.get('/songs'),
+  getAnonymousJob: (jobId, wait = 0) => api.get(`/songs/anonymous/${jobId}`, { params: { wait } }),
+  getSongs: (params = {}) => api.get('/songs', { params }),
+  // Resolves with status 304 when nothing changed since the sync token
+  getSongChanges: (since) => api.get('/songs', {
+    params: { updated_since: since },
+    validateStatus: (status) => status === 304 || (status >= 200 && status < 300),
+  }),
   getSong: (id) => api.get(`/songs/${id}`),
   updateSong: (id, data) => api.put(`/songs/${id}`, data),
   deleteSong: (id) => api.delete(`/songs/${id}`),
+  // Event and audio streams cannot send headers, so their URLs carry a
+  // short-lived token that only works for streams, never the access token
+  getStreamToken: () => api.post('/songs/stream-token'),
+  getStreamUrl: (id, streamToken) => `${API_BASE_URL}/songs/${id}/stream?jwt=${streamToken}`,
+};
+
+const RECONNECT_DELAY_MS = 3000;
+
+// Streams song status changes over server-sent events. Calls onFallback if
+// the browser lacks EventSource or the server refuses the stream, so callers
+// can go back to polling. onResync receives the user's current sync token
+// every few seconds; changes made by other server processes only show up
+// there. Returns a function that closes the stream.
+export const subscribeToSongEvents = ({ songId, onSong, onResync, onReconnect, onFallback }) => {
+  if (!window.EventSource || !localStorage.getItem('access_token')) {
+    onFallback();
+    return () => {};
+  }
+
+  let source = null;
+  let closed = false;
+  let connectedBefore = false;
+
+  // Stream tokens expire quickly, so every connection asks for a new one
+  // instead of letting EventSource retry the same URL
+  const connect = async () => {
+    let streamToken;
+    try {
+      streamToken = (await songAPI.getStreamToken()).data.token;
+    } catch (err) {
+      if (!closed) {
+        onFallback();
+      }
+      return;
+    }
+    if (closed) {
+      return;
+    }
+
+    const params = new URLSearchParams({ jwt: streamToken });
+    if (songId) {
+      params.set('song_id', songId);
+    }
+
+    source = new EventSource(`${API_BASE_URL}/songs/events?${params}`);
+    let opened = false;
+
+    source.onopen = () => {
+      // Events may have been missed while disconnected
+      if (connectedBefore && onReconnect) {
+        onReconnect();
+      }
+      opened = true;
+      connectedBefore = true;
+    };
+    source.onmessage = (event) => onSong(JSON.parse(event.data));
+    source.addEventListener('resync', (event) => {
+      if (onResync) {
+        onResync(JSON.parse(event.data).sync_token);
+      }
+    });
+    source.onerror = () => {
+      source.close();
+      if (closed) {
+        return;
+      }
+      if (opened) {
+        setTimeout(connect, RECONNECT_DELAY_MS);
+      } else {
+        // The server refused the stream
+        onFallback();
+      }
+    };
+  };
+
+  connect();
+  return () => {
+    closed = true;
+    if (source) {
+      source.close();
+    }
+  };
 };
 
 export const paymentAPI = {
@@ -0,0 +1,20 @@
+// Smallest first: the browser plays the first source it supports
+const FORMAT_TYPES = [
+  ['opus', 'audio/ogg; codecs=opus', 'Opus'],
+  ['mp3', 'audio/mpeg', 'MP3'],
+  ['flac', 'audio/flac', 'FLAC'],
+  ['wav16', 'audio/wav', 'WAV'],
+];
+
+export const audioSources = (song) => {
+  const formats = song.audio_formats || {};
+  const sources = FORMAT_TYPES
+    .filter(([name]) => formats[name])
+    .map(([name, type, label]) => ({ name, src: formats[name], type, label }));
+
+  if (song.gcs_url) {
+    sources.push({ name: 'original', src: song.gcs_url, type: 'audio/wav', label: 'Original WAV' });
+  }
+
+  return sources;
+};